@@ -146,7 +146,7 @@ def retry(tries, delay=3, backoff=2):
     return f_retry # true decorator -> decorated function
   return deco_retry  # @retry(arg[, ...]) -> true decorator
 
-def retry_http(tries, backoff=2, on_failure='error'):
+def retry_http(tries, backoff=2, on_failure='error', timeout_arg=None):
     """
     Retry a function or method reading from the internet until no socket or IOError
     is raised
@@ -154,6 +154,12 @@ def retry_http(tries, backoff=2, on_failure='error'):
     delay sets the initial delay, and backoff sets how much the delay should
     lengthen after each failure. backoff must be greater than 1, or else it
     isn't really a backoff. tries must be at least 0, and delay greater than 0.
+
+    By default, the delay is set as the global socket timeout. If
+    timeout_arg is given, the delay is instead passed to the function as the
+    keyword argument with that name on every try, and the global timeout is
+    left alone. Use this for functions that are called from several threads
+    at once.
     """
     delay = socket.getdefaulttimeout()
     o_delay = socket.getdefaulttimeout()
@@ -164,7 +170,11 @@ def retry_http(tries, backoff=2, on_failure='error'):
     if tries < 0:
       raise ValueError("tries must be 0 or greater")
 
-    if delay <= 0:
+    if delay is None:
+      #-- no global timeout set: start retrying with a default one, but leave
+      #   the global setting untouched until a connection actually fails
+      delay = 15.
+    elif delay <= 0:
       delay = 15.
       o_delay = 15.
       socket.setdefaulttimeout(delay)
@@ -173,19 +183,23 @@ def retry_http(tries, backoff=2, on_failure='error'):
     def deco_retry(f):
       def f_retry(*args, **kwargs):
         mtries, mdelay = tries, delay # make mutable
+        msg = None
 
         while mtries > 0:
+          if timeout_arg is not None:
+              kwargs[timeout_arg] = mdelay
           try:
               rv = f(*args, **kwargs) # Try again
-          except IOError as msg:
-              rv = False
-          except socket.error:
-              rv = False
+          except IOError as error:
+              rv, msg = False, error
+          except socket.error as error:
+              rv, msg = False, error
 
           if rv != False: # Done on success
             return rv
           mtries -= 1      # consume an attempt
-          socket.setdefaulttimeout(mdelay) # wait...
+          if timeout_arg is None:
+              socket.setdefaulttimeout(mdelay) # wait...
           mdelay *= backoff  # make future wait longer
           logger.error("URL timeout: %d attempts remaining (delay=%.1fs)"%(mtries,mdelay))
         logger.critical("URL timeout: number of trials exceeded")
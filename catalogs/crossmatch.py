@@ -21,6 +21,7 @@ from ivs.catalogs import sesame
 from ivs.aux import numpy_ext
 from ivs.aux import loggers
 from ivs.aux import argkwargparser
+from ivs.inout import http
 
 from scipy.spatial import KDTree
 
@@ -102,30 +103,32 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
     if exclude is not None:
         searchables = list( set(searchables)- set(exclude))
 
-    #-- and search photometry
+    #-- and search photometry: all sources are queried concurrently, each
+    #   delivering its own part of the master record. The parts are combined
+    #   in a fixed order (MAST, GATOR, ViZieR, GCPD), so that the result does
+    #   not depend on which query finished first.
+    master = kwargs.pop('master',None)
+    jobs = []
     if 'mast' in searchables:
-        kwargs['master'] = mast.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+        jobs.append((mast.get_photometry,(),dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
     if 'gator' in searchables:
-        kwargs['master'] = gator.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
+        jobs.append((gator.get_photometry,(),dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
     if 'vizier' in searchables:
         #-- first query catalogs that can only be queried via HD number
-        info = sesame.search(ID=ID,fix=True)
-        if 'alias' in info:
-            HDnumber = [name for name in info['alias'] if name[:2]=='HD']
-            if HDnumber:
-                kwargs['master'] = vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
+        jobs.append((_get_vizier_photometry_HD,(ID,),dict(extra_fields=extra_fields,**kwargs)))
         #-- then query catalogs that can only be queried via another catalog
-        results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
-        if results is not None:
-            catname = results[0]['Name'].strip()
-            kwargs['master'] = vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
+        jobs.append((_get_vizier_photometry_xid,(ID,),dict(extra_fields=extra_fields,**kwargs)))
         #-- then query normal catalogs
-        kwargs['master'] = vizier.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-
-
+        jobs.append((vizier.get_photometry,(),dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
     if 'gcpd' in searchables:
-        kwargs['master'] = gcpd.get_photometry(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)
-    master = kwargs['master']
+        jobs.append((gcpd.get_photometry,(),dict(ID=ID,to_units=to_units,extra_fields=extra_fields,**kwargs)))
+
+    for part in http.map_concurrent(jobs):
+        if part is None: continue
+        if master is None:
+            master = part
+        else:
+            master = numpy_ext.recarr_addrows(master,part.tolist())
 
     #-- now make a summary of the contents:
     photbands = [phot.split('.')[0]  for phot in master['photband']]
@@ -134,6 +137,39 @@ def get_photometry(ID=None,to_units='erg/s/cm2/AA',extra_fields=[],include=None,
         logger.info('%10s: found %d measurements'%phot)
     return master
 
+def _get_vizier_photometry_HD(ID,extra_fields=[],**kwargs):
+    """
+    Collect photometry from ViZieR catalogs that can only be queried via the
+    HD number of a target.
+
+    @param ID: the target's name, understandable by SIMBAD
+    @type ID: str
+    @return: record array where eacht entry is a photometric measurement, or
+    None if no HD number or no photometry is found
+    @rtype: record array
+    """
+    info = sesame.search(ID=ID,fix=True)
+    if 'alias' in info:
+        HDnumber = [name for name in info['alias'] if name[:2]=='HD']
+        if HDnumber:
+            return vizier.get_photometry(extra_fields=extra_fields,constraints=['HD=%s'%(HDnumber[0][3:])],sources=['II/83/catalog','V/33/phot'],sort=None,**kwargs)
+
+def _get_vizier_photometry_xid(ID,extra_fields=[],**kwargs):
+    """
+    Collect photometry from ViZieR catalogs that can only be queried via the
+    name of the target in another catalog (J/A+A/380/609).
+
+    @param ID: the target's name, understandable by SIMBAD
+    @type ID: str
+    @return: record array where eacht entry is a photometric measurement, or
+    None if no photometry is found
+    @rtype: record array
+    """
+    results,units,comms = vizier.search('J/A+A/380/609/table1',ID=ID)
+    if results is not None:
+        catname = results[0]['Name'].strip()
+        return vizier.get_photometry(take_mean=True,extra_fields=extra_fields,constraints=['Name={0}'.format(catname)],sources=['J/A+A/380/609/table{0}'.format(tnr) for tnr in range(2,5)],sort=None,**kwargs)
+
 def add_bibcodes(master):
     """
     Add bibcodes to a master record.
@@ -3,6 +3,7 @@
 Interface to the GATOR search engine
 """
 import os
+import hashlib
 import urllib.request, urllib.parse, urllib.error
 import logging
 import configparser
@@ -10,6 +11,9 @@ import numpy as np
 
 from ivs.aux import loggers
 from ivs.aux import numpy_ext
+from ivs.inout import ascii
+from ivs.inout import http
+from ivs.catalogs import vizier
 from ivs.sed import filters
 from ivs.units import conversions
 
@@ -25,6 +29,9 @@ cat_info = configparser.ConfigParser()
 cat_info.optionxform = str # make sure the options are case sensitive
 cat_info.readfp(open(os.path.join(basedir,'gator_cats_phot.cfg')))
 
+#-- URL of the query interface
+query_url = 'http://irsa.ipac.caltech.edu/cgi-bin/Gator/nph-query'
+
 
 #{ Basic interfaces
 
@@ -73,8 +80,7 @@ def search(catalog,**kwargs):
     #-- gradually build URI
     base_url = _get_URI(catalog,**kwargs)
     #-- prepare to open URI
-    url = urllib.request.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    filen,url = http.retrieve(base_url,filename=filename)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying GATOR source %s and downloading to %s'%(catalog,filen))
@@ -95,6 +101,49 @@ def search(catalog,**kwargs):
 
 
 
+def search_batch(catalog,ra,dec,radius=1.,chunk_size=500):
+    """
+    Search a Gator catalog around a list of positions.
+
+    Instead of querying every target separately, the positions are uploaded to
+    Gator as a target table, in chunks of C{chunk_size} targets per request.
+    The chunks are queried concurrently. All rows returned for all targets are
+    collected in one record array, with the index of the target (starting
+    from 1) in the column C{cntr_01}: use L{ivs.catalogs.vizier.split_targets}
+    (with C{ra_col='ra'}, C{dec_col='dec'}, C{r_col='dist'} and
+    C{q_col='cntr_01'}) to assign them to the individual targets.
+
+    @param catalog: name of a GATOR catalog (e.g. 'II/246/out')
+    @type catalog: str
+    @param ra: right ascensions of the targets (degrees)
+    @type ra: array
+    @param dec: declinations of the targets (degrees)
+    @type dec: array
+    @param radius: search radius around each target (arcseconds)
+    @type radius: float
+    @param chunk_size: maximum number of targets per request
+    @type chunk_size: int
+    @return: catalog data columns, units, comments
+    @rtype: record array, dict, list of str
+    """
+    ra,dec = np.atleast_1d(ra),np.atleast_1d(dec)
+    starts = list(range(0,len(ra),chunk_size))
+    jobs = [(_search_chunk,(catalog,ra[start:start+chunk_size],dec[start:start+chunk_size],radius),{}) for start in starts]
+    chunks = []
+    for start,chunk in zip(starts,http.map_concurrent(jobs)):
+        if chunk[0] is None: continue
+        #-- the target indices are counted per chunk
+        if 'cntr_01' in chunk[0].dtype.names:
+            chunk[0]['cntr_01'] += start
+        chunks.append(chunk)
+    if not chunks:
+        return None,{},[]
+    results = np.rec.array(np.hstack([chunk[0] for chunk in chunks]))
+    units,comms = chunks[0][1],chunks[0][2]
+    logger.info('Querying GATOR source %s for %d targets (%d)'%(catalog,len(ra),len(results)))
+    return results,units,comms
+
+
 def list_catalogs():
     """
     Return a list of all availabe GATOR catalogues.
@@ -145,41 +194,17 @@ def get_photometry(ID=None,extra_fields=['dist','ra','dec'],**kwargs):
     to_units = kwargs.pop('to_units','erg/s/cm2/AA')
     master_ = kwargs.get('master',None)
     master = None
-    #-- retrieve all measurements
-    for source in cat_info.sections():
-        results,units,comms = search(source,**kwargs)
+    #-- retrieve all measurements: the queries are sent concurrently, but
+    #   the results are combined in the order of the sources
+    sources = cat_info.sections()
+    queries = http.map_concurrent([(search,(source,),kwargs) for source in sources])
+    for source,(results,units,comms) in zip(sources,queries):
         if results is not None:
             master = gator2phot(source,results,units,master,extra_fields=extra_fields)
 
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','U50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        zp = filters.get_info(master['photband'])
-        for i in range(len(master)):
-            try:
-                value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
-            except ValueError: # calibrations not available
-                value,e_value = np.nan,np.nan
-            except AssertionError: # the error or flux must be positive number
-                value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = _convert_master(master,to_units)
 
     if master_ is not None and master is not None:
         master = numpy_ext.recarr_addrows(master_,master.tolist())
@@ -190,6 +215,54 @@ def get_photometry(ID=None,extra_fields=['dist','ra','dec'],**kwargs):
     return master
 
 
+def get_photometry_batch(ra,dec,ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],radius=1.,**kwargs):
+    """
+    Download all available photometry for a list of targets.
+
+    This is the multi-target version of L{get_photometry}: for each catalog,
+    the whole target list is queried at once via L{search_batch}, and the rows
+    are assigned to their target. The result is a list with one master
+    record array per target (or None if nothing was found), identical in
+    layout to the output of L{get_photometry}.
+
+    @param ra: right ascensions of the targets (degrees)
+    @type ra: array
+    @param dec: declinations of the targets (degrees)
+    @type dec: array
+    @param ID: names of the targets (only used for logging)
+    @type ID: list of str
+    @param radius: search radius around each target (arcseconds)
+    @type radius: float
+    @return: master record array per target
+    @rtype: list of record arrays
+    """
+    ra,dec = np.atleast_1d(ra).astype(float),np.atleast_1d(dec).astype(float)
+    if ID is None:
+        ID = ['%.5f%+.5f'%(ira,idec) for ira,idec in zip(ra,dec)]
+    to_units = kwargs.pop('to_units','erg/s/cm2/AA')
+    chunk_size = kwargs.pop('chunk_size',500)
+    sources = cat_info.sections()
+    masters = [None]*len(ra)
+    #-- retrieve all measurements: the catalogs are queried concurrently, but
+    #   the results are combined in the order of the sources
+    queries = http.map_concurrent([(search_batch,(source,ra,dec,radius),dict(chunk_size=chunk_size)) for source in sources])
+    for source,(results,units,comms) in zip(sources,queries):
+        if results is None: continue
+        per_target = vizier.split_targets(results,ra,dec,radius,ra_col='ra',
+                                          dec_col='dec',r_col='dist',q_col='cntr_01',units=units)
+        for i,rows in enumerate(per_target):
+            if rows is None: continue
+            masters[i] = gator2phot(source,rows,units,masters[i],extra_fields=extra_fields)
+    #-- convert the measurement to a common unit.
+    for i in range(len(masters)):
+        if masters[i] is None:
+            logger.info('%s: no photometry found'%(ID[i]))
+            continue
+        if to_units:
+            masters[i] = _convert_master(masters[i],to_units)
+        logger.info('%s: found %d measurements'%(ID[i],len(masters[i])))
+    return masters
+
 #}
 
 #{ Convenience functions
@@ -204,39 +277,25 @@ def txt2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    ff = open(filename,'r')
+    with open(filename,'r') as ff:
+        lines = ff.read().split('\n')
     data = []
     comms = []
     indices = None
-    while 1:  # might call read several times for a file
-        line = ff.readline()
-        if not line: break  # end of file
-
-        #-- strip return character from line
-        if line.isspace():
-            continue # empty line
-
-        #-- remove return characters
-        line = line.replace('\n','')
-        #-- when reading a comment line
-        if line[0] =='\\':
-            continue # treat next line
+    for line in lines:
+        #-- skip empty lines and comment lines
+        if not line or line.isspace() or line[0]=='\\':
+            continue
         if line[0] == '|':
             comms.append(line)
-            indices = []
-            for i in range(len(line)):
-                if line[i]=='|': indices.append(i)
+            indices = [i for i,char in enumerate(line) if char=='|']
             continue
         if indices is None: break
-        data.append([])
-        for i in range(len(indices)-1):
-            data[-1].append(line[indices[i]:indices[i+1]].strip())
+        data.append(line)
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if comms:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
         #-- retrieve the format of the columns. They are given in the
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
@@ -251,23 +310,19 @@ def txt2recarray(filename):
         units_ = [head.strip() for head in comms[2].split('|')[1:-1]]
         #-- define dtypes for record array
         dtypes = np.dtype([(i,j) for i,j in zip(names,formats)])
-        #-- remove spaces or empty values
-        cols = []
         for i,key in enumerate(names):
             units[key] = units_[i]
-            if len(data)==0: break
-            col = data[:,i]
-            #-- fill empty or null values with nan
-            col = [(row.isspace() or not row or row=='null') and 'nan' or row for row in col]
-            cols.append(col)
-
-        #-- define columns for record array and construct record array
-        if len(data)==0:
-            results = None
-        else:
-            cols = np.array(cols)
-            cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-            results = np.rec.array(cols, dtype=dtypes)
+        #-- cut the data lines in columns, and fill empty or null values
+        #   with nan
+        if data:
+            data = ascii.fixwidth2array(data,indices)
+            cols = []
+            for i,key in enumerate(names):
+                col = data[:,i]
+                if dtypes[i].kind=='U':
+                    col = np.char.strip(col)
+                cols.append(ascii.str2column(col,dtypes[i],null_values=('null',)))
+            results = np.rec.fromarrays(cols,dtype=dtypes)
     return results,units,comms
 
 
@@ -395,7 +450,7 @@ def _get_URI(name,ID=None,ra=None,dec=None,radius=1.,filetype='1',spatial='cone'
     @return: url
     @rtype: str
     """
-    base_url = 'http://irsa.ipac.caltech.edu/cgi-bin/Gator/nph-query?'
+    base_url = query_url+'?'
     base_url += 'catalog=%s'%(name)
     #base_url += '&spatial=cone'
 
@@ -434,6 +489,89 @@ def _get_URI(name,ID=None,ra=None,dec=None,radius=1.,filetype='1',spatial='cone'
     return base_url
 
 
+def _search_chunk(catalog,ra,dec,radius):
+    """
+    Query a Gator catalog around a list of positions in one request.
+
+    The target list is uploaded as an IPAC table in a multipart POST request.
+    Gator adds the index of the target (starting from 1 within this chunk) to
+    every row in the column C{cntr_01}, its position in C{ra_01} and
+    C{dec_01}, and the distance to it in C{dist_x}, which is renamed to
+    C{dist} as in a single-target query.
+
+    @return: catalog data columns, units, comments
+    @rtype: record array, dict, list of str
+    """
+    table = ['|%15s|%15s|'%('ra','dec'),'|%15s|%15s|'%('double','double')]
+    table += [' %15.7f %15.7f '%(ira,idec) for ira,idec in zip(ra,dec)]
+    table = '\n'.join(table)+'\n'
+    fields = [('catalog',catalog),('spatial','Upload'),('uradius',str(radius)),
+              ('uradunits','arcsec'),('outfmt','1')]
+    #-- a boundary derived from the contents keeps identical requests
+    #   identical, so that they can be cached
+    boundary = 'ivs'+hashlib.sha1(table.encode('ascii')).hexdigest()
+    body = []
+    for key,value in fields:
+        body += ['--'+boundary,'Content-Disposition: form-data; name="%s"'%(key),'',value]
+    body += ['--'+boundary,'Content-Disposition: form-data; name="filename"; filename="targets.tbl"',
+             'Content-Type: text/plain','',table,'--'+boundary+'--','']
+    body = '\r\n'.join(body).encode('ascii')
+    headers = {'Content-Type':'multipart/form-data; boundary=%s'%(boundary)}
+    filen,url = http.retrieve(query_url,data=body,headers=headers)
+    try:
+        results,units,comms = txt2recarray(filen)
+    finally:
+        url.close()
+    #-- the distance to the target is called 'dist' in single-target queries
+    if results is not None and 'dist_x' in results.dtype.names:
+        names = list(results.dtype.names)
+        names[names.index('dist_x')] = 'dist'
+        results.dtype.names = names
+        units['dist'] = units.pop('dist_x')
+    return results,units,comms
+
+def _convert_master(master,to_units):
+    """
+    Add the converted measurements to a master record array.
+
+    The columns C{cwave}, C{cmeas}, C{e_cmeas} and C{cunit} are added.
+
+    @param master: master record array from gator2phot.
+    @type master: record array
+    @param to_units: units to convert everything to.
+    @type to_units: str
+    @return: master with added columns
+    @rtype: record array
+    """
+    #-- prepare columns to extend to basic master
+    dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','U50')]
+    cols = [[],[],[],[]]
+    #-- forget about 'nan' errors for the moment
+    no_errors = np.isnan(master['e_meas'])
+    master['e_meas'][no_errors] = 0.
+    #-- extend basic master
+    zp = filters.get_info(master['photband'])
+    for i in range(len(master)):
+        try:
+            value,e_value = conversions.convert(master['unit'][i],to_units,master['meas'][i],master['e_meas'][i],photband=master['photband'][i])
+        except ValueError: # calibrations not available
+            value,e_value = np.nan,np.nan
+        except AssertionError: # the error or flux must be positive number
+            value,e_value = np.nan,np.nan
+        try:
+            eff_wave = filters.eff_wave(master['photband'][i])
+        except IOError:
+            eff_wave = np.nan
+        cols[0].append(eff_wave)
+        cols[1].append(value)
+        cols[2].append(e_value)
+        cols[3].append(to_units)
+    master = numpy_ext.recarr_addcols(master,cols,dtypes)
+    #-- reset errors
+    master['e_meas'][no_errors] = np.nan
+    master['e_cmeas'][no_errors] = np.nan
+    return master
+
 #}
 
 if __name__=="__main__":
@@ -131,6 +131,22 @@ again. If a computer does stop running, just restart again with::
 
 and everything should be fine.
 
+Section 5. Hermes index file
+============================
+
+For large archives, the overview can also be kept in an indexed SQLite file
+C{HermesFullDataIndex.sqlite}, created and updated via L{make_data_index}:
+
+>>> index_file = make_data_index(threads='safe')
+
+The FITS headers are read in a pool of worker processes, and only files that
+were added or modified since they were last indexed are read. When the index
+file exists, L{search} uses it instead of the overview file: searches on date,
+program, observing mode and coordinates are then done via indexed lookups in
+the SQLite file, instead of by reading and filtering the whole overview file.
+
+>>> data = search('HD50230',time_range=('2009-9-22','2009-9-30'),obsmode='HRF_OBJ')
+
 @var hermesDir: Path to the directory in which the hermes folders (hermesAnalysis,
                 hermesRun, hermesDebug) are located. By default this is set to
                 '/home/user/'.
@@ -138,6 +154,10 @@ and everything should be fine.
 @var tempDir: Path to temporary directory where files nessessary for hermesVR to run
               can be copied to. You need write permission in this directory. The
               default is set to '/scratch/user/'
+
+@var indexFile: Path to the SQLite index of all Hermes data (see
+                L{make_data_index}). By default, it is located in the Hermes
+                data directory.
 """
 import os
 import sys
@@ -146,6 +166,7 @@ import time
 import shutil
 import logging
 import getpass
+import sqlite3
 import datetime
 import subprocess
 import numpy as np
@@ -155,6 +176,7 @@ import copy
 from lxml import etree
 from xml.etree import ElementTree as ET
 from collections import defaultdict
+from multiprocessing import Pool,cpu_count
 
 from ivs.catalogs import sesame
 from ivs.inout import ascii, fits
@@ -168,6 +190,13 @@ from ivs.spectra import tools as sptools
 
 hermesDir = os.path.expanduser('~/')
 tempDir = '/scratch/%s/'%(getpass.getuser())
+indexFile = os.path.join(config.ivs_dirs['hermes'],'HermesFullDataIndex.sqlite')
+
+#-- columns of the overview file and the index, with their types
+_overview_columns = [('unseq','i'),('prog_id','i'),('obsmode','U20'),('bvcor','f8'),
+                     ('observer','U50'),('object','U50'),('ra','f8'),('dec','f8'),
+                     ('bjd','f8'),('exptime','f8'),('pmtotal','f8'),('date-avg','U30'),
+                     ('airmass','f8'),('filename','U200')]
 
 logger = logging.getLogger("CAT.HERMES")
 logger.addHandler(loggers.NullHandler())
@@ -175,7 +204,7 @@ logger.addHandler(loggers.NullHandler())
 #{ User functions
 
 def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
-           radius=1.,filename=None):
+           radius=1.,filename=None,obsmode=None,index_file=None):
     """
     Retrieve datafiles from the Hermes catalogue.
 
@@ -193,6 +222,9 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     the program. Individual stars are not queried in SIMBAD, so any information
     that is missing in the header will not be corrected.
 
+    B{If C{obsmode} is given}: Only observations made in that instrument mode
+    (e.g. 'HRF_OBJ') are returned.
+
     If you don't give either ID or time_range, the info on all data will be
     returned. This is a huge amount of data, so it can take a while before it
     is returned. Remember that the header of each spectrum is read in and checked.
@@ -204,8 +236,11 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
         4. ext_wavelength: return wavelength merged with cosmics
         5. raw: raw files (also TECH..., i.e. any file in the raw directory)
 
-    This functions needs a C{HermesFullDataOverview.tsv} file located in one
-    of the datadirectories from C{config.py}, and subdirectory C{catalogs/hermes}.
+    If the SQLite index C{index_file} exists (default L{indexFile}, see
+    L{make_data_index}), the search is done via indexed lookups in that file.
+    Otherwise, this functions needs a C{HermesFullDataOverview.tsv} file
+    located in one of the datadirectories from C{config.py}, and subdirectory
+    C{catalogs/hermes}.
 
     If this file does not exist, you can create it with L{make_data_overview}.
 
@@ -281,16 +316,14 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     @type radius: float
     @param filename: write summary to outputfile if not None
     @type filename: str
+    @param obsmode: instrument mode of the observations
+    @type obsmode: str
+    @param index_file: SQLite index of the Hermes data (defaults to L{indexFile})
+    @type index_file: str
     @return: record array with summary information on the observations, as well
     as their location (column 'filename')
     @rtype: numpy rec array
     """
-    #-- read in the data from the overview file, and get SIMBAD information
-    #   of the star
-    ctlFile = '/STER/mercator/hermes/HermesFullDataOverview.tsv'
-    data = ascii.read2recarray(ctlFile, splitchar='\t')
-    #data = ascii.read2recarray(config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv'),splitchar='\t')
-    keep = np.array(np.ones(len(data)),bool)
     #-- confined search within given time range
     if time_range is not None:
         if isinstance(time_range,str):
@@ -298,27 +331,43 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
             time_range = (time_range,time_range+datetime.timedelta(days=1))
         else:
             time_range = (_timestamp2datetime(time_range[0]),_timestamp2datetime(time_range[1]))
-        keep = keep & np.array([(time_range[0]<=_timestamp2datetime(i)<=time_range[1]) for i in data['date-avg']],bool)
-        info = None
-
-
-    #-- search on ID
+    info = None
     if ID is not None:
         info = sesame.search(ID)
-
-        #-- first search on object name only
-        ID = ID.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','')
-        match_names = np.array([objectn.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','') for objectn in data['object']],str)
-        keep_id = [((((ID in objectn) or (objectn in ID)) and len(objectn)) and True or False) for objectn in match_names]
-        keep_id = np.array(keep_id)
-        #   if we found the star on SIMBAD, we use its RA and DEC to match the star
-        if info:
-            ra,dec = info['jradeg'],info['jdedeg']
-            keep_id = keep_id | (np.sqrt((data['ra']-ra)**2 + (data['dec']-dec)**2) < radius/60.)
-        keep = keep & keep_id
-
-    if prog_ID is not None:
-        keep = keep & (data['prog_id']==prog_ID)
+        ID = _match_name(ID)
+
+    if index_file is None:
+        index_file = indexFile
+    #-- look up the data in the index file: all selections are done in SQLite
+    if os.path.isfile(index_file):
+        data = _search_index(index_file,ID=ID,info=info,time_range=time_range,
+                             prog_ID=prog_ID,obsmode=obsmode,radius=radius)
+        keep = np.ones(len(data),bool)
+    #-- or read in the data from the overview file, and select the matching
+    #   observations
+    else:
+        ctlFile = '/STER/mercator/hermes/HermesFullDataOverview.tsv'
+        data = ascii.read2recarray(ctlFile, splitchar='\t')
+        #data = ascii.read2recarray(config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv'),splitchar='\t')
+        keep = np.array(np.ones(len(data)),bool)
+        if time_range is not None:
+            dates = _timestamp2datetime64(data['date-avg'])
+            keep = keep & (np.datetime64(time_range[0])<=dates) & (dates<=np.datetime64(time_range[1]))
+
+        #-- search on ID: first search on object name only
+        if ID is not None:
+            match_names = np.array([_match_name(objectn) for objectn in np.array(data['object'],str)],str)
+            keep_id = [((((ID in objectn) or (objectn in ID)) and len(objectn)) and True or False) for objectn in match_names]
+            keep_id = np.array(keep_id,bool)
+            #   if we found the star on SIMBAD, we use its RA and DEC to match the star
+            if info:
+                keep_id = keep_id | (np.sqrt((data['ra']-info['jradeg'])**2 + (data['dec']-info['jdedeg'])**2) < radius/60.)
+            keep = keep & keep_id
+
+        if prog_ID is not None:
+            keep = keep & (data['prog_id']==prog_ID)
+        if obsmode is not None:
+            keep = keep & (np.array(data['obsmode'],str)==obsmode)
 
     #-- if some data is found, we check if the C{data_type} string is contained
     #   with the file's name. If not, we remove it.
@@ -342,26 +391,28 @@ def search(ID=None,time_range=None,prog_ID=None,data_type='cosmicsremoved_log',
     #-- we now check if the barycentric correction was calculated properly.
     #   If not, we calculate it here, but only if the object was found in
     #   SIMBAD. Else, we have no information on the ra and dec (if bvcorr was
-    #   not calculated, ra and dec are not in the header).
-    for obs in data:
-        if ID is not None and info:
+    #   not calculated, ra and dec are not in the header). The corrections of
+    #   all observations are calculated at once.
+    if ID is not None and info and len(data):
+        ra,dec = info['jradeg'],info['jdedeg']
+        jds = np.zeros(len(data))
+        for i,obs in enumerate(data):
             try:
-                jd  = _timestamp2jd(obs['date-avg'])
+                jds[i] = _timestamp2jd(obs['date-avg'])
             except ValueError:
                 logger.info('Header probably corrupted for unseq {}: no info on time or barycentric correction'.format(obs['unseq']))
-                jd = np.nan
+                jds[i] = np.nan
             # the previous line is equivalent to:
             # day = dateutil.parser.parse(header['DATE-AVG'])
             # BJD = ephem.julian_date(day)
-            bvcorr, hjd = helcorr(ra/360.*24, dec, jd)
-        else:
-            break
-        if np.isnan(obs['bvcor']):
-            logger.info("Corrected 'bvcor' for unseq {} (missing in header)".format(obs['unseq']))
-            obs['bvcor'] = float(bvcorr)
-        if np.isnan(obs['bjd']):
-            logger.info("Corrected 'bjd' for unseq {} (missing in header)".format(obs['unseq']))
-            obs['bjd'] = float(hjd)
+        bvcorrs, hjds = helcorr(ra/360.*24, dec, jds)
+        for obs,bvcorr,hjd in zip(data,bvcorrs,hjds):
+            if np.isnan(obs['bvcor']):
+                logger.info("Corrected 'bvcor' for unseq {} (missing in header)".format(obs['unseq']))
+                obs['bvcor'] = float(bvcorr)
+            if np.isnan(obs['bjd']):
+                logger.info("Corrected 'bjd' for unseq {} (missing in header)".format(obs['unseq']))
+                obs['bjd'] = float(hjd)
 
 
     #-- do we need the information as a file, or as a numpy array?
@@ -1029,7 +1080,7 @@ class HermesCCF(object):
 
 #{ Administrator functions
 
-def make_data_overview():
+def make_data_overview(threads=1):
     """
     Summarize all Hermes data in a file for easy data retrieval.
 
@@ -1060,19 +1111,16 @@ def make_data_overview():
     >>> hermes_file = config.get_datafile(os.path.join('catalogs','hermes'),'HermesFullDataOverview.tsv')
     >>> data = ascii.read2recarray(hermes_file,splitchar='\\t')
 
+    The headers of the new files are read in a pool of C{threads} worker
+    processes.
+
+    @param threads: number of worker processes (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @return: name of the overview file
+    @rtype: str
     """
     logger.info('Collecting files...')
-    #-- all hermes data directories
-    dirs = sorted(glob.glob(os.path.join(config.ivs_dirs['hermes'],'20??????')))
-    dirs = [idir for idir in dirs if os.path.isdir(idir)]
-    obj_files = []
-    #-- collect in those directories the raw and relevant reduced files
-    for idir in dirs:
-        obj_files += sorted(glob.glob(os.path.join(idir,'raw','*.fits')))
-        #obj_files += sorted(glob.glob(os.path.join(idir,'reduced','*OBJ*wavelength_merged.fits')))
-        #obj_files += sorted(glob.glob(os.path.join(idir,'reduced','*OBJ*wavelength_merged_c.fits')))
-        #obj_files += sorted(glob.glob(os.path.join(idir,'reduced','*OBJ*log_merged.fits')))
-        #obj_files += sorted(glob.glob(os.path.join(idir,'reduced','*OBJ*log_merged_c.fits')))
+    obj_files = _collect_raw_files()
 
     #-- keep track of what is already in the file, if it exists:
     try:
@@ -1090,50 +1138,258 @@ def make_data_overview():
         overview_data = {'filename':[]}
         logger.info('Found %d FITS files: starting new overview file %s'%(len(obj_files),overview_file))
 
+    #-- maybe files are already processed: forget about them then
+    existing_files = set(overview_data['filename'])
+    obj_files = [obj_file for obj_file in obj_files if obj_file not in existing_files]
+
     #-- and summarize the contents in a tab separated file (some columns contain spaces)
-    existing_files = np.sort(overview_data['filename'])
-    for i,obj_file in enumerate(obj_files):
+    for i,contents in enumerate(_harvest_headers(obj_files,threads=threads)):
         sys.stdout.write(chr(27)+'[s') # save cursor
         sys.stdout.write(chr(27)+'[2K') # remove line
         sys.stdout.write('Scanning %5d / %5d FITS files'%(i+1,len(obj_files)))
         sys.stdout.flush() # flush to screen
-
-        #-- maybe this file is already processed: forget about it then
-        index = existing_files.searchsorted(obj_file)
-        if index<len(existing_files) and existing_files[index]==obj_file:
-            sys.stdout.write(chr(27)+'[u') # reset cursor
-            continue
-
-        #-- keep track of: UNSEQ, PROG_ID, OBSMODE, BVCOR, OBSERVER,
-        #                  OBJECT, RA, DEC, BJD, EXPTIME, DATE-AVG, PMTOTAL,
-        #                  airmass and filename (not part of fitsheader)
-        contents = dict(unseq=-1,prog_id=-1,obsmode='nan',bvcor=np.nan,observer='nan',
-                        object='nan',ra=np.nan,dec=np.nan,
-                        bjd=np.nan,exptime=np.nan,pmtotal=np.nan,airmass=np.nan,
-                        filename=os.path.realpath(obj_file))
-        contents['date-avg'] = 'nan'
-        header = pf.getheader(obj_file)
-        for key in contents:
-            if key in header and key in ['unseq','prog_id']:
-                try: contents[key] = int(header[key])
-                except: pass
-            elif key in header and key in ['obsmode','observer','object','date-avg']:
-                contents[key] = str(header[key])
-            elif key in header and key in ['ra','dec','exptime','pmtotal','bjd','bvcor']:
-                contents[key] = float(header[key])
-            elif key=='airmass' and 'telalt' in header:
-                if float(header['telalt'])<90:
-                    try:
-                        contents[key] = airmass.airmass(90-float(header['telalt']))
-                    except ValueError:
-                        pass
-
         outfile.write('%(unseq)d\t%(prog_id)d\t%(obsmode)s\t%(bvcor)f\t%(observer)s\t%(object)s\t%(ra)f\t%(dec)f\t%(bjd)f\t%(exptime)f\t%(pmtotal)f\t%(date-avg)s\t%(airmass)f\t%(filename)s\n'%contents)
         outfile.flush()
         sys.stdout.write(chr(27)+'[u') # reset cursor
     outfile.close()
     return overview_file
 
+def make_data_index(index_file=None,threads='safe'):
+    """
+    Summarize all Hermes data in an indexed SQLite file for fast data retrieval.
+
+    The index contains the same columns as the overview file of
+    L{make_data_overview}, together with the Julian Date of C{date-avg}, the
+    object name stripped from spaces and punctuation, and the modification time
+    of every file. The date, declination, program, observing mode and object
+    columns are indexed, so that L{search} does not need to read the whole
+    overview.
+
+    If the index already exists, only the headers of files that were added or
+    modified since they were last indexed are read. The headers are read in a
+    pool of C{threads} worker processes.
+
+    @param index_file: SQLite file (defaults to L{indexFile})
+    @type index_file: str
+    @param threads: number of worker processes (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @return: name of the index file
+    @rtype: str
+    """
+    if index_file is None:
+        index_file = indexFile
+    logger.info('Collecting files...')
+    obj_files = _collect_raw_files()
+
+    connection = sqlite3.connect(index_file,timeout=60.)
+    try:
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS spectra (
+                                  unseq INTEGER, prog_id INTEGER, obsmode TEXT, bvcor REAL,
+                                  observer TEXT, object TEXT, ra REAL, dec REAL, bjd REAL,
+                                  exptime REAL, pmtotal REAL, date_avg TEXT, airmass REAL,
+                                  filename TEXT PRIMARY KEY, jd REAL, match_name TEXT,
+                                  mtime REAL)""")
+            for column in ['jd','dec','prog_id','obsmode','match_name']:
+                connection.execute("CREATE INDEX IF NOT EXISTS {0}_index ON spectra ({0})".format(column))
+            connection.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        #-- only (re)read the files that are new or were modified since they
+        #   were indexed
+        indexed = dict(connection.execute("SELECT filename,mtime FROM spectra"))
+        mtimes = [os.path.getmtime(obj_file) for obj_file in obj_files]
+        new_files = [(obj_file,mtime) for obj_file,mtime in zip(obj_files,mtimes)
+                                      if indexed.get(os.path.realpath(obj_file),-1)<mtime]
+        logger.info('Found %d FITS files: indexing %d new or modified files in %s'%(len(obj_files),len(new_files),index_file))
+
+        columns = [name for name,dtype in _overview_columns]
+        rows = []
+        for contents,(obj_file,mtime) in zip(_harvest_headers([obj_file for obj_file,mtime in new_files],threads=threads),new_files):
+            try:
+                jd = _timestamp2jd(contents['date-avg'])
+            except ValueError:
+                jd = None
+            rows.append([contents[name] for name in columns] + [jd,_match_name(contents['object']),mtime])
+            #-- commit regularly, so that an interrupted update is not lost
+            if len(rows)>=1000:
+                _insert_index_rows(connection,rows)
+                rows = []
+        _insert_index_rows(connection,rows)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO info VALUES ('updated',?)",(datetime.datetime.utcnow().isoformat(),))
+    finally:
+        connection.close()
+    return index_file
+
+def _collect_raw_files():
+    """
+    Collect the raw FITS files in all Hermes data directories.
+
+    @return: sorted list of filenames
+    @rtype: list of str
+    """
+    #-- all hermes data directories
+    dirs = sorted(glob.glob(os.path.join(config.ivs_dirs['hermes'],'20??????')))
+    dirs = [idir for idir in dirs if os.path.isdir(idir)]
+    obj_files = []
+    #-- collect in those directories the raw and relevant reduced files
+    for idir in dirs:
+        obj_files += sorted(glob.glob(os.path.join(idir,'raw','*.fits')))
+    return obj_files
+
+def _read_header_contents(obj_file):
+    """
+    Extract the overview information from the header of a Hermes FITS file.
+
+    Keeps track of: UNSEQ, PROG_ID, OBSMODE, BVCOR, OBSERVER, OBJECT, RA, DEC,
+    BJD, EXPTIME, DATE-AVG, PMTOTAL, airmass and filename (not part of
+    fitsheader).
+
+    @param obj_file: FITS file
+    @type obj_file: str
+    @return: header information
+    @rtype: dict
+    """
+    contents = dict(unseq=-1,prog_id=-1,obsmode='nan',bvcor=np.nan,observer='nan',
+                    object='nan',ra=np.nan,dec=np.nan,
+                    bjd=np.nan,exptime=np.nan,pmtotal=np.nan,airmass=np.nan,
+                    filename=os.path.realpath(obj_file))
+    contents['date-avg'] = 'nan'
+    header = pf.getheader(obj_file)
+    for key in contents:
+        if key in header and key in ['unseq','prog_id']:
+            try: contents[key] = int(header[key])
+            except: pass
+        elif key in header and key in ['obsmode','observer','object','date-avg']:
+            contents[key] = str(header[key])
+        elif key in header and key in ['ra','dec','exptime','pmtotal','bjd','bvcor']:
+            contents[key] = float(header[key])
+        elif key=='airmass' and 'telalt' in header:
+            if float(header['telalt'])<90:
+                try:
+                    contents[key] = airmass.airmass(90-float(header['telalt']))
+                except ValueError:
+                    pass
+    return contents
+
+def _harvest_headers(obj_files,threads=1,chunksize=16):
+    """
+    Read the overview information from the headers of FITS files.
+
+    With C{threads>1}, the headers are read in a pool of worker processes.
+    The results are yielded in the order of the files.
+
+    @param obj_files: FITS files
+    @type obj_files: list of str
+    @param threads: number of worker processes (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @return: header information (see L{_read_header_contents})
+    @rtype: iterator over dicts
+    """
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='half':
+        threads = cpu_count()//2
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(min(int(threads),len(obj_files)),1)
+    if threads==1:
+        for obj_file in obj_files:
+            yield _read_header_contents(obj_file)
+        return
+    pool = Pool(threads)
+    try:
+        for contents in pool.imap(_read_header_contents,obj_files,chunksize=chunksize):
+            yield contents
+    finally:
+        pool.close()
+        pool.join()
+
+def _insert_index_rows(connection,rows):
+    """
+    Insert or replace rows in the Hermes index.
+    """
+    columns = [name.replace('-','_') for name,dtype in _overview_columns] + ['jd','match_name','mtime']
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO spectra (%s) VALUES (%s)"%(','.join(columns),','.join(['?']*len(columns))),rows)
+
+def _search_index(index_file,ID=None,info=None,time_range=None,prog_ID=None,
+                  obsmode=None,radius=1.):
+    """
+    Select observations from the Hermes index.
+
+    The selection criteria are the same as in L{search}: observations match
+    the ID if the object name in the header matches C{ID}, or if they lie
+    within C{radius} arcminutes from the SIMBAD coordinates in C{info}.
+
+    @param index_file: SQLite index (see L{make_data_index})
+    @type index_file: str
+    @param ID: object name, stripped with L{_match_name}
+    @type ID: str
+    @param info: SIMBAD information on the object
+    @type info: dict
+    @param time_range: start and end of the time range
+    @type time_range: tuple of datetimes
+    @return: record array with summary information on the observations
+    @rtype: numpy rec array
+    """
+    conditions,parameters = [],[]
+    if time_range is not None:
+        conditions.append('jd BETWEEN ? AND ?')
+        parameters += [_timestamp2jd(date.isoformat()) for date in time_range]
+    if prog_ID is not None:
+        conditions.append('prog_id=?')
+        parameters.append(int(prog_ID))
+    if obsmode is not None:
+        conditions.append('obsmode=?')
+        parameters.append(obsmode)
+    #-- the object name matches if one contains the other; the coordinates are
+    #   first selected in a box, via the index on the declination
+    name_match = '0'
+    if ID is not None:
+        name_match = "(match_name!='' AND (instr(match_name,?)>0 OR instr(?,match_name)>0))"
+        if info:
+            ra,dec,size = info['jradeg'],info['jdedeg'],radius/60.
+            conditions.append("(%s OR (dec BETWEEN ? AND ? AND ra BETWEEN ? AND ?))"%(name_match))
+            parameters += [ID,ID,dec-size,dec+size,ra-size,ra+size]
+        else:
+            conditions.append(name_match)
+            parameters += [ID,ID]
+    columns = ','.join([name.replace('-','_') for name,dtype in _overview_columns])
+    query = 'SELECT %s,%s FROM spectra'%(columns,name_match)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY filename'
+    if name_match!='0':
+        parameters = [ID,ID] + parameters
+
+    connection = sqlite3.connect(index_file,timeout=60.)
+    try:
+        rows = connection.execute(query,parameters).fetchall()
+    finally:
+        connection.close()
+
+    #-- missing floats are stored as NULL
+    dtype = np.dtype(_overview_columns)
+    data = [np.array([row[i] for row in rows],dtype[i]) for i in range(len(dtype))]
+    data = np.rec.fromarrays(data,dtype=dtype)
+    #-- within the box, keep only the observations within the radius
+    if ID is not None and info and len(data):
+        matched = np.array([row[-1] for row in rows],bool)
+        keep = matched | (np.sqrt((data['ra']-ra)**2 + (data['dec']-dec)**2) < size)
+        data = data[keep]
+    return data
+
+def _match_name(name):
+    """
+    Strip an object name from spaces and punctuation, for matching names.
+
+    @param name: object name
+    @type name: str
+    @return: stripped name
+    @rtype: str
+    """
+    return name.replace(' ','').replace('.','').replace('+','').replace('-','').replace('*','')
+
 def _derive_filelocation_from_raw(rawfile,data_type):
     """
     Derive the location of a reduced file from the raw file.
@@ -1194,6 +1450,29 @@ def _timestamp2datetime(timestamp):
         timestamp += [12,0,0]
     return datetime.datetime(*timestamp)
 
+def _timestamp2datetime64(timestamps):
+    """
+    Convert time stamps from HERMES FITS 'date-avg' to numpy datetimes.
+
+    Time stamps that cannot be interpreted (e.g. 'nan') are converted to 'NaT'.
+
+    @param timestamps: strings from 'date-avg'
+    @type timestamps: array of str
+    @return: datetimes
+    @rtype: datetime64[us] array
+    """
+    timestamps = np.array(timestamps,str)
+    try:
+        return np.array(np.where(timestamps=='nan','NaT',timestamps),'datetime64[us]')
+    except ValueError:
+        dates = np.zeros(len(timestamps),'datetime64[us]')
+        for i,timestamp in enumerate(timestamps):
+            try:
+                dates[i] = np.datetime64(timestamp,'us')
+            except ValueError:
+                dates[i] = np.datetime64('NaT')
+        return dates
+
 def _etree_to_dict(t):
     """
     Convert a xml tree to a dictionary.
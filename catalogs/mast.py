@@ -118,8 +118,7 @@ def galex(**kwargs):
     #radius = radius/60.
     base_url = 'http://galex.stsci.edu/gxws/conesearch/conesearch.asmx/ConeSearchToXml?ra={0:f}&dec={1:f}&sr={2:f}&verb=1'.format(ra,dec,radius)
     #base_url = 'http://galex.stsci.edu/GR4/?page=searchresults&RA={ra:f}&DEC={dec:f}&query=no'.format(ra=ra,dec=dec)
-    url = urllib.request.URLopener()
-    filen,msg = url.retrieve(base_url,filename=None)
+    filen,url = http.retrieve(base_url,filename=None)
     fuv_flux,e_fuv_flux = None,None
     columns = ['_r','ra','dec','fuv_flux','fuv_fluxerr','nuv_flux','nuv_fluxerr']
     values = [np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan]
@@ -136,6 +135,7 @@ def galex(**kwargs):
                     got_target = (col=='fuv_fluxerr')
             if got_target:
                 break
+    url.close()
 
     values[0] = np.sqrt( (values[1]-ra)**2 + (values[2]-dec)**2)*3600
     columns[1] = '_RAJ2000'
@@ -196,8 +196,7 @@ def search(catalog,**kwargs):
     base_url = _get_URI(catalog,**kwargs)
     #-- prepare to open URI
 
-    url = urllib.request.URLopener()
-    filen,msg = url.retrieve(base_url,filename=filename)
+    filen,url = http.retrieve(base_url,filename=filename)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying MAST source %s and downloading to %s'%(catalog,filename))
@@ -341,42 +340,44 @@ def csv2recarray(filename):
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data,comms = ascii.read2array(filename,dtype=np.str,splitchar=',',return_comments=True)
+    with open(filename,'r') as ff:
+        lines = ff.read().split('\n')
+    comms = [line[1:] for line in lines if line[:1]=='#']
+    data = [line for line in lines if line and not line.isspace() and line[0]!='#']
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if len(data)>1:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
+        names = data[0].split(',')
+        fmts = data[1].split(',')
         #-- retrieve the format of the columns. They are given in the
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
         #   the contents as a long string
-        formats = np.zeros_like(data[0])
-        for i,fmt in enumerate(data[1]):
+        formats = ['']*len(names)
+        for i,fmt in enumerate(fmts):
             if 'string' in fmt or fmt=='datetime': formats[i] = 'U100'
             if fmt=='integer': formats[i] = 'f8'
             if fmt=='ra': formats[i] = 'f8'
             if fmt=='dec': formats[i] = 'f8'
             if fmt=='float': formats[i] = 'f8'
         #-- define dtypes for record array
-        dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
+        dtypes = np.dtype([(i,j) for i,j in zip(names,formats)])
+        #-- split the data lines in columns
+        data = ascii.lines2array(data[2:],',').reshape(-1,len(names))
         cols = []
-        for i,key in enumerate(data[0]):
-             col = data[2:,i]
+        for i,key in enumerate(names):
              #-- fill empty values with nan
-             cols.append([(row.isspace() or not row) and np.nan or row for row in col])
+             cols.append(ascii.str2column(data[:,i],dtypes[i]))
              #-- fix unit name
              for source in cat_info.sections():
-                if cat_info.has_option(source,data[0,i]+'_unit'):
-                    units[key] = cat_info.get(source,data[0,i]+'_unit')
+                if cat_info.has_option(source,key+'_unit'):
+                    units[key] = cat_info.get(source,key+'_unit')
                     break
              else:
                 units[key] = 'nan'
         #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
+        results = np.rec.fromarrays(cols,dtype=dtypes)
     else:
         results = None
         units = {}
@@ -393,13 +394,16 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],**kwargs):
     to_units = kwargs.pop('to_units','erg/s/cm2/AA')
     master_ = kwargs.get('master',None)
     master = None
-    #-- retrieve all measurements
-    for source in cat_info.sections():
+    #-- retrieve all measurements: the queries are sent concurrently, but
+    #   the results are combined in the order of the sources
+    sources = cat_info.sections()
+    jobs = []
+    for source in sources:
         if source=='galex':
-            results,units,comms = galex(ID=ID,**kwargs)
+            jobs.append((galex,(),dict(ID=ID,**kwargs)))
         else:
-            results,units,comms = search(source,ID=ID,**kwargs)
-
+            jobs.append((search,(source,),dict(ID=ID,**kwargs)))
+    for source,(results,units,comms) in zip(sources,http.map_concurrent(jobs)):
         if results is not None:
             master = mast2phot(source,results,units,master,extra_fields=extra_fields)
 
@@ -10,6 +10,7 @@ import logging
 import numpy as np
 from ivs.units import conversions
 from ivs.aux import xmlparser
+from ivs.inout import http
 from ivs.catalogs import vizier
 
 logger = logging.getLogger("CAT.SESAME")
@@ -145,7 +146,8 @@ def search(ID, db='S', fix=False):
     @rtype: dictionary
     """
     base_url = get_URI(ID, db=db)
-    with urllib.request.urlopen(base_url) as ff:
+    filen, url = http.retrieve(base_url)
+    with open(filen, 'rb') as ff:
         xmlpage = ""
         for line in ff.readlines():
             line = line.decode('utf-8')
@@ -160,6 +162,7 @@ def search(ID, db='S', fix=False):
         except KeyError as IndexError:
             # -- we found nothing!
             database = {}
+    url.close()
 
     if fix:
         # -- fix the parallax: make sure we have the Van Leeuwen 2007 value.
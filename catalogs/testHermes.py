@@ -678,16 +678,93 @@ class TestCase6RunHermesVR(HermesTestCase):
         hermes._subprocess_execute.assert_called_with(cmd, 150)
 
 
+class TestCase7HermesIndex(HermesTestCase):
+    """
+    Tests regarding the index of the Hermes data (make_data_index and search)
+    """
 
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+        import astropy.io.fits as pf
+        cls.pf = pf
+        cls.datadir = tempfile.mkdtemp()
+        cls.original_dir = hermes.config.ivs_dirs['hermes']
+        hermes.config.ivs_dirs['hermes'] = cls.datadir
+        cls.index_file = os.path.join(cls.datadir,'HermesFullDataIndex.sqlite')
+        cls.headers = [dict(unseq=100,prog_id=1,obsmode='HRF_OBJ',object='HD 50230',ra=103.08,dec=1.61,date_avg='2009-09-22T04:00:00.5'),
+                       dict(unseq=101,prog_id=1,obsmode='HRF_OBJ',object='HD50230',ra=103.08,dec=1.61,date_avg='2009-09-23T04:00:00.5'),
+                       dict(unseq=102,prog_id=2,obsmode='HRF_TH',object='ThAr',ra=103.08,dec=1.61,date_avg='2009-09-23T05:00:00.5'),
+                       dict(unseq=103,prog_id=2,obsmode='HRF_OBJ',object='unknown',ra=103.085,dec=1.615,date_avg='2009-09-30T04:00:00.5'),
+                       dict(unseq=104,prog_id=3,obsmode='HRF_OBJ',object='HD170580',ra=277.47,dec=4.27,date_avg='2009-10-01T04:00:00.5')]
+        for header in cls.headers:
+            cls.write_file(header)
 
+    @classmethod
+    def tearDownClass(cls):
+        hermes.config.ivs_dirs['hermes'] = cls.original_dir
+        shutil.rmtree(cls.datadir)
 
-
-
-
-
-
-
-
-
-
-
+    @classmethod
+    def write_file(cls,header):
+        night = header['date_avg'][:10].replace('-','')
+        direc = os.path.join(cls.datadir,night,'raw')
+        if not os.path.isdir(direc):
+            os.makedirs(direc)
+        filename = os.path.join(direc,'%08d_%s.fits'%(header['unseq'],header['obsmode']))
+        hdu = cls.pf.PrimaryHDU()
+        for key in ['unseq','prog_id','obsmode','object','ra','dec']:
+            hdu.header[key] = header[key]
+        hdu.header['date-avg'] = header['date_avg']
+        hdu.writeto(filename,overwrite=True)
+        return filename
+
+    def test1make_index(self):
+        """catalogs.hermes make_data_index harvest headers in parallel"""
+        hermes.make_data_index(self.index_file,threads=2)
+        data = hermes.search(data_type='raw',index_file=self.index_file)
+        self.assertArrayEqual(data['unseq'],[100,101,102,103,104])
+        self.assertArrayEqual(data['object'],['HD 50230','HD50230','ThAr','unknown','HD170580'])
+        self.assertTrue(np.all(np.isnan(data['bvcor'])))
+
+    def test2search_index(self):
+        """catalogs.hermes search on time range, program and observing mode"""
+        hermes.make_data_index(self.index_file,threads=1)
+        #-- the night starting at the given day
+        data = hermes.search(time_range='2009-9-22',data_type='raw',index_file=self.index_file)
+        self.assertArrayEqual(data['unseq'],[101,102])
+        data = hermes.search(time_range=('2009-9-21','2009-9-30'),data_type='raw',index_file=self.index_file)
+        self.assertArrayEqual(data['unseq'],[100,101,102,103])
+        data = hermes.search(prog_ID=2,obsmode='HRF_OBJ',data_type='raw',index_file=self.index_file)
+        self.assertArrayEqual(data['unseq'],[103])
+
+    def test3search_index_ID(self):
+        """catalogs.hermes search on object name and coordinates"""
+        hermes.make_data_index(self.index_file,threads=1)
+        data = hermes._search_index(self.index_file,ID='HD50230')
+        self.assertArrayEqual(data['unseq'],[100,101])
+        info = dict(jradeg=103.08,jdedeg=1.61)
+        data = hermes._search_index(self.index_file,ID='HD50230',info=info,radius=1.)
+        self.assertArrayEqual(data['unseq'],[100,101,102,103])
+        data = hermes._search_index(self.index_file,ID='HD50230',info=info,radius=0.1)
+        self.assertArrayEqual(data['unseq'],[100,101,102])
+
+    def test4update_index(self):
+        """catalogs.hermes make_data_index only reads new and modified files"""
+        hermes.make_data_index(self.index_file,threads=1)
+        #-- change the header of an indexed file, but keep its modification time
+        header = dict(self.headers[-1],object='HD 170580')
+        filename = self.write_file(header)
+        mtime = os.path.getmtime(filename)
+        os.utime(filename,(mtime-100,mtime-100))
+        hermes.make_data_index(self.index_file,threads=1)
+        data = hermes.search(data_type='raw',index_file=self.index_file)
+        self.assertEqual(data['object'][-1],'HD170580')
+        #-- modified and new files are (re)read
+        os.utime(filename,(mtime+100,mtime+100))
+        self.write_file(dict(self.headers[0],unseq=105))
+        hermes.make_data_index(self.index_file,threads=1)
+        data = hermes.search(data_type='raw',index_file=self.index_file)
+        self.assertArrayEqual(data['unseq'],[100,105,101,102,103,104])
+        self.assertEqual(data['object'][-1],'HD 170580')
+        self.write_file(self.headers[-1])
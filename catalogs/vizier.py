@@ -220,8 +220,7 @@ def search(name,filetype='tsv',filename=None,**kwargs):
     base_url = _get_URI(name=name,**kwargs)
 
     #-- prepare to open URI
-    url = urllib.request.URLopener()
-    filen, msg = url.retrieve(base_url,filename=filename)
+    filen, url = http.retrieve(base_url,filename=filename)
     #   maybe we are just interest in the file, not immediately in the content
     if filename is not None:
         logger.info('Querying ViZieR source %s and downloading to %s'%(name,filen))
@@ -241,6 +240,58 @@ def search(name,filetype='tsv',filename=None,**kwargs):
         return results,units,comms
 
 
+def search_batch(name,ra,dec,radius=20.,chunk_size=500,**kwargs):
+    """
+    Search a VizieR catalog around a list of positions.
+
+    Instead of querying every target separately, the positions are uploaded to
+    VizieR as a target list, in chunks of C{chunk_size} targets per request.
+    The chunks are queried concurrently. All rows returned for all targets are
+    collected in one record array, with the index of the target (starting
+    from 1) in the column C{_q}: use L{split_targets} to assign them to the
+    individual targets.
+
+    Example usage:
+
+    >>> ra,dec = np.array([279.23473,88.79379]),np.array([38.78369,89.26411])
+    >>> results,units,comms = search_batch('II/246/out',ra,dec,radius=5.)
+    >>> per_target = split_targets(results,ra,dec,radius=5.)
+
+    Extra kwargs: see L{_get_URI}.
+
+    @param name: name of a ViZieR catalog (e.g. 'II/246/out')
+    @type name: str
+    @param ra: right ascensions of the targets (degrees)
+    @type ra: array
+    @param dec: declinations of the targets (degrees)
+    @type dec: array
+    @param radius: search radius around each target (arcseconds)
+    @type radius: float
+    @param chunk_size: maximum number of targets per request
+    @type chunk_size: int
+    @return: catalog data columns, units, comments
+    @rtype: record array, dict, list of str
+    """
+    ra,dec = np.atleast_1d(ra),np.atleast_1d(dec)
+    kwargs['filetype'] = 'tsv'
+    kwargs.pop('ID',None)
+    starts = list(range(0,len(ra),chunk_size))
+    jobs = [(_search_chunk,(name,ra[start:start+chunk_size],dec[start:start+chunk_size],radius),kwargs) for start in starts]
+    chunks = []
+    for start,chunk in zip(starts,http.map_concurrent(jobs)):
+        if chunk[0] is None: continue
+        #-- the target indices are counted per chunk
+        if '_q' in chunk[0].dtype.names:
+            chunk[0]['_q'] += start
+        chunks.append(chunk)
+    if not chunks:
+        return None,{},[]
+    results = np.rec.array(np.hstack([chunk[0] for chunk in chunks]))
+    units,comms = chunks[0][1],chunks[0][2]
+    logger.info('Querying ViZieR source %s for %d targets (%d)'%(name,len(ra),len(results)))
+    return results,units,comms
+
+
 def list_catalogs(ID,filename=None,filetype='tsv',**kwargs):
     """
     Print and return all catalogs containing information on the star.
@@ -537,56 +588,15 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=F
     sources = kwargs.get('sources',cat_info.sections())
     master_ = kwargs.get('master',None)
     master = None
-    #-- retrieve all measurements
-    for source in sources:
-        results,units,comms = search(source,**kwargs)
+    #-- retrieve all measurements: the queries are sent concurrently, but
+    #   the results are combined in the order of the sources
+    queries = http.map_concurrent([(search,(source,),kwargs) for source in sources])
+    for source,(results,units,comms) in zip(sources,queries):
         if results is None: continue
         master = vizier2phot(source,results,units,master,extra_fields=extra_fields,take_mean=take_mean)
     #-- convert the measurement to a common unit.
     if to_units and master is not None:
-        #-- prepare columns to extend to basic master
-        dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','U50')]
-        cols = [[],[],[],[]]
-        #-- forget about 'nan' errors for the moment
-        no_errors = np.isnan(master['e_meas'])
-        master['e_meas'][no_errors] = 0.
-        #-- extend basic master
-        zp = filters.get_info(master['photband'])
-        for i in range(len(master)):
-            to_units_ = to_units+''
-            try:
-                value, e_value = conversions.convert(master['unit'][i],
-                                                     to_units,
-                                                     master['meas'][i],
-                                                     master['e_meas'][i],
-                                                     photband=master['photband'][i])
-            except ValueError: # calibrations not available, or its a color
-                # if it is a magnitude color, try converting it to a flux ratio
-                if 'mag' in master['unit'][i]:
-                    try:
-                        value, e_value = conversions.convert('mag_color',
-                                                             'flux_ratio',
-                                                             master['meas'][i],
-                                                             master['e_meas'][i],
-                                                             photband=master['photband'][i])
-                        to_units_ = 'flux_ratio'
-                    except ValueError:
-                        value, e_value = np.nan, np.nan
-                # else, we are powerless...
-                else:
-                    value,e_value = np.nan,np.nan
-            try:
-                eff_wave = filters.eff_wave(master['photband'][i])
-            except IOError:
-                eff_wave = np.nan
-            cols[0].append(eff_wave)
-            cols[1].append(value)
-            cols[2].append(e_value)
-            cols[3].append(to_units_)
-        master = numpy_ext.recarr_addcols(master,cols,dtypes)
-        #-- reset errors
-        master['e_meas'][no_errors] = np.nan
-        master['e_cmeas'][no_errors] = np.nan
+        master = _convert_master(master,to_units)
 
     if master_ is not None and master is not None:
         master = numpy_ext.recarr_addrows(master_,master.tolist())
@@ -597,6 +607,114 @@ def get_photometry(ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=F
     return master
 
 
+def get_photometry_batch(ra,dec,ID=None,extra_fields=['_r','_RAJ2000','_DEJ2000'],take_mean=False,radius=20.,**kwargs):
+    """
+    Download all available photometry for a list of targets.
+
+    This is the multi-target version of L{get_photometry}: for each catalog,
+    the whole target list is queried at once via L{search_batch}, and the rows
+    are assigned to their target via L{split_targets}. The result is a
+    list with one master record array per target (or None if nothing was
+    found), identical in layout to the output of L{get_photometry}.
+
+    Example usage:
+
+    >>> masters = get_photometry_batch([279.23473,88.79379],[38.78369,89.26411],ID=['vega','polaris'],radius=5.)
+
+    For extra kwargs, see L{search_batch}, L{_get_URI} and L{vizier2phot}.
+
+    @param ra: right ascensions of the targets (degrees)
+    @type ra: array
+    @param dec: declinations of the targets (degrees)
+    @type dec: array
+    @param ID: names of the targets (only used for logging)
+    @type ID: list of str
+    @param radius: search radius around each target (arcseconds)
+    @type radius: float
+    @return: master record array per target
+    @rtype: list of record arrays
+    """
+    ra,dec = np.atleast_1d(ra).astype(float),np.atleast_1d(dec).astype(float)
+    if ID is None:
+        ID = ['%.5f%+.5f'%(ira,idec) for ira,idec in zip(ra,dec)]
+    to_units = kwargs.pop('to_units','erg/s/cm2/AA')
+    sources = kwargs.pop('sources',cat_info.sections())
+    masters = [None]*len(ra)
+    #-- retrieve all measurements: the catalogs are queried concurrently, but
+    #   the results are combined in the order of the sources
+    queries = http.map_concurrent([(search_batch,(source,ra,dec,radius),kwargs) for source in sources])
+    for source,(results,units,comms) in zip(sources,queries):
+        if results is None: continue
+        for i,rows in enumerate(split_targets(results,ra,dec,radius,units=units)):
+            if rows is None: continue
+            masters[i] = vizier2phot(source,rows,units,masters[i],extra_fields=extra_fields,take_mean=take_mean)
+    #-- convert the measurement to a common unit.
+    for i in range(len(masters)):
+        if masters[i] is None:
+            logger.info('%s: no photometry found'%(ID[i]))
+            continue
+        if to_units:
+            masters[i] = _convert_master(masters[i],to_units)
+        logger.info('%s: found %d measurements'%(ID[i],len(masters[i])))
+    return masters
+
+def split_targets(results,ra,dec,radius,ra_col='_RAJ2000',dec_col='_DEJ2000',r_col='_r',q_col='_q',units=None):
+    """
+    Assign the rows of a multi-target catalog query to the targets.
+
+    Each row is assigned to the target given in the column C{q_col} (the
+    index of the target, starting from 1). If the results have no such
+    column, each row is assigned to the nearest target via a KDTree on the
+    unit sphere. Rows further than C{radius} from their target are dropped.
+    The distance column C{r_col} is replaced by the distance to the assigned
+    target (in the units of that column, if given in C{units}, otherwise in
+    arcseconds), and the rows of each target are sorted on that distance, as
+    in a single-target query.
+
+    @param results: results from a multi-target query
+    @type results: record array
+    @param ra: right ascensions of the targets (degrees)
+    @type ra: array
+    @param dec: declinations of the targets (degrees)
+    @type dec: array
+    @param radius: maximum distance between target and row (arcseconds)
+    @type radius: float
+    @param ra_col: name of the column with the rows' right ascensions (deg)
+    @type ra_col: str
+    @param dec_col: name of the column with the rows' declinations (deg)
+    @type dec_col: str
+    @param r_col: name of the distance column
+    @type r_col: str
+    @param q_col: name of the column with the target index
+    @type q_col: str
+    @param units: units of the columns
+    @type units: dict
+    @return: record array of rows per target (None when there are no rows)
+    @rtype: list of record arrays
+    """
+    per_target = [None]*len(np.atleast_1d(ra))
+    if results is None or len(results)==0:
+        return per_target
+    targets = _radec2xyz(ra,dec)
+    rows = _radec2xyz(results[ra_col],results[dec_col])
+    if q_col is not None and q_col in results.dtype.names:
+        target = np.asarray(results[q_col],float).astype(int)-1
+        chord = np.sqrt(((rows-targets[target])**2).sum(axis=1))
+    else:
+        chord,target = KDTree(targets).query(rows)
+    distance = 2*np.arcsin(np.clip(chord/2.,0,1))/np.pi*180.*3600.
+    keep = distance<=radius
+    results,target,distance = results[keep],target[keep],distance[keep]
+    if r_col in results.dtype.names:
+        r_unit = units is not None and units.get(r_col,'arcsec') or 'arcsec'
+        results[r_col] = distance/dict(arcsec=1.,arcmin=60.,deg=3600.).get(r_unit,1.)
+    #-- group the rows per target, nearest first
+    order = np.lexsort((distance,target))
+    results,target = results[order],target[order]
+    for i in np.unique(target):
+        per_target[i] = results[target==i]
+    return per_target
+
 def quality_check(master,ID=None,return_master=True,**kwargs):
     """
     Perform quality checks on downloaded data.
@@ -761,30 +879,38 @@ def tsv2recarray(filename):
     """
     Read a Vizier tsv (tab-sep) file into a record array.
 
+    The header (column names, units and format lines) is interpreted once,
+    after which the data is split and converted column by column with
+    vectorized operations.
+
     @param filename: name of the TSV file
     @type filename: str
     @return: catalog data columns, units, comments
     @rtype: record array, dict, list of str
     """
-    data, comms = ascii.read2array(filename,dtype=np.str,splitchar='\t',return_comments=True)
+    with open(filename,'r') as ff:
+        lines = ff.read().split('\n')
+    comms = [line[1:] for line in lines if line[:1]=='#']
+    data = [line for line in lines if line and not line.isspace() and line[0]!='#']
     results = None
     units = {}
     #-- retrieve the data and put it into a record array
     if len(data)>0:
-        #-- now convert this thing into a nice dictionary
-        data = np.array(data)
+        #-- the first three lines contain the names, units and dashes
+        names = data[0].split('\t')
+        units_ = data[1].split('\t')
+        data = ascii.lines2array(data[3:],splitchar='\t')
         #-- retrieve the format of the columns. They are given in the
         #   Fortran format. In rare cases, columns contain multiple values
         #   themselves (so called vectors). In those cases, we interpret
         #   the contents as a long string
-        formats = np.zeros_like(data[0])
-
+        formats = ['']*len(names)
         for line in comms:
             line = line.split('\t')
 
-            if len(line)<3: continue
-            for i,key in enumerate(data[0]):
-                if key == line[1] and line[0]=='Column': # this is the line with information
+            if len(line)<3 or line[0]!='Column': continue
+            for i,key in enumerate(names):
+                if key == line[1]: # this is the line with information
                     formats[i] = line[2].replace('(','').replace(')','').lower().replace('a', 'U')
                     if formats[i][0].isdigit(): formats[i] = 'U100'
                     elif 'f' in formats[i]: formats[i] = 'f8' # floating point
@@ -794,24 +920,17 @@ def tsv2recarray(filename):
                     if formats[i][0]=='U':
                         formats[i] = 'U'+str(int(formats[i][1:])+3)
         #-- define dtypes for record array
-        dtypes = np.dtype([(i,j) for i,j in zip(data[0],formats)])
-        #-- remove spaces or empty values
+        dtypes = np.dtype([(i,j) for i,j in zip(names,formats)])
+        #-- fill empty values with nan, and make sure each string in the
+        #   array is at least three spaces long (otherwise we cannot fit
+        #   'nan' in the row)
         cols = []
-        for i,key in enumerate(data[0]):
-             col = data[3:,i]
-             #-- fill empty values with nan, and make sure each string in the
-             #   array is at least three spaces long (otherwise we cannot fit
-             #   'nan' in the row and the casting will not work properly in a
-             #   few lines
-             cols.append([(row.isspace() or not row) and np.nan or 3*' '+row for row in col])
-             #-- fix unit name
-             #if source in cat_info.sections() and cat_info.has_option(source,data[1,i]):
-             #   units[key] = cat_info.get(source,data[1,i])
-             #else:
-             units[key] = data[1,i]
-        #-- define columns for record array and construct record array
-        cols = [np.cast[dtypes[i]](cols[i]) for i in range(len(cols))]
-        results = np.rec.array(cols, dtype=dtypes)
+        for i,key in enumerate(names):
+            col = data[:,i] if data.size else np.zeros(0,str)
+            cols.append(ascii.str2column(col,dtypes[i],prefix=3*' '))
+            units[key] = units_[i]
+        #-- construct record array
+        results = np.rec.fromarrays(cols, dtype=dtypes)
     return results,units,comms
 
 def vizier2phot(source,results,units,master=None,e_flag='e_',q_flag='q_',extra_fields=None,take_mean=False):
@@ -1247,6 +1366,99 @@ def _get_URI(name=None,ID=None,ra=None,dec=None,radius=20.,
     #print base_url
     return base_url
 
+def _search_chunk(name,ra,dec,radius,**kwargs):
+    """
+    Query a VizieR catalog around a list of positions in one request.
+
+    The targets are sent as a VizieR list block in the body of a POST
+    request, one position per line. The index of the target (starting from 1
+    within this chunk) is added to every row in the column C{_q}.
+
+    @return: catalog data columns, units, comments
+    @rtype: record array, dict, list of str
+    """
+    kwargs['radius'] = None
+    base_url,query = _get_URI(name=name,**kwargs).split('?',1)
+    targets = ['%.7f %+.7f'%(ira,idec) for ira,idec in zip(ra,dec)]
+    targets = '\n'.join(['<<====targets']+targets+['====targets'])
+    query += '&-out.add=_q&-c.rs=%s&-c.u=arcsec&-c=%s'%(radius,urllib.parse.quote(targets))
+    filen,url = http.retrieve(base_url,data=query.encode('ascii'))
+    try:
+        results,units,comms = tsv2recarray(filen)
+    except ValueError:
+        raise ValueError("failed to read %s, perhaps multiple catalogs specified (e.g. III/168 instead of III/168/catalog)"%(name))
+    finally:
+        url.close()
+    return results,units,comms
+
+def _radec2xyz(ra,dec):
+    """
+    Convert equatorial coordinates (degrees) to unit vectors.
+
+    @return: array of shape (N,3)
+    @rtype: array
+    """
+    ra,dec = np.radians(np.asarray(ra,float)),np.radians(np.asarray(dec,float))
+    return np.column_stack([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)])
+
+def _convert_master(master,to_units):
+    """
+    Add the converted measurements to a master record array.
+
+    The columns C{cwave}, C{cmeas}, C{e_cmeas} and C{cunit} are added.
+
+    @param master: master record array from vizier2phot.
+    @type master: record array
+    @param to_units: units to convert everything to.
+    @type to_units: str
+    @return: master with added columns
+    @rtype: record array
+    """
+    #-- prepare columns to extend to basic master
+    dtypes = [('cwave','f8'),('cmeas','f8'),('e_cmeas','f8'),('cunit','U50')]
+    cols = [[],[],[],[]]
+    #-- forget about 'nan' errors for the moment
+    no_errors = np.isnan(master['e_meas'])
+    master['e_meas'][no_errors] = 0.
+    #-- extend basic master
+    zp = filters.get_info(master['photband'])
+    for i in range(len(master)):
+        to_units_ = to_units+''
+        try:
+            value, e_value = conversions.convert(master['unit'][i],
+                                                 to_units,
+                                                 master['meas'][i],
+                                                 master['e_meas'][i],
+                                                 photband=master['photband'][i])
+        except ValueError: # calibrations not available, or its a color
+            # if it is a magnitude color, try converting it to a flux ratio
+            if 'mag' in master['unit'][i]:
+                try:
+                    value, e_value = conversions.convert('mag_color',
+                                                         'flux_ratio',
+                                                         master['meas'][i],
+                                                         master['e_meas'][i],
+                                                         photband=master['photband'][i])
+                    to_units_ = 'flux_ratio'
+                except ValueError:
+                    value, e_value = np.nan, np.nan
+            # else, we are powerless...
+            else:
+                value,e_value = np.nan,np.nan
+        try:
+            eff_wave = filters.eff_wave(master['photband'][i])
+        except IOError:
+            eff_wave = np.nan
+        cols[0].append(eff_wave)
+        cols[1].append(value)
+        cols[2].append(e_value)
+        cols[3].append(to_units_)
+    master = numpy_ext.recarr_addcols(master,cols,dtypes)
+    #-- reset errors
+    master['e_meas'][no_errors] = np.nan
+    master['e_cmeas'][no_errors] = np.nan
+    return master
+
 def _breakup_colours(master):
     """
     From colors and one magnitude measurement, derive the other magnitudes.
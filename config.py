@@ -18,6 +18,11 @@ data_dirs = [os.getenv('ivsdata'),'/STER/pieterd/IVSDATA/', '/STER/kristofs/IVSd
 ivs_dirs = dict(coralie='/STER/coralie/',
                 hermes='/STER/mercator/hermes/')
 
+#-- On-disk cache for catalog queries (VizieR, GATOR, MAST, Sesame). Set to
+#   e.g. dict(filename=os.path.expanduser('~/.ivs/queries.sqlite'),
+#   ttl=30*24*3600.) to switch it on, see ivs.inout.http.set_cache
+query_cache = None
+
 
 
 def get_datafile(relative_path,basename):
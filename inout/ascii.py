@@ -3,6 +3,7 @@
 Read and write ASCII files.
 """
 import gzip
+import itertools
 import logging
 import os
 import re
@@ -34,51 +35,9 @@ def read2list(filename,**kwargs):
              list of lists (comments lines without commentchar),
     @rtype: (list,list)
     """
-    commentchar = kwargs.get('commentchar',['#'])
     splitchar = kwargs.get('splitchar',None)
-    skip_empty = kwargs.get('skip_empty',True)
-    skip_lines = kwargs.get('skip_lines',0)
-
-    if os.path.splitext(filename)[1] == '.gz':
-        ff = gzip.open(filename,mode='rt')
-    else:
-        ff = open(filename)
-
-    data = []  # data
-    comm = []  # comments
-
-    line_nr = -1
-
-    #-- fixwidth split or character split?
-    if splitchar is None or isinstance(splitchar,str):
-        fixwidth = False
-    else:
-        fixwidth = True
-
-    while 1:  # might call read several times for a file
-        line = ff.readline()
-        if not line: break  # end of file
-        line_nr += 1
-        if line_nr<skip_lines:
-            continue
-
-        #-- strip return character from line
-        if skip_empty and line.isspace():
-            continue # empty line
-
-        #-- remove return characters
-        line = line.replace('\n','')
-        #-- when reading a comment line
-        if line[0] in commentchar:
-            comm.append(line[1:])
-            continue # treat next line
-
-        #-- when reading data, split the line
-        if not fixwidth:
-            data.append(line.split(splitchar))
-        else:
-            data.append(fw2python(line,splitchar))
-    ff.close()
+    data,comm = _read_lines(filename,**kwargs)
+    data = _split_rows(data,splitchar)
 
     #-- report that the file has been read
     logger.debug('Data file %s read'%(filename))
@@ -96,6 +55,10 @@ def read2array(filename,**kwargs):
 
     C{>>> col1,col2,col3 = ascii.read2array(myfile).T}
 
+    The file is read in one go and, if all rows have the same number of
+    columns, split (or for floats parsed) in one pass instead of line by line.
+    The result is the same as converting the output of L{read2list}.
+
     @param filename: name of file with the data
     @type filename: string
     @keyword dtype: type of numpy array (default: float)
@@ -107,10 +70,53 @@ def read2array(filename,**kwargs):
     """
     dtype = kwargs.get('dtype',np.float)
     return_comments = kwargs.get('return_comments',False)
-    data,comm = read2list(filename,**kwargs)
-    data = np.array(data,dtype=dtype)
+    data,comm = _read_lines(filename,**kwargs)
+    data = _lines2array(data,kwargs.get('splitchar',None),dtype)
     return return_comments and (data,comm) or data
 
+def iter_read2array(filename,chunk_size=100000,**kwargs):
+    """
+    Iterate over an ASCII file in chunks of rows.
+
+    Every chunk is a numpy array of at most C{chunk_size} rows, as would be
+    returned by L{read2array} for that part of the file. This allows to
+    process files that are too large to hold in memory at once (as text):
+
+    >>> for chunk in iter_read2array('huge.dat',chunk_size=10**6):
+    ...     total += chunk[:,1].sum()
+
+    The keyword arguments are the same as for L{read2array}. If
+    C{return_comments=True}, every iteration returns the chunk and the
+    comments encountered while reading it.
+
+    @param filename: name of file with the data
+    @type filename: string
+    @param chunk_size: (maximum) number of lines read per chunk
+    @type chunk_size: int
+    @return: iterator over data arrays (, lists of comments)
+    @rtype: iterator
+    """
+    dtype = kwargs.get('dtype',np.float)
+    return_comments = kwargs.get('return_comments',False)
+    splitchar = kwargs.get('splitchar',None)
+    skip_lines = kwargs.get('skip_lines',0)
+    with _open(filename) as ff:
+        line_nr = 0
+        while 1:
+            lines = list(itertools.islice(ff,chunk_size))
+            if not lines: break
+            #-- the lines keep their return character: joining and splitting
+            #   them again is faster than stripping every line
+            lines = ''.join(lines).split('\n')
+            if lines[-1]=='': lines = lines[:-1]
+            first = max(skip_lines-line_nr,0)
+            line_nr += len(lines)
+            data,comm = _filter_lines(lines[first:],**kwargs)
+            if not data and not comm:
+                continue
+            data = _lines2array(data,splitchar,dtype)
+            yield return_comments and (data,comm) or data
+
 def read2recarray(filename,**kwargs):
     """
     Load ASCII file to a numpy record array.
@@ -137,22 +143,22 @@ def read2recarray(filename,**kwargs):
     return_comments = kwargs.get('return_comments',False)
     splitchar = kwargs.get('splitchar',None)
 
-    #-- first read in as a normal array
-    data,comm = read2list(filename,**kwargs)
+    #-- first read in as a list of lines
+    data,comm = _read_lines(filename,**kwargs)
 
     #-- if dtypes is None, we have some room to automatically detect the contents
     #   of the columns. This is not fully implemented yet, and works only
     #   if the second-to-last and last columns of the comments denote the
     #   name and dtype, respectively
     if dtype is None:
-        data = np.array(data,dtype=str).T
+        data = _lines2array(data,splitchar,str).T
         header = comm[-2].replace('|',' ').split()
         types = comm[-1]
         types = re.sub(r'(<|>|\||=)(S|a)', 'U', types).split()
         dtype = [(head,typ) for head,typ in zip(header,types)]
         dtype = np.dtype(dtype)
     elif isinstance(dtype,list):
-        data = np.array(data,dtype=str).T
+        data = _lines2array(data,splitchar,str).T
         dtype = np.dtype(dtype)
     #-- if dtype is a list, assume it is a list of fixed width stuff.
     elif isinstance(splitchar,list):
@@ -166,8 +172,12 @@ def read2recarray(filename,**kwargs):
                 dtype.append((str(names[i]),fmt))
         dtype = np.dtype(dtype)
 
+    #-- otherwise, keep the rows as in read2list
+    if not isinstance(data,np.ndarray):
+        data = _split_rows(data,splitchar)
+
     #-- cast all columns to the specified type
-    data = [np.cast[dtype[i]](data[i]) for i in range(len(data))]
+    data = [_cast_column(data[i],dtype[i]) for i in range(len(data))]
 
     #-- and build the record array
     data = np.rec.array(data, dtype=dtype)
@@ -338,6 +348,303 @@ def fw2python(line,fixwidths,missing_value=0):
         else:
             processed_line.append(itype(line[length[i]:length[i+1]]))
     return processed_line
+
+def lines2array(lines,splitchar=None):
+    """
+    Split lines of text into a 2D array of strings.
+
+    If all lines contain the same number of entries, the lines are split in
+    one pass over the joined text instead of line by line.
+
+    >>> lines2array(['1\t2','3\t'],splitchar='\t')
+    array([['1', '2'],
+           ['3', '']],
+          dtype='<U1')
+
+    @param lines: lines of text (without return characters)
+    @type lines: list of str
+    @param splitchar: character seperating entries in a row (default: whitespace)
+    @type splitchar: str or None
+    @return: array of shape (number of lines, number of entries)
+    @rtype: ndarray
+    """
+    if not len(lines):
+        return np.zeros((0,0),str)
+    counts = _count_fields(lines,splitchar)
+    ncols = counts[0]
+    if np.all(counts==ncols):
+        if splitchar is None:
+            cells = ' '.join(lines).split()
+        else:
+            cells = splitchar.join(lines).split(splitchar)
+        if len(cells)==len(lines)*ncols:
+            return np.array(cells).reshape(len(lines),ncols)
+    return np.array([line.split(splitchar) for line in lines])
+
+def fixwidth2array(lines,indices):
+    """
+    Cut lines of text into a 2D array of strings at fixed positions.
+
+    Column C{i} contains the characters between positions C{indices[i]} and
+    C{indices[i+1]}. Surrounding whitespace is not removed.
+
+    >>> fixwidth2array(['  1.0  ab','  2.5   c'],[0,5,9])
+    array([['  1.0', '  ab'],
+           ['  2.5', '   c']],
+          dtype='<U5')
+
+    @param lines: lines of text (without return characters)
+    @type lines: list of str
+    @param indices: positions separating the columns
+    @type indices: list of int
+    @return: array of shape (number of lines, number of columns)
+    @rtype: ndarray
+    """
+    width = max(indices[-1],max([len(line) for line in lines]))
+    chars = np.array(lines,'U%d'%(width)).view('U1').reshape(len(lines),width)
+    cols = []
+    for start,end in zip(indices[:-1],indices[1:]):
+        cols.append(np.ascontiguousarray(chars[:,start:end]).view('U%d'%(end-start))[:,0])
+    return np.column_stack(cols)
+
+def str2column(col,dtype,null_values=(),prefix=''):
+    """
+    Convert a column of strings to a column of a given dtype.
+
+    Empty entries, entries consisting only of whitespace and entries listed in
+    C{null_values} are missing values: they become C{nan} (or the string
+    C{'nan'} for string columns). Non-missing entries of string columns can
+    be given a C{prefix}.
+
+    All steps work on the whole column at once: blank entries are detected on
+    a character view of the column, and numerical columns are converted with
+    one cast.
+
+    >>> str2column(np.array(['1.5','  ','null']),'f8',null_values=('null',))
+    array([ 1.5,  nan,  nan])
+
+    @param col: column of strings
+    @type col: ndarray
+    @param dtype: dtype of the output column
+    @type dtype: numpy dtype
+    @param null_values: extra entries denoting missing values
+    @type null_values: tuple of str
+    @param prefix: string to prepend to non-missing entries of string columns
+    @type prefix: str
+    @return: converted column
+    @rtype: ndarray
+    """
+    dtype = np.dtype(dtype)
+    col = np.ascontiguousarray(col,str)
+    if len(col)==0:
+        return np.zeros(0,dtype)
+    #-- an entry is blank if it contains no character beyond the space
+    width = col.dtype.itemsize//4
+    chars = col.view('U1').reshape(len(col),width)
+    missing = ~np.any(chars>' ',axis=1)
+    if dtype.kind in 'US':
+        if null_values:
+            missing |= np.in1d(np.char.strip(col),null_values)
+        if prefix:
+            chars_ = np.empty((len(col),width+len(prefix)),'U1')
+            chars_[:,:len(prefix)] = list(prefix)
+            chars_[:,len(prefix):] = chars
+            col = chars_.view('U%d'%(width+len(prefix)))[:,0]
+        return np.where(missing,'nan',col).astype(dtype)
+    output = np.empty(len(col),dtype)
+    output[missing] = np.nan
+    try:
+        output[~missing] = _parse_numbers(col[~missing],dtype)
+    except ValueError:
+        #-- only look for null values when there are any
+        if not null_values:
+            raise
+        missing |= np.in1d(np.char.strip(col),null_values)
+        output[missing] = np.nan
+        output[~missing] = _parse_numbers(col[~missing],dtype)
+    return output
+
+def _parse_numbers(col,dtype):
+    """
+    Parse a column of strings to numbers.
+
+    Floats are converted from the list of strings in one call, which is much
+    faster than casting the string array. Invalid entries (e.g. entries
+    containing spaces or other characters) raise a ValueError.
+    """
+    if np.dtype(dtype).kind!='f':
+        return col.astype(dtype)
+    return np.array(col.tolist(),dtype=dtype)
+
+def _open(filename):
+    """
+    Open a (gzipped) text file for reading.
+    """
+    if os.path.splitext(filename)[1] == '.gz':
+        return gzip.open(filename,mode='rt')
+    else:
+        return open(filename)
+
+def _read_lines(filename,skip_lines=0,**kwargs):
+    """
+    Read the data lines and comment lines of an ASCII file.
+
+    The whole file is read at once. For the keyword arguments, see
+    L{read2list}.
+
+    @return: data lines, comment lines (both without return characters)
+    @rtype: list of str, list of str
+    """
+    with _open(filename) as ff:
+        lines = ff.read().split('\n')
+    if lines[-1]=='': lines = lines[:-1]
+    return _filter_lines(lines[skip_lines:],**kwargs)
+
+def _filter_lines(lines,commentchar=['#'],skip_empty=True,**kwargs):
+    """
+    Separate data lines from comment lines, and skip empty lines.
+
+    @return: data lines, comment lines (without comment character)
+    @rtype: list of str, list of str
+    """
+    if skip_empty:
+        lines = [line for line in lines if line and not line.isspace()]
+    comm = [line[1:] for line in lines if line and line[0] in commentchar]
+    if comm:
+        lines = [line for line in lines if not (line and line[0] in commentchar)]
+    return lines,comm
+
+def _split_rows(lines,splitchar=None):
+    """
+    Split data lines into lists of entries, as in L{read2list}.
+    """
+    if isinstance(splitchar,list):
+        return [fw2python(line,splitchar) for line in lines]
+    return [line.split(splitchar) for line in lines]
+
+def _count_fields(lines,splitchar=None):
+    """
+    Count the number of entries on each line.
+
+    For whitespace separated lines, the entries are counted on a byte view of
+    the whole text, without splitting the lines. All ASCII control characters
+    are then counted as whitespace, so the counts can only be too high: the
+    total number of entries tells if they are exact.
+
+    @return: number of entries per line
+    @rtype: array of int
+    """
+    if splitchar is not None:
+        return np.array([line.count(splitchar) for line in lines])+1
+    try:
+        text = np.frombuffer('\n'.join(lines).encode('ascii'),np.uint8)
+    except UnicodeEncodeError:
+        #-- non-ASCII whitespace cannot be recognised on bytes
+        return np.array([len(line.split()) for line in lines])
+    #-- an entry starts at a non-whitespace character preceded by whitespace
+    space = text<=32
+    start = np.flatnonzero(space[:-1]>space[1:])+1
+    if len(text) and not space[0]:
+        start = np.hstack([0,start])
+    bounds = np.hstack([0,np.flatnonzero(text==10)+1,len(text)])
+    return np.diff(np.searchsorted(start,bounds))
+
+def _lines2array(lines,splitchar=None,dtype=float):
+    """
+    Convert data lines to an array of a given dtype.
+
+    The result is the same as C{np.array(rows,dtype=dtype)}, where the rows are
+    the output of L{read2list}. If all lines have the same number of entries,
+    floats are parsed from the whole text at once by numpy's parser, and other
+    types are split from the whole text at once.
+
+    @param lines: data lines
+    @type lines: list of str
+    @param splitchar: character seperating entries, or fixed width formats
+    @type splitchar: str, None or list of str
+    @param dtype: type of numpy array
+    @type dtype: numpy dtype
+    @return: data array
+    @rtype: ndarray
+    """
+    dtype = np.dtype(dtype)
+    if not lines:
+        return np.array([],dtype=dtype)
+    if isinstance(splitchar,list):
+        data = _fixwidth2array(lines,splitchar,dtype)
+    elif dtype.kind=='f' and (splitchar is None or splitchar.strip()):
+        data = _lines2numbers(lines,splitchar,dtype)
+    elif dtype.kind in 'fU':
+        data = lines2array(lines,splitchar)
+        if data.ndim==2:
+            data = data.astype(dtype)
+        else:
+            data = None
+    else:
+        data = None
+    if data is None:
+        data = np.array(_split_rows(lines,splitchar),dtype=dtype)
+    return data
+
+def _lines2numbers(lines,splitchar,dtype):
+    """
+    Parse lines of separated numbers in one pass.
+
+    @return: data array, or None if the lines cannot be parsed in one pass
+    @rtype: ndarray
+    """
+    counts = _count_fields(lines,splitchar)
+    ncols = counts[0]
+    if np.any(counts!=ncols):
+        return None
+    if splitchar is None:
+        tokens = ' '.join(lines).split()
+    else:
+        tokens = splitchar.join(lines).split(splitchar)
+    #-- if not all entries are numbers, leave it to numpy to raise the
+    #   appropriate error
+    if len(tokens)!=len(lines)*ncols:
+        return None
+    try:
+        values = np.array(tokens,dtype=dtype)
+    except ValueError:
+        return None
+    return values.reshape(len(lines),ncols)
+
+def _fixwidth2array(lines,fixwidths,dtype):
+    """
+    Convert fixed width lines of numbers to an array.
+
+    Blank entries are replaced by zero, as in L{fw2python}.
+
+    @return: data array, or None if not all columns are numbers
+    @rtype: ndarray
+    """
+    types,length = fws2info(fixwidths)
+    if dtype.kind!='f' or str in types:
+        return None
+    data = fixwidth2array(lines,length)
+    cols = []
+    for i,itype in enumerate(types):
+        col = np.ascontiguousarray(data[:,i])
+        width = col.dtype.itemsize//4
+        chars = col.view('U1').reshape(len(col),width)
+        blank = np.all((chars==' ') | (chars=='\t') | (chars==''),axis=1) & np.any(chars!='',axis=1)
+        col = np.where(blank,'0',col)
+        if itype is int:
+            cols.append(col.astype(int).astype(dtype))
+        else:
+            cols.append(_parse_numbers(col,dtype))
+    return np.column_stack(cols)
+
+def _cast_column(col,dtype):
+    """
+    Cast a column to a given dtype, parsing strings to floats in one pass.
+    """
+    col = np.asarray(col)
+    if col.ndim==1 and col.dtype.kind=='U' and np.dtype(dtype).kind=='f':
+        return _parse_numbers(col,dtype)
+    return col.astype(dtype)
 #}
 
 #{ Source specific
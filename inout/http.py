@@ -1,7 +1,49 @@
 """
 Read or download files from the internet.
+
+Besides the plain L{download} function, this module provides the shared
+fetch layer used by the catalog interfaces (L{ivs.catalogs.vizier},
+L{ivs.catalogs.gator}, L{ivs.catalogs.mast}...):
+
+    - L{retrieve} downloads a URI while respecting a per-host connection
+    limit, and retries failed connections with a per-connection timeout (see
+    L{ivs.aux.decorators.retry_http}).
+    - L{set_cache} switches on a persistent on-disk cache of all responses
+    retrieved via L{retrieve} (see L{ivs.inout.querycache}), with an optional
+    offline mode.
+    - L{map_concurrent} evaluates a list of independent jobs (typically catalog
+    queries) in a thread pool, and returns the results in the order of the
+    jobs, so that combining them is deterministic.
+
+Example usage: query three ViZieR catalogs at once
+
+>>> from ivs.catalogs import vizier
+>>> jobs = [(vizier.search,(source,),dict(ID='vega')) for source in ['I/311/hip2','II/169/main','B/mk/mktypes']]
+>>> hip,geneva,mk = map_concurrent(jobs)
 """
 import urllib.request, urllib.parse, urllib.error
+import os
+import tempfile
+import threading
+import logging
+from concurrent import futures
+
+from ivs import config
+from ivs.aux import decorators
+from ivs.inout import querycache
+
+logger = logging.getLogger("IO.HTTP")
+
+#-- maximum number of simultaneous connections to one host, and the default
+#   number of threads used to evaluate jobs concurrently
+max_connections_per_host = 4
+default_workers = 8
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+#-- persistent query cache, see set_cache
+cache = None
 
 #@decorators.retry_http(3)
 def download(link,filename=None):
@@ -28,4 +70,182 @@ def download(link,filename=None):
         url.close()
         return myfile
     else:
-        return myfile,url
\ No newline at end of file
+        return myfile,url
+
+def retrieve(link,filename=None,data=None,headers=None):
+    """
+    Download the contents of a link to a (temporary) file.
+
+    At most C{max_connections_per_host} downloads from the same host are
+    running at the same time, also when this function is called from different
+    threads. Failed connections are retried.
+
+    If C{data} is given, the request is sent as a POST request (e.g. to upload
+    a list of targets), otherwise as a GET request.
+
+    If a query cache is set (see L{set_cache}), the response is taken from the
+    cache when possible, and otherwise stored in it after downloading.
+
+    The url object is always returned: if no C{filename} is given, the
+    downloaded file is temporary and is deleted when the url object is
+    closed. Remember to close the url after finishing reading!
+
+    @parameter link: the url of the file
+    @type link: string
+    @parameter filename: the name of the file to write to (optional)
+    @type filename: str
+    @parameter data: body of a POST request (optional)
+    @type data: bytes
+    @parameter headers: extra HTTP headers (optional)
+    @type headers: dict
+    @return: output filename, url object
+    @rtype: string, url-like object with a C{close} method
+    """
+    #-- POST requests are identified by their body as well
+    key = link
+    if data is not None:
+        key = link+'\n'+data.decode('latin-1')
+    content = None
+    if cache is not None:
+        content = cache.get(key)
+        if content is None and cache.offline:
+            raise IOError("Offline mode: %s is not in the query cache"%(link))
+    if content is None:
+        content = _download(link,data=data,headers=headers)
+        if cache is not None:
+            cache.put(key,content)
+    return _write_response(content,filename)
+
+def set_cache(filename=None,ttl=None,max_size=None,offline=False):
+    """
+    Switch the persistent query cache on or off.
+
+    All queries made via L{retrieve} (and thus all VizieR, GATOR, MAST and
+    Sesame searches) are stored on disk, and served from there when they are
+    repeated. See L{ivs.inout.querycache} for details.
+
+    Give no filename to switch the cache off.
+
+    @param filename: path to the cache file
+    @type filename: str
+    @param ttl: time-to-live of entries in seconds (None is forever)
+    @type ttl: float
+    @param max_size: maximum size of the cache in bytes (None is unlimited)
+    @type max_size: int
+    @param offline: serve only from the cache, never connect to the network
+    @type offline: bool
+    @return: the cache
+    @rtype: QueryCache
+    """
+    global cache
+    if cache is not None:
+        cache.close()
+    if filename is None:
+        cache = None
+    else:
+        cache = querycache.QueryCache(filename,ttl=ttl,max_size=max_size,offline=offline)
+    return cache
+
+def map_concurrent(jobs,max_workers=None):
+    """
+    Evaluate independent jobs concurrently in a pool of threads.
+
+    Each job is a tuple C{(function,args,kwargs)}. The results are returned
+    in the same order as the jobs, regardless of the order in which they
+    finish. If a job raises an exception, it is re-raised here.
+
+    Threads are well suited for network bound work such as catalog queries:
+    the connections themselves are limited per host in L{retrieve}.
+
+    @param jobs: list of (function,args,kwargs)
+    @type jobs: list of tuples
+    @param max_workers: number of threads (defaults to C{default_workers})
+    @type max_workers: int
+    @return: results of the jobs
+    @rtype: list
+    """
+    if max_workers is None:
+        max_workers = default_workers
+    jobs = list(jobs)
+    #-- no need to set up a thread pool for a single job
+    if len(jobs)<=1 or max_workers<=1:
+        return [function(*args,**kwargs) for function,args,kwargs in jobs]
+    with futures.ThreadPoolExecutor(max_workers=min(max_workers,len(jobs))) as pool:
+        running = [pool.submit(function,*args,**kwargs) for function,args,kwargs in jobs]
+        return [job.result() for job in running]
+
+@decorators.retry_http(3,timeout_arg='timeout')
+def _download(link,data=None,headers=None,timeout=None):
+    """
+    Download a link while respecting the per-host connection limit.
+
+    @parameter link: the url of the file
+    @type link: string
+    @parameter data: body of a POST request (optional)
+    @type data: bytes
+    @parameter headers: extra HTTP headers (optional)
+    @type headers: dict
+    @parameter timeout: timeout of this connection in seconds (set by
+    L{ivs.aux.decorators.retry_http} on every try, so that concurrent
+    downloads do not change each other's timeout)
+    @type timeout: float
+    @return: raw response
+    @rtype: bytes
+    """
+    host = urllib.parse.urlparse(link).netloc
+    request = urllib.request.Request(link,data=data,headers=headers or {})
+    with _get_host_semaphore(host):
+        with urllib.request.urlopen(request,timeout=timeout) as ff:
+            content = ff.read()
+    return content
+
+def _write_response(content,filename=None):
+    """
+    Write a response to a (temporary) file.
+
+    @param content: raw response
+    @type content: bytes
+    @parameter filename: the name of the file to write to (optional)
+    @type filename: str
+    @return: output filename, url-like object to close
+    @rtype: string, _Response
+    """
+    if filename is None:
+        handle,myfile = tempfile.mkstemp()
+        os.close(handle)
+    else:
+        myfile = filename
+    with open(myfile,'wb') as ff:
+        ff.write(content)
+    return myfile,_Response(filename is None and myfile or None)
+
+class _Response(object):
+    """
+    Url-like object of a retrieved response.
+
+    Closing it deletes the temporary file, if any, like for a URLopener.
+    """
+    def __init__(self,path=None):
+        self.path = path
+
+    def close(self):
+        if self.path is not None and os.path.isfile(self.path):
+            os.unlink(self.path)
+        self.path = None
+
+def _get_host_semaphore(host):
+    """
+    Return the semaphore limiting the number of connections to a host.
+
+    @param host: network location of the url
+    @type host: str
+    @return: semaphore for this host
+    @rtype: BoundedSemaphore
+    """
+    with _host_semaphores_lock:
+        if not host in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(max_connections_per_host)
+        return _host_semaphores[host]
+
+if config.query_cache is not None:
+    set_cache(**config.query_cache)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache for web queries.
+
+The raw responses of catalog queries (VizieR, GATOR, MAST, Sesame) are stored
+in a single SQLite file, keyed on the final query URI. Identical queries are
+then served from disk instead of from the network. The responses are stored
+compressed, and each entry remembers when it was downloaded and when it was
+last used, so that the cache can:
+
+    - discard entries older than a time-to-live (C{ttl}, in seconds),
+    - stay below a maximum size (C{max_size}, in bytes) by removing the least
+    recently used entries,
+    - run in C{offline} mode, in which no network connections are made at all:
+    every response is served from the cache regardless of its age, and
+    queries that are not in the cache fail.
+
+You normally do not use this module directly, but switch on the cache of
+L{ivs.inout.http}, through which all catalog queries go:
+
+>>> from ivs.inout import http
+>>> cache = http.set_cache('/home/user/.ivs_queries.sqlite',ttl=30*24*3600.)
+
+Re-running a script for the same targets now makes no network connections for
+queries that were already done. To inspect the cache, do
+
+>>> print(cache.stats())
+{'hits': 12, 'misses': 0, 'expired': 0, 'entries': 12, 'size': 40923}
+
+To work without a network connection:
+
+>>> cache = http.set_cache('/home/user/.ivs_queries.sqlite',offline=True)
+
+The cache can safely be shared between threads and processes.
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger("IO.CACHE")
+
+
+class QueryCache(object):
+    """
+    Store raw query responses in an SQLite file, keyed on the query URI.
+    """
+    def __init__(self,filename,ttl=None,max_size=None,offline=False):
+        """
+        Open (or create) a query cache.
+
+        @param filename: path to the SQLite file
+        @type filename: str
+        @param ttl: time-to-live of entries in seconds (None is forever)
+        @type ttl: float
+        @param max_size: maximum size of all stored responses in bytes (None
+        is unlimited)
+        @type max_size: int
+        @param offline: serve only from the cache
+        @type offline: bool
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        direc = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(direc):
+            os.makedirs(direc)
+        self._connection = sqlite3.connect(filename,timeout=60.,check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                        key TEXT PRIMARY KEY, uri TEXT,
+                                        created REAL, accessed REAL,
+                                        size INTEGER, content BLOB)""")
+            self._connection.execute("""CREATE INDEX IF NOT EXISTS accessed_index
+                                        ON responses (accessed)""")
+        logger.info('Opened query cache %s'%(filename))
+
+    def get(self,uri):
+        """
+        Retrieve the response to a query from the cache.
+
+        Expired entries are not returned (except in offline mode), but are
+        removed from the cache.
+
+        @param uri: query URI
+        @type uri: str
+        @return: raw response, or None if the query is not (validly) cached
+        @rtype: bytes
+        """
+        key = _uri2key(uri)
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT created,content FROM responses WHERE key=?",(key,)).fetchone()
+            if row is not None and self.ttl is not None and not self.offline and (now-row[0])>self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key=?",(key,))
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                logger.debug('Cache miss: %s'%(uri))
+                return None
+            self._connection.execute("UPDATE responses SET accessed=? WHERE key=?",(now,key))
+            self.hits += 1
+        logger.debug('Cache hit: %s'%(uri))
+        return zlib.decompress(row[1])
+
+    def put(self,uri,content):
+        """
+        Store the response to a query in the cache.
+
+        If the cache grows beyond its maximum size, the least recently used
+        entries are removed.
+
+        @param uri: query URI
+        @type uri: str
+        @param content: raw response
+        @type content: bytes
+        """
+        key = _uri2key(uri)
+        now = time.time()
+        content = zlib.compress(content)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)",
+                                     (key,uri,now,now,len(content),sqlite3.Binary(content)))
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self,max_size=None):
+        """
+        Remove expired entries, and the least recently used entries until the
+        total size is below C{max_size}.
+
+        @param max_size: maximum size of all stored responses in bytes
+        (defaults to the cache's C{max_size})
+        @type max_size: int
+        @return: number of removed entries
+        @rtype: int
+        """
+        if max_size is None:
+            max_size = self.max_size
+        removed = 0
+        with self._lock, self._connection:
+            if self.ttl is not None and not self.offline:
+                removed += self._connection.execute("DELETE FROM responses WHERE created<?",
+                                                    (time.time()-self.ttl,)).rowcount
+            if max_size is not None:
+                total = self._connection.execute("SELECT TOTAL(size) FROM responses").fetchone()[0]
+                if total>max_size:
+                    rows = self._connection.execute("SELECT key,size FROM responses ORDER BY accessed").fetchall()
+                    keys = []
+                    for key,size in rows:
+                        if total<=max_size: break
+                        keys.append((key,))
+                        total -= size
+                    self._connection.executemany("DELETE FROM responses WHERE key=?",keys)
+                    removed += len(keys)
+        if removed:
+            logger.info('Removed %d entries from query cache'%(removed))
+        return removed
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+        self._connection.execute("VACUUM")
+
+    def stats(self):
+        """
+        Summarize the use of the cache.
+
+        Hits, misses and expired entries are counted since the cache was
+        opened, the number of entries and the size (in bytes, compressed)
+        refer to the whole cache file.
+
+        @return: hits, misses, expired, entries and size
+        @rtype: dict
+        """
+        with self._lock:
+            entries,size = self._connection.execute("SELECT COUNT(*),TOTAL(size) FROM responses").fetchone()
+        return dict(hits=self.hits,misses=self.misses,expired=self.expired,
+                    entries=entries,size=int(size))
+
+    def close(self):
+        """
+        Close the connection to the cache file.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+def _uri2key(uri):
+    """
+    Convert a URI to a cache key.
+
+    @param uri: query URI
+    @type uri: str
+    @return: hexadecimal SHA1 digest of the URI
+    @rtype: str
+    """
+    return hashlib.sha1(uri.encode('utf-8')).hexdigest()
@@ -1,7 +1,22 @@
 import os
+import re
+import gzip
+import time
+import warnings
+import socket
+import threading
+import socketserver
+import http.server
 import h5py
 import numpy as np
+import urllib.parse
 from ivs.inout import hdf5
+from ivs.inout import ascii
+from ivs.inout import http as ivshttp
+from ivs.inout import querycache
+from ivs.aux import decorators
+from ivs.catalogs import vizier
+from ivs.catalogs import gator
 
 import unittest
 
@@ -107,3 +122,349 @@ class HDF5TestCase(unittest.TestCase):
 
 
 
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the requested path back after a delay given in the query
+
+    If C{peak} is set, every request is held until that many connections have
+    been open at the same time (or a timeout passes).
+    """
+    active = 0
+    max_active = 0
+    peak = None
+    lock = threading.Condition()
+
+    def do_GET(self):
+        with self.lock:
+            StandInHandler.active += 1
+            StandInHandler.max_active = max(StandInHandler.max_active,StandInHandler.active)
+            self.lock.notify_all()
+            if StandInHandler.peak is not None:
+                self.lock.wait_for(lambda:StandInHandler.max_active>=StandInHandler.peak,timeout=10.)
+        path,delay = self.path.split('?delay=')
+        time.sleep(float(delay))
+        with self.lock:
+            StandInHandler.active -= 1
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(path.encode('utf-8'))
+
+    def log_message(self,*args):
+        pass
+
+class StandInServer(socketserver.ThreadingMixIn,http.server.HTTPServer):
+    daemon_threads = True
+
+class HTTPTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(('127.0.0.1',0),StandInHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d'%(self.server.server_address[1])
+        StandInHandler.max_active = 0
+        StandInHandler.peak = None
+
+    def tearDown(self):
+        StandInHandler.peak = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _read(self,link):
+        filen,url = ivshttp.retrieve(link)
+        with open(filen,'r') as ff:
+            contents = ff.read()
+        url.close()
+        return contents
+
+    def testRetrieve(self):
+        """ inout.http.retrieve() """
+        self.assertEqual(self._read(self.base+'/catalog?delay=0'),'/catalog')
+
+    def testMapConcurrentOrder(self):
+        """ inout.http.map_concurrent() order """
+        #-- the first jobs finish last
+        links = [self.base+'/cat%d?delay=%.2f'%(i,0.05*(5-i)) for i in range(6)]
+        output = ivshttp.map_concurrent([(self._read,(link,),{}) for link in links])
+        self.assertListEqual(output,['/cat%d'%(i) for i in range(6)])
+
+    def testHostLimit(self):
+        """ inout.http.map_concurrent() connections per host """
+        #-- hold the requests until the limit is reached, so that the peak
+        #   does not depend on timing
+        StandInHandler.peak = ivshttp.max_connections_per_host
+        links = [self.base+'/cat%d?delay=0'%(i) for i in range(12)]
+        output = ivshttp.map_concurrent([(self._read,(link,),{}) for link in links],max_workers=12)
+        self.assertEqual(len(output),12)
+        self.assertEqual(StandInHandler.max_active,ivshttp.max_connections_per_host)
+
+    def testRetryTimeout(self):
+        """ aux.decorators.retry_http() per-call timeout """
+        timeouts = []
+        @decorators.retry_http(3,timeout_arg='timeout')
+        def fail(timeout=None):
+            timeouts.append(timeout)
+            raise IOError('no connection')
+        default = socket.getdefaulttimeout()
+        self.assertRaises(IOError,fail)
+        self.assertEqual(len(timeouts),3)
+        self.assertEqual(timeouts[1:],[2*timeouts[0],4*timeouts[0]])
+        self.assertEqual(socket.getdefaulttimeout(),default)
+
+    def testCachedRetrieve(self):
+        """ inout.http.retrieve() with query cache """
+        link = self.base+'/catalog?delay=0'
+        try:
+            cache = ivshttp.set_cache('test_cache.sqlite')
+            self.assertEqual(self._read(link),'/catalog')
+            self.server.shutdown()
+            self.assertEqual(self._read(link),'/catalog')
+            self.assertEqual(cache.stats()['hits'],1)
+            self.assertEqual(cache.stats()['misses'],1)
+            cache = ivshttp.set_cache('test_cache.sqlite',offline=True)
+            self.assertEqual(self._read(link),'/catalog')
+            self.assertRaises(IOError,self._read,self.base+'/other?delay=0')
+        finally:
+            ivshttp.set_cache(None)
+            os.remove('test_cache.sqlite')
+
+class CatalogHandler(http.server.BaseHTTPRequestHandler):
+    """Answer multi-target VizieR and Gator queries with one row per target
+
+    Every row lies 1.5 arcsec north of its target, and its measurements equal
+    the declination of the target. The request bodies are recorded in
+    C{bodies}.
+    """
+    bodies = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('ascii')
+        with self.lock:
+            CatalogHandler.bodies.append(body)
+        if self.path.startswith('/viz-bin'):
+            response = self.vizier(body)
+        else:
+            response = self.gator(body)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(response.encode('ascii'))
+
+    def vizier(self,body):
+        query = urllib.parse.parse_qs(body)
+        targets = query['-c'][0].split('\n')[1:-1]
+        names,units = ['_r','_RAJ2000','_DEJ2000','_q'],['arcmin','deg','deg','']
+        for key,value in vizier.cat_info.items(query['-source'][0]):
+            if key=='bibcode': continue
+            names.append(key[:2]=='e_' and value or key)
+            units.append('mag')
+        lines = ['#Column\t%s\t(F12.8)'%(name) for name in names]
+        lines += ['\t'.join(names),'\t'.join(units),'\t'.join(['-']*len(names))]
+        for i,target in enumerate(targets):
+            ra,dec = [float(x) for x in target.split()]
+            row = [0.025,ra,dec+1.5/3600.,i+1]+[dec]*(len(names)-4)
+            lines.append('\t'.join(['%12.8f'%(x) for x in row]))
+        return '\n'.join(lines)+'\n'
+
+    def gator(self,body):
+        catalog = re.search('name="catalog"\r\n\r\n(.*?)\r\n',body).group(1)
+        names = ['cntr_01','dist_x','ra_01','dec_01','ra','dec']
+        units = ['','arcsec','deg','deg','deg','deg']
+        for key,value in gator.cat_info.items(catalog):
+            if key=='bibcode': continue
+            names.append(key[:2]=='e_' and value or key)
+            units.append('mJy')
+        lines = ['|'+'|'.join(['%15s'%(name) for name in names])+'|',
+                 '|'+'|'.join(['%15s'%('double') for name in names])+'|',
+                 '|'+'|'.join(['%15s'%(unit) for unit in units])+'|']
+        #-- only the first catalog contains the targets
+        if catalog==gator.cat_info.sections()[0]:
+            table = body.split('filename="targets.tbl"')[1].split('\r\n\r\n')[1].split('\r\n--')[0]
+            for i,line in enumerate(table.split('\n')[2:-1]):
+                ra,dec = [float(x) for x in line.split()]
+                row = [i+1,1.5,ra,dec,ra,dec+1.5/3600.]+[dec]*(len(names)-6)
+                lines.append(' '+' '.join(['%15.8f'%(x) for x in row])+' ')
+        return '\n'.join(lines)+'\n'
+
+    def log_message(self,*args):
+        pass
+
+class CatalogBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(('127.0.0.1',0),CatalogHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.mirror,self.query_url = vizier.mirrors['current'],gator.query_url
+        vizier.mirrors['current'] = '127.0.0.1:%d'%(self.server.server_address[1])
+        gator.query_url = 'http://127.0.0.1:%d/gator'%(self.server.server_address[1])
+        CatalogHandler.bodies = []
+        #-- the first two targets are 2 arcsec apart
+        self.ra = np.array([10.,10.,200.])
+        self.dec = np.array([20.,20.+2./3600.,-30.])
+
+    def tearDown(self):
+        vizier.mirrors['current'],gator.query_url = self.mirror,self.query_url
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testVizierSearchBatch(self):
+        """ catalogs.vizier.search_batch() and split_targets() """
+        results,units,comms = vizier.search_batch('I/239/hip_main',self.ra,self.dec,radius=5.,chunk_size=2)
+        #-- one request per chunk, with the targets as a list block
+        self.assertEqual(len(CatalogHandler.bodies),2)
+        for body,(start,end) in zip(sorted(CatalogHandler.bodies,key=len,reverse=True),[(0,2),(2,3)]):
+            query = urllib.parse.parse_qs(body)
+            self.assertEqual(query['-out.add'],['_q'])
+            self.assertEqual(query['-c.rs'],['5.0'])
+            self.assertEqual(query['-source'],['I/239/hip_main'])
+            targets = ['%.7f %+.7f'%(ra,dec) for ra,dec in zip(self.ra[start:end],self.dec[start:end])]
+            self.assertEqual(query['-c'][0],'\n'.join(['<<====targets']+targets+['====targets']))
+        self.assertEqual(list(results['_q']),[1,2,3])
+        #-- the row of the first target is closer to the second one: it
+        #   should still be assigned to the first
+        per_target = vizier.split_targets(results,self.ra,self.dec,5.,units=units)
+        self.assertEqual([len(rows) for rows in per_target],[1,1,1])
+        self.assertTrue(np.allclose([rows['Hpmag'][0] for rows in per_target],self.dec))
+        self.assertTrue(np.allclose([rows['_r'][0] for rows in per_target],0.025,atol=1e-5))
+        #-- without target index, rows go to the nearest target
+        per_target = vizier.split_targets(results,self.ra,self.dec,5.,q_col=None,units=units)
+        self.assertEqual([0 if rows is None else len(rows) for rows in per_target],[0,2,1])
+
+    def testVizierPhotometryBatch(self):
+        """ catalogs.vizier.get_photometry_batch() """
+        masters = vizier.get_photometry_batch(self.ra,self.dec,sources=['I/239/hip_main','II/246/out'],
+                                              to_units=None,radius=5.,chunk_size=2)
+        self.assertEqual(len(CatalogHandler.bodies),4)
+        self.assertEqual(sorted([urllib.parse.parse_qs(body)['-source'][0] for body in CatalogHandler.bodies]),
+                         ['I/239/hip_main']*2+['II/246/out']*2)
+        photbands = sorted(['TYCHO2.BT','TYCHO2.VT','HIPPARCOS.HP','2MASS.J','2MASS.H','2MASS.KS'])
+        for i,master in enumerate(masters):
+            self.assertEqual(sorted(master['photband']),photbands)
+            self.assertTrue(np.allclose(master['meas'],self.dec[i]))
+            self.assertTrue(np.allclose(master['_r'],0.025,atol=1e-5))
+            self.assertTrue(np.allclose(master['_DEJ2000'],self.dec[i]+1.5/3600.))
+
+    def testGatorPhotometryBatch(self):
+        """ catalogs.gator.get_photometry_batch() """
+        source = gator.cat_info.sections()[0]
+        masters = gator.get_photometry_batch(self.ra,self.dec,to_units=None,radius=5.,chunk_size=2)
+        #-- one upload per chunk and catalog
+        self.assertEqual(len(CatalogHandler.bodies),2*len(gator.cat_info.sections()))
+        bodies = [body for body in CatalogHandler.bodies if 'name="catalog"\r\n\r\n%s\r\n'%(source) in body]
+        self.assertEqual(len(bodies),2)
+        for body in bodies:
+            self.assertTrue('name="spatial"\r\n\r\nUpload\r\n' in body)
+            self.assertTrue('name="uradius"\r\n\r\n5.0\r\n' in body)
+        for ra,dec in zip(self.ra,self.dec):
+            self.assertEqual(sum([' %15.7f %15.7f '%(ra,dec) in body for body in bodies]),1)
+        #-- one master per target, with the distance to its own target
+        nbands = len([key for key in gator.cat_info.options(source) if key[:2]!='e_' and key!='bibcode'])
+        self.assertEqual([len(master) for master in masters],[nbands]*3)
+        for i,master in enumerate(masters):
+            self.assertTrue(np.all(master['source']==source))
+            self.assertTrue(np.allclose(master['meas'],self.dec[i]))
+            self.assertTrue(np.allclose(master['_r'],1.5,atol=1e-3))
+            self.assertTrue(np.allclose(master['_DEJ2000'],self.dec[i]+1.5/3600.))
+
+class QueryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = 'test_querycache.sqlite'
+
+    def tearDown(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def testExpire(self):
+        """ inout.querycache.QueryCache ttl """
+        cache = querycache.QueryCache(self.filename,ttl=0.05)
+        cache.put('http://host/query',b'response')
+        self.assertEqual(cache.get('http://host/query'),b'response')
+        time.sleep(0.1)
+        self.assertEqual(cache.get('http://host/query'),None)
+        self.assertEqual(cache.stats()['expired'],1)
+        self.assertEqual(cache.stats()['entries'],0)
+        cache.close()
+
+    def testEvict(self):
+        """ inout.querycache.QueryCache max_size """
+        cache = querycache.QueryCache(self.filename)
+        contents = [os.urandom(1000) for i in range(5)]
+        for i,content in enumerate(contents):
+            cache.put('http://host/query%d'%(i),content)
+        #-- use the first one, so that the second is the least recently used
+        self.assertEqual(cache.get('http://host/query0'),contents[0])
+        cache.evict(max_size=cache.stats()['size']-1)
+        self.assertEqual(cache.get('http://host/query1'),None)
+        self.assertEqual(cache.get('http://host/query0'),contents[0])
+        self.assertEqual(cache.stats()['entries'],4)
+        cache.close()
+
+class AsciiColumnsTestCase(unittest.TestCase):
+
+    def testLines2Array(self):
+        """ inout.ascii.lines2array """
+        data = ascii.lines2array(['1\t a\t','2\tb\t3'],'\t')
+        self.assertEqual(data.shape,(2,3))
+        self.assertEqual(list(data[:,1]),[' a','b'])
+        self.assertEqual(list(data[:,2]),['','3'])
+
+    def testFixwidth2Array(self):
+        """ inout.ascii.fixwidth2array """
+        data = ascii.fixwidth2array(['  1.0  ab','  2.5'],[0,5,9])
+        self.assertEqual(list(data[:,0]),['  1.0','  2.5'])
+        self.assertEqual(list(data[:,1]),['  ab',''])
+
+    def testStr2Column(self):
+        """ inout.ascii.str2column """
+        col = np.array(['1.5','  ','null',' 2e3 '])
+        output = ascii.str2column(col,'f8',null_values=('null',))
+        self.assertTrue(np.all(np.isnan(output[1:3])))
+        self.assertEqual(list(output[[0,3]]),[1.5,2000.])
+        self.assertRaises(ValueError,ascii.str2column,col,'f8')
+        #-- invalid entries should not rely on deprecated partial parsing
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertRaises(ValueError,ascii.str2column,np.array(['1.5','2 3','4']),'f8')
+            self.assertEqual(list(ascii.str2column(np.array(['1.5','x']),'f8',null_values=('x',)))[0],1.5)
+        output = ascii.str2column(np.array(['ab',' ','null']),'U10',null_values=('null',),prefix='  ')
+        self.assertEqual(list(output),['  ab','nan','nan'])
+
+    def testRead2Array(self):
+        """ inout.ascii.read2array and iter_read2array """
+        filename = 'test_read2array.dat.gz'
+        with gzip.open(filename,'wt') as ff:
+            ff.write('# wave flux\n')
+            for i in range(25):
+                ff.write(' %d\t%.3e\n'%(i,i**2/3.))
+            ff.write('\n#end\n')
+        try:
+            data,comms = ascii.read2array(filename,return_comments=True)
+            self.assertEqual(comms,[' wave flux','end'])
+            self.assertEqual(data.shape,(25,2))
+            self.assertEqual(list(data[:,1]),[float('%.3e'%(i**2/3.)) for i in range(25)])
+            chunks = list(ascii.iter_read2array(filename,chunk_size=10))
+            self.assertEqual([len(chunk) for chunk in chunks],[9,10,6])
+            self.assertTrue(np.all(np.vstack(chunks)==data))
+            data = ascii.read2array(filename,dtype=str)
+            self.assertEqual(list(data[:2,0]),['0','1'])
+        finally:
+            os.remove(filename)
+
+    def testRead2ArraySeparated(self):
+        """ inout.ascii.read2array with separator """
+        filename = 'test_read2array.csv'
+        try:
+            with open(filename,'w') as ff:
+                ff.write('1, 2.5,3\n4,5e1 ,6\n')
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                data = ascii.read2array(filename,splitchar=',')
+                self.assertEqual(data.tolist(),[[1.,2.5,3.],[4.,50.,6.]])
+                with open(filename,'w') as ff:
+                    ff.write('1,2,3\n4,x,6\n')
+                self.assertRaises(ValueError,ascii.read2array,filename,splitchar=',')
+        finally:
+            os.remove(filename)
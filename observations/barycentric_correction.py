@@ -12,6 +12,9 @@ def baryvel(dje, deq=0):
 
   This function takes into account the Earth-Moon motion, and is useful for
   radial velocity work to an accuracy of  ~1 m/s.
+
+  For an array of dates, all series terms are evaluated at once, and the
+  velocity components have shape (3,)+dje.shape.
   
   dvel_hel, dvel_bary = baryvel(dje, deq)
    
@@ -97,38 +100,34 @@ def baryvel(dje, deq=0):
   ccpamv = np.array([8.326827e-11, 1.843484e-11, 1.988712e-12, 1.881276e-12])
   dc1mme = 0.99999696e0
   
-  #Time arguments.
-  dt = (dje - dcto) / dcjul
-  tvec = np.array([1e0, dt, dt * dt])
+  #Time arguments. All terms are evaluated for all dates at once: the
+  # arrays of terms have the dates along the last axis.
+  dje = np.asarray(dje, dtype=float)
+  shape = dje.shape
+  dt = (dje.ravel() - dcto) / dcjul
+  tvec = np.array([np.ones_like(dt), dt, dt * dt])
   
   #Values of all elements for the instant dje.
-  temp = (np.transpose(np.dot(np.transpose(tvec), np.transpose(dcfel)))) % dc2pi
+  temp = np.dot(dcfel, tvec) % dc2pi
   dml = temp[0]
   forbel = temp[1:8]
   g = forbel[0]      #old fortran equivalence
   
-  deps = (tvec * dceps).sum() % dc2pi
-  sorbel = (np.transpose(np.dot(np.transpose(tvec), np.transpose(ccsel)))) % dc2pi
+  deps = np.dot(dceps, tvec) % dc2pi
+  sorbel = np.dot(ccsel, tvec) % dc2pi
   e = sorbel[0]     #old fortran equivalence
   
   #Secular perturbations in longitude.
-  dummy = np.cos(2.0)
-  sn = np.sin((np.transpose(np.dot(np.transpose(tvec[0:2]), np.transpose(ccsec[:,1:3])))) % cc2pi)
+  sn = np.sin(np.dot(ccsec[:,1:3], tvec[0:2]) % cc2pi)
   
   #Periodic perturbations of the emb (earth-moon barycenter).
-  pertl = (ccsec[:,0] * sn).sum() + dt * ccsec3 * sn[2]
-  pertld = 0.0
-  pertr = 0.0
-  pertrd = 0.0
-  for k in range(0, 15):
-    a = (dcargs[k,0] + dt * dcargs[k,1]) % dc2pi
-    cosa = np.cos(a)
-    sina = np.sin(a)
-    pertl = pertl + ccamps[k,0] * cosa + ccamps[k,1] * sina
-    pertr = pertr + ccamps[k,2] * cosa + ccamps[k,3] * sina
-    if k < 11:   
-      pertld = pertld + (ccamps[k,1] * cosa - ccamps[k,0] * sina) * ccamps[k,4]
-      pertrd = pertrd + (ccamps[k,3] * cosa - ccamps[k,2] * sina) * ccamps[k,4]
+  a = (dcargs[:,0:1] + dt * dcargs[:,1:2]) % dc2pi
+  cosa = np.cos(a)
+  sina = np.sin(a)
+  pertl = np.dot(ccsec[:,0], sn) + dt * ccsec3 * sn[2] + np.dot(ccamps[:,0], cosa) + np.dot(ccamps[:,1], sina)
+  pertr = np.dot(ccamps[:,2], cosa) + np.dot(ccamps[:,3], sina)
+  pertld = np.dot(ccamps[:11,1] * ccamps[:11,4], cosa[:11]) - np.dot(ccamps[:11,0] * ccamps[:11,4], sina[:11])
+  pertrd = np.dot(ccamps[:11,3] * ccamps[:11,4], cosa[:11]) - np.dot(ccamps[:11,2] * ccamps[:11,4], sina[:11])
       
   #Elliptic part of the motion of the emb.
   phi = (e * e / 4e0) * (((8e0 / e) - e) * np.sin(g) + 5 * np.sin(2 * g) + (13 / 3e0) * e * np.sin(3 * g))
@@ -151,18 +150,13 @@ def baryvel(dje, deq=0):
   
   #Influence of eccentricity, evection and variation on the geocentric
   # motion of the moon.
-  pertl = 0.0
-  pertld = 0.0
-  pertp = 0.0
-  pertpd = 0.0
-  for k in range(0, 3):
-    a = (dcargm[k,0] + dt * dcargm[k,1]) % dc2pi
-    sina = np.sin(a)
-    cosa = np.cos(a)
-    pertl = pertl + ccampm[k,0] * sina
-    pertld = pertld + ccampm[k,1] * cosa
-    pertp = pertp + ccampm[k,2] * cosa
-    pertpd = pertpd - ccampm[k,3] * sina
+  a = (dcargm[:,0:1] + dt * dcargm[:,1:2]) % dc2pi
+  sina = np.sin(a)
+  cosa = np.cos(a)
+  pertl = np.dot(ccampm[:,0], sina)
+  pertld = np.dot(ccampm[:,1], cosa)
+  pertp = np.dot(ccampm[:,2], cosa)
+  pertpd = -np.dot(ccampm[:,3], sina)
     
   #Heliocentric motion of the earth.
   tl = forbel[1] + pertl
@@ -176,17 +170,13 @@ def baryvel(dje, deq=0):
   dzhd = -sigma * ccfdi * np.cos(forbel[2])
   
   #Barycentric motion of the earth.
-  dxbd = dxhd * dc1mme
-  dybd = dyhd * dc1mme
-  dzbd = dzhd * dc1mme
-  for k in range(0, 4):
-    plon = forbel[k + 3]
-    pomg = sorbel[k + 1]
-    pecc = sorbel[k + 9]
-    tl = (plon + 2.0 * pecc * np.sin(plon - pomg)) % cc2pi
-    dxbd = dxbd + ccpamv[k] * (np.sin(tl) + pecc * np.sin(pomg))
-    dybd = dybd - ccpamv[k] * (np.cos(tl) + pecc * np.cos(pomg))
-    dzbd = dzbd - ccpamv[k] * sorbel[k + 13] * np.cos(plon - sorbel[k + 5])
+  plon = forbel[3:7]
+  pomg = sorbel[1:5]
+  pecc = sorbel[9:13]
+  tl = (plon + 2.0 * pecc * np.sin(plon - pomg)) % cc2pi
+  dxbd = dxhd * dc1mme + np.dot(ccpamv, np.sin(tl) + pecc * np.sin(pomg))
+  dybd = dyhd * dc1mme - np.dot(ccpamv, np.cos(tl) + pecc * np.cos(pomg))
+  dzbd = dzhd * dc1mme - np.dot(ccpamv, sorbel[13:17] * np.cos(plon - sorbel[5:9]))
     
   #Transition to mean equator of date.
   dcosep = np.cos(deps)
@@ -198,18 +188,18 @@ def baryvel(dje, deq=0):
   
   #Epoch of mean equinox (deq) of zero implies that we should use
   # Julian ephemeris date (dje) as epoch of mean equinox.
-  if deq == 0:   
-    dvelh = au * (np.array([dxhd, dyahd, dzahd]))
-    dvelb = au * (np.array([dxbd, dyabd, dzabd]))
-    return (dvelh,dvelb)
+  dvelh = au * (np.array([dxhd, dyahd, dzahd]))
+  dvelb = au * (np.array([dxbd, dyabd, dzabd]))
+  if np.all(deq == 0):
+    return (dvelh.reshape((3,)+shape),dvelb.reshape((3,)+shape))
   
   #General precession from epoch dje to deq.
-  deqdat = (dje - dcto - dcbes) / dctrop + dc1900
+  deqdat = (dje.ravel() - dcto - dcbes) / dctrop + dc1900
   prema = premat(deqdat, deq, fk4=True)
-  dvelh = au * (np.transpose(np.dot(np.transpose(prema), np.transpose(np.array([dxhd, dyahd, dzahd])))))
-  dvelb = au * (np.transpose(np.dot(np.transpose(prema), np.transpose(np.array([dxbd, dyabd, dzabd])))))
+  dvelh = np.einsum('...ji,j...->i...', prema, dvelh)
+  dvelb = np.einsum('...ji,j...->i...', prema, dvelb)
   
-  return (dvelh, dvelb)
+  return (dvelh.reshape((3,)+shape), dvelb.reshape((3,)+shape))
 
 def bprecess(ra0, dec0, mu_radec=None, parallax=None, rad_vel=None, epoch=None):
   """
@@ -305,61 +295,56 @@ def bprecess(ra0, dec0, mu_radec=None, parallax=None, rad_vel=None, epoch=None):
   sinra = np.sin(ra_rad)
   cosdec = np.cos(dec_rad)
   sindec = np.sin(dec_rad)
-  dec_1950 = dec * 0.
-  ra_1950 = ra * 0.
-  
-  for i in range(n):
-    # Following statement moved inside loop in Feb 2000.
-    a = 1e-6 * np.array([-1.62557e0, -0.31919e0, -0.13843e0])        #in radians
-    r0 = np.array([cosra[i] * cosdec[i], sinra[i] * cosdec[i], sindec[i]])
-    if (mu_radec is not None):   
-      mu_a = mu_radec[i,0]
-      mu_d = mu_radec[i,1]
-      r0_dot = np.array([-mu_a * sinra[i] * cosdec[i] - mu_d * cosra[i] * sindec[i], mu_a * cosra[i] * cosdec[i] - mu_d * sinra[i] * sindec[i], mu_d * cosdec[i]]) + 21.095e0 * rad_vel[i] * parallax[i] * r0
-    else:   
-      r0_dot = np.array([0.0e0, 0.0e0, 0.0e0])
-      
-    r_0 = np.concatenate((r0, r0_dot))
-    r_1 = np.transpose(np.dot(np.transpose(m), np.transpose(r_0)))
+  
+  #all stars at once: vectors are along the last axis
+  a = 1e-6 * np.array([-1.62557e0, -0.31919e0, -0.13843e0])        #in radians
+  r0 = np.array([cosra * cosdec, sinra * cosdec, sindec]).T
+  if (mu_radec is not None):   
+    mu_a = mu_radec[:,0]
+    mu_d = mu_radec[:,1]
+    r0_dot = np.array([-mu_a * sinra * cosdec - mu_d * cosra * sindec, mu_a * cosra * cosdec - mu_d * sinra * sindec, mu_d * cosdec]).T + 21.095e0 * (rad_vel * parallax)[:,None] * r0
+  else:   
+    r0_dot = np.zeros((n, 3))
     
-    # Include the effects of the E-terms of aberration to form r and r_dot.
-    r1     = r_1[0:3]
-    r1_dot = r_1[3:6]
-    if mu_radec is None:
-      r1 = r1 + sec_to_radian ( r1_dot * (epoch - 1950.0e0) / 100. )
-      a  = a + sec_to_radian ( a_dot * (epoch - 1950.0e0) / 100. )
+  r_0 = np.hstack((r0, r0_dot))
+  r_1 = np.dot(r_0, m)
+  
+  # Include the effects of the E-terms of aberration to form r and r_dot.
+  r1     = r_1[:,0:3]
+  r1_dot = r_1[:,3:6]
+  if mu_radec is None:
+    r1 = r1 + sec_to_radian ( r1_dot * (epoch - 1950.0e0) / 100. )
+    a  = a + sec_to_radian ( a_dot * (epoch - 1950.0e0) / 100. )
 
-    x1     = r_1[0]
-    y1     = r_1[1]
-    z1     = r_1[2]
-    rmag   = np.sqrt(x1 ** 2 + y1 ** 2 + z1 ** 2)
-    s1     = r1 / rmag
-    s1_dot = r1_dot / rmag
-    s      = s1
-    for j in np.arange(0, 3):
-      r = s1 + a - ((s * a).sum()) * s
-      s = r / rmag
+  rmag   = np.sqrt((r_1[:,0:3] ** 2).sum(axis=1))[:,None]
+  s1     = r1 / rmag
+  s1_dot = r1_dot / rmag
+  s      = s1
+  for j in np.arange(0, 3):
+    r = s1 + a - ((s * a).sum(axis=1))[:,None] * s
+    s = r / rmag
 
-    x    = r[0]
-    y    = r[1]
-    z    = r[2]
-    r2   = x ** 2 + y ** 2 + z ** 2
-    rmag = np.sqrt(r2)
-    
-    if mu_radec is not None:   
-      r_dot         = s1_dot + a_dot - ((s * a_dot).sum()) * s
-      x_dot         = r_dot[0]
-      y_dot         = r_dot[1]
-      z_dot         = r_dot[2]
-      mu_radec[i,0] = (x * y_dot - y * x_dot) / (x ** 2 + y ** 2)
-      mu_radec[i,1] = (z_dot * (x ** 2 + y ** 2) - z * (x * x_dot + y * y_dot)) / (r2 * np.sqrt(x ** 2 + y ** 2))
-    
-    dec_1950[i] = np.arcsin(z / rmag)
-    ra_1950[i]  = np.arctan2(y, x)
-    
-    if parallax[i] > 0.:   
-      rad_vel[i]  = (x * x_dot + y * y_dot + z * z_dot) / (21.095 * parallax[i] * rmag)
-      parallax[i] = parallax[i] / rmag
+  x    = r[:,0]
+  y    = r[:,1]
+  z    = r[:,2]
+  r2   = x ** 2 + y ** 2 + z ** 2
+  rmag = np.sqrt(r2)
+  
+  if mu_radec is not None:   
+    r_dot         = s1_dot + a_dot - ((s * a_dot).sum(axis=1))[:,None] * s
+    x_dot         = r_dot[:,0]
+    y_dot         = r_dot[:,1]
+    z_dot         = r_dot[:,2]
+    mu_radec[:,0] = (x * y_dot - y * x_dot) / (x ** 2 + y ** 2)
+    mu_radec[:,1] = (z_dot * (x ** 2 + y ** 2) - z * (x * x_dot + y * y_dot)) / (r2 * np.sqrt(x ** 2 + y ** 2))
+  
+  dec_1950 = np.arcsin(z / rmag)
+  ra_1950  = np.arctan2(y, x)
+  
+  pos = parallax > 0.
+  if pos.any():   
+    rad_vel[pos]  = (x * x_dot + y * y_dot + z * z_dot)[pos] / (21.095 * parallax * rmag)[pos]
+    parallax[pos] = parallax[pos] / rmag[pos]
   
   neg = (ra_1950 < 0)
   if neg.any() > 0:   
@@ -650,19 +635,25 @@ def helcorr(ra2000, dec2000, jd, obs_long=None, obs_lat=None, obs_alt=None, debu
   calculates heliocentric Julian date, baricentric and heliocentric radial
   velocity corrections from:
 
+  All inputs can also be (1D) arrays, which are broadcast against each other
+  to compute the corrections of many observations (of different objects,
+  from different sites) at once. The results are then arrays too.
+  
   INPUT:
   @param ra2000: Right ascension of object for epoch 2000.0 (hours)
-  @type ra2000: float
+  @type ra2000: float or array
   @param dec2000: declination of object for epoch 2000.0 (degrees)
-  @type dec2000: float
+  @type dec2000: float or array
   @param jd: julian date for the middle of exposure
-  @type jd: float
+  @type jd: float or array
   @keyword obs_long: longitude of observatory (degrees, western direction is positive)
-  @type obs_long: float
+  @type obs_long: float or array
   @keyword obs_lat: latitude of observatory (degrees)
-  @type obs_lat: float
+  @type obs_lat: float or array
   @keyword obs_alt: altitude of observatory (meters)
-  @type obs_alt: float
+  @type obs_alt: float or array
+  @return: barycentric correction (km/s), heliocentric reduced Julian date
+  @rtype: float, float (or array, array)
   
   Algorithms used are taken from the IRAF task noao.astutils.rvcorrect
   and some procedures of the IDL Astrolib are used as well.
@@ -684,6 +675,11 @@ def helcorr(ra2000, dec2000, jd, obs_long=None, obs_lat=None, obs_alt=None, debu
   if obs_alt is None:
     obs_alt = 2333.
   
+  # Arrays of observations are handled at once
+  if any(np.ndim(arg) > 0 for arg in (ra2000, dec2000, jd, obs_long, obs_lat, obs_alt)):
+    ra2000, dec2000, jd, obs_long, obs_lat, obs_alt = [np.ravel(arg).astype(float) for arg in \
+        np.broadcast_arrays(ra2000, dec2000, jd, obs_long, obs_lat, obs_alt)]
+  
   #covert JD to Gregorian calendar date
   xjd = jd*1.0
   jd  = jd-2400000.0
@@ -779,15 +775,18 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
   or use the /PRINT keyword. The default (RA,DEC) system is FK5 based on epoch
   J2000.0 but FK4 based on B1950.0 is available via the /FK4 keyword.
   
+  The equinoxes can be arrays of the same length as the coordinates, to
+  precess each coordinate to its own equinox.
+  
   Input:
     @param ra0: Input right ascension in DEGREES
     @type ra0: float
     @param dec0: Input declination in degrees
     @type dec0: float
     @param equinox1: first equinox
-    @type equinox1: float
+    @type equinox1: float or array
     @param equinox2: second equinox
-    @type equinox2: float
+    @type equinox2: float or array
     @keyword fk4: If this keyword is set and non-zero, the FK4 (B1950.0) system will be used otherwise FK5 (J2000.0) will be used instead.
     @type fk4: float
     @keyword radian: If this keyword is set, input is in radian instead of degrees
@@ -810,7 +809,7 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
     Convert to Python (S. Koposov, july 2010)
     Converted for use at IvS (K. Smolders)
   """
-  scal = True
+  scal = np.ndim(equinox1) == 0 and np.ndim(equinox2) == 0
   if isinstance(ra0, np.ndarray):
     ra   = ra0.copy()  
     dec  = dec0.copy()
@@ -834,10 +833,11 @@ def precess(ra0, dec0, equinox1, equinox2, doprint=False, fk4=False, radian=Fals
   x[:,2] = np.sin(dec_rad)
   
   # Use PREMAT function to get precession matrix from Equinox1 to Equinox2
+  #  (one matrix per coordinate if the equinoxes are arrays)
   r       = premat(equinox1, equinox2, fk4=fk4)
-  x2      = np.transpose(np.dot(np.transpose(r), np.transpose(x)))
-  ra_rad  = np.zeros(npts) + np.arctan2(x2[:,1], x2[:,0])
-  dec_rad = np.zeros(npts) + np.arcsin(x2[:,2])
+  x2      = np.einsum('...ji,...j->...i', r, x)
+  ra_rad  = np.arctan2(x2[:,1], x2[:,0])
+  dec_rad = np.arcsin(x2[:,2])
   
   if not radian:   
     ra  = np.rad2deg(ra_rad)
@@ -898,12 +898,15 @@ def premat(equinox1, equinox2, fk4=False):
   Return the precession matrix needed to go from EQUINOX1 to EQUINOX2.
   
   This matrix is used by the procedures PRECESS and BARYVEL to precess astronomical coordinates
-  @param equinox1: Original equinox of coordinates, numeric scalar.
-  @type equinox1: float
+  Arrays of equinoxes are broadcast against each other, and give one
+  matrix per element.
+  
+  @param equinox1: Original equinox of coordinates.
+  @type equinox1: float or array
   @param equinox2: Equinox of precessed coordinates.
-  @type equinox2: float
+  @type equinox2: float or array
   @return: double precision 3 x 3 precession matrix, used to precess equatorial rectangular coordinates
-  @rtype: 3 by 3 array
+  @rtype: 3 by 3 array (or N x 3 x 3 array)
   @keyword fk4: If this keyword is set, the FK4 (B1950.0) system precession angles are used to compute the precession matrix. The default is to use FK5 (J2000.0) precession angles
   
   Revision history:
@@ -933,12 +936,12 @@ def premat(equinox1, equinox2, fk4=False):
   cosa   = np.cos(a)
   cosb   = np.cos(b)
   cosc   = np.cos(c)
-  r      = np.zeros((3, 3))
-  r[0,:] = np.array([cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc, cosa * sinc])
-  r[1,:] = np.array([-cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, -sina * sinc])
-  r[2,:] = np.array([-cosb * sinc, -sinb * sinc, cosc])
+  r      = np.array([[cosa * cosb * cosc - sina * sinb, sina * cosb + cosa * sinb * cosc, cosa * sinc],
+                     [-cosa * sinb - sina * cosb * cosc, cosa * cosb - sina * sinb * cosc, -sina * sinc],
+                     [-cosb * sinc, -sinb * sinc, cosc]])
   
-  return r
+  #for arrays of equinoxes, the matrices are along the first axes
+  return np.moveaxis(r, (0, 1), (-2, -1))
 
 
 def sphdist (ra1, dec1, ra2, dec2):
@@ -0,0 +1,51 @@
+import time
+import numpy as np
+from ivs.observations import barycentric_correction as bc
+
+import unittest
+
+class HelcorrTestCase(unittest.TestCase):
+    """ Compare the array evaluation of helcorr with the scalar one """
+
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(1111)
+        num = 500
+        cls.ra = np.random.uniform(0,24,num)
+        cls.dec = np.random.uniform(-89,89,num)
+        cls.jd = np.random.uniform(2440000,2470000,num)
+        cls.obs_long = np.random.uniform(-180,180,num)
+        cls.obs_lat = np.random.uniform(-60,60,num)
+        cls.obs_alt = np.random.uniform(0,4000,num)
+
+        start = time.time()
+        cls.scalar = np.array([bc.helcorr(*args) for args in zip(cls.ra,cls.dec,cls.jd,cls.obs_long,cls.obs_lat,cls.obs_alt)])
+        cls.scalar_duration = time.time()-start
+        start = time.time()
+        cls.array = bc.helcorr(cls.ra,cls.dec,cls.jd,cls.obs_long,cls.obs_lat,cls.obs_alt)
+        cls.array_duration = time.time()-start
+
+    def testCorrection(self):
+        """ observations.barycentric_correction.helcorr() arrays of observations """
+        self.assertTrue(np.all(np.abs(self.array[0]-self.scalar[:,0])<1e-5), msg='Barycentric correction differs by more than 1 cm/s')
+        self.assertTrue(np.all(np.abs(self.array[1]-self.scalar[:,1])<1e-8), msg='Heliocentric julian date differs')
+
+    def testBroadcast(self):
+        """ observations.barycentric_correction.helcorr() broadcast one object to many dates """
+        corr,hjd = bc.helcorr(self.ra[0],self.dec[0],self.jd[:10])
+        scalar = np.array([bc.helcorr(self.ra[0],self.dec[0],jd)[0] for jd in self.jd[:10]])
+        self.assertEqual(corr.shape,(10,))
+        self.assertTrue(np.all(np.abs(corr-scalar)<1e-5))
+
+    def testBaryvel(self):
+        """ observations.barycentric_correction.baryvel() arrays of dates """
+        for deq in [0,2000.]:
+            vh,vb = bc.baryvel(self.jd[:20],deq)
+            scalar = np.array([bc.baryvel(jd,deq)[1] for jd in self.jd[:20]]).T
+            self.assertEqual(vb.shape,(3,20))
+            self.assertTrue(np.all(np.abs(vb-scalar)<1e-8))
+
+    def testSpeed(self):
+        """ observations.barycentric_correction.helcorr() arrays faster than loop """
+        self.assertTrue(self.array_duration<self.scalar_duration,
+                        msg='array: %.3fs, scalar: %.3fs'%(self.array_duration,self.scalar_duration))
@@ -0,0 +1,86 @@
+import time
+import numpy as np
+from numpy import pi
+import ephem
+from ivs.observations import visibility
+
+import unittest
+
+def get_ephemeris(**kwargs):
+    """ Ephemeris for three fixed objects, without querying SIMBAD """
+    eph = visibility.Ephemeris(startdate='2011/09/27 12:00:00.0',dt=10.,days=5,**kwargs)
+    eph.objects = [ephem.readdb("HD50230,f|M|A0,06:51:31.38,+01:36:38.5,8.0,2000"),
+                   ephem.readdb("HD163506,f|M|A0,17:58:08.5,+26:03:00.2,8.0,2000"),
+                   ephem.readdb("Polaris,f|M|A0,02:31:49.1,+89:15:50.8,8.0,2000")]
+    return eph
+
+class VisibilityTestCase(unittest.TestCase):
+    """ Compare the numpy ephemeris engine with pyephem """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vis = {}
+        cls.duration = {}
+        for backend in ['pyephem','numpy']:
+            eph = get_ephemeris(sitename='lapalma')
+            start = time.time()
+            eph.visibility(backend=backend)
+            cls.duration[backend] = time.time()-start
+            cls.vis[backend] = eph.vis
+
+    def testAltitudes(self):
+        """ observations.visibility.Ephemeris.visibility() altitudes and moon """
+        ref,vis = self.vis['pyephem'],self.vis['numpy']
+        self.assertTrue(np.allclose(ref['MJDs'],vis['MJDs'],rtol=0,atol=1e-8))
+        self.assertTrue(np.all(np.array(ref['dates'],'U19')==np.array(vis['dates'],'U19')))
+        up = ref['alts']>0
+        self.assertTrue(np.all(np.abs(ref['alts']-vis['alts'])[up]<0.02/180.*pi))
+        up = ref['moon_alts']>0
+        self.assertTrue(np.all(np.abs(ref['moon_alts']-vis['moon_alts'])[up]<0.5/180.*pi))
+        self.assertTrue(np.all(np.abs(ref['moon_separation']-vis['moon_separation'])<0.5/180.*pi))
+        keep = (0<=ref['airmass']) & (ref['airmass']<=2.5)
+        self.assertTrue(np.allclose(ref['airmass'][keep],vis['airmass'][keep],rtol=1e-3))
+
+    def testNights(self):
+        """ observations.visibility.Ephemeris.visibility() sun rise, set and night """
+        ref,vis = self.vis['pyephem'],self.vis['numpy']
+        self.assertTrue(np.all(ref['during_night']==vis['during_night']))
+        for key in ['sun_prevrise','sun_prevset','sun_nextrise','sun_nextset']:
+            ref_dates = np.array(ref[key],'datetime64[s]')
+            dates = np.array(vis[key],'datetime64[s]')
+            self.assertTrue(np.all(np.abs(ref_dates-dates)<=np.timedelta64(60,'s')),msg=key)
+
+    def testMidnight(self):
+        """ observations.visibility.Ephemeris.visibility() at midnight """
+        ref = get_ephemeris(sitename='Paris')
+        ref.visibility(midnight=True,backend='pyephem')
+        eph = get_ephemeris(sitename='Paris')
+        eph.visibility(midnight=True,backend='numpy')
+        self.assertEqual(len(ref.vis['MJDs']),len(eph.vis['MJDs']))
+        self.assertTrue(np.all(np.abs(ref.vis['MJDs']-eph.vis['MJDs'])<1./24/60))
+        self.assertTrue(np.all(np.abs(ref.vis['alts']-eph.vis['alts'])[ref.vis['alts']>0]<0.02/180.*pi))
+
+    def testMultiple(self):
+        """ observations.visibility.Ephemeris multiple times, sites and objects """
+        startdate = np.array([2456084.0,2456085.02,2456085.29,2456085.55,2456095.6321])
+        output = {}
+        for backend in ['pyephem','numpy']:
+            eph = get_ephemeris()
+            eph._uniqueSites = []
+            for sitename in ['lapalma','palomar']:
+                eph.set_site(sitename=sitename)
+                eph._uniqueSites.append(eph.thesite)
+            eph._siteIndices = np.array([0,0,1,1,0])
+            eph._objectIndices = np.array([0,0,0,1,2])
+            output[backend] = getattr(eph,'_multiple_%s'%(backend))(startdate)
+        rawdates,alts,during_night,moon_alts,moon_separation = output['numpy'][:5]
+        self.assertTrue(np.all(np.abs(rawdates-output['pyephem'][0])<2./86400))
+        self.assertTrue(np.all(during_night==output['pyephem'][2]))
+        up = output['pyephem'][1]>0
+        self.assertTrue(np.all(np.abs(alts-output['pyephem'][1])[up]<0.02/180.*pi))
+        self.assertTrue(np.all(np.abs(moon_separation-output['pyephem'][4])<0.5/180.*pi))
+
+    def testSpeed(self):
+        """ observations.visibility.Ephemeris.visibility() numpy faster than pyephem """
+        self.assertTrue(self.duration['numpy']<self.duration['pyephem'],
+                        msg='numpy: %.3fs, pyephem: %.3fs'%(self.duration['numpy'],self.duration['pyephem']))
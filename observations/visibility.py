@@ -74,6 +74,7 @@ import numpy as np
 from numpy import sqrt,pi,cos,sin
 import sys
 import time
+import datetime
 import pytz
 import logging
 import ephem
@@ -81,6 +82,7 @@ import ephem
 from ivs.units import conversions
 from ivs.catalogs import sesame
 from ivs.observations import airmass as obs_airmass
+from ivs.observations import barycentric_correction
 from ivs.aux import decorators
 
 logger = logging.getLogger("OBS.VIS")
@@ -293,7 +295,7 @@ class Ephemeris(object):
 
     #{ Compute and plot visibilities
 
-    def visibility(self,multiple=False,midnight=None,airmassmodel='Pickering2002',**kwargs):
+    def visibility(self,multiple=False,midnight=None,airmassmodel='Pickering2002',backend='numpy',**kwargs):
         """
         Calculate ephemeri.
 
@@ -306,6 +308,16 @@ class Ephemeris(object):
         can be either N or 1 and should be in the same format as previously. In this case, ephemeri are only calculated at the times given in 'startdate',
         and thus the keywords 'days', 'dt' and 'midnight' are not used. Sites are currently only accessible throught the keyword 'sitename'.
 
+        The ephemeri are by default computed for all times, objects and sites at
+        once with numpy ('backend'='numpy'), using low-precision formulae for the
+        positions of the sun and the moon (see L{sun_position} and
+        L{moon_position}). Above the horizon, altitudes are accurate to about
+        0.01 degree for the objects and about 0.3 degree for the moon, sun rise
+        and set times to about a minute. Below the horizon, refraction is
+        modelled differently than in pyephem, and altitudes can differ by up to
+        a degree. With 'backend'='pyephem', every time step is computed
+        with pyephem instead, which is accurate but slow.
+
         The result of this function is an attribute 'vis', a dictionary containing:
             - MJDs: Modified Julian Dates
             - dates calendar dates (Format 1)
@@ -323,6 +335,8 @@ class Ephemeris(object):
         NOTE: use the 'get_out_objects', 'get_out_objectnames', 'get_out_sites' and 'get_out_sitenames' functions to retrieve the object, name of the object,
         site and name of the site corresponding to a particular row in each of the arrays 'vis' contains.
 
+        @keyword backend: 'numpy' or 'pyephem'
+        @type backend: str
         """
         #-- if no values are given for these keywords, this means nothing should change --> None
         kwargs.setdefault('sitename',None)
@@ -330,88 +344,33 @@ class Ephemeris(object):
         kwargs.setdefault('dt',None)
         kwargs.setdefault('days',None)
 
-        #-- set optional additional keywords
-        sun = ephem.Sun()
-        moon = ephem.Moon()
-        #moon_theta = 34.1 # minutes
-
         if not multiple:
             #-- set the site, date and objects
             self.set_site(**kwargs)
             self.set_date(**kwargs)
             self.set_objects(**kwargs)
-
-            #-- set stuff for calculations
-            timestep_minutes = self.dt
-            total_days = self.days
+            #-- run over all timesteps, or over all nights
             if midnight is None:
-                total_minutes = int(total_days*24*60./timestep_minutes)
+                total_minutes = int(self.days*24*60./self.dt)
+                output = getattr(self,'_timesteps_%s'%(backend))(total_minutes)
             else:
-                total_minutes = 365
-
-            #-- set initial arrays
-            alts = np.zeros((len(self.objects),total_minutes))
-            rawdates = np.zeros(total_minutes)
-            during_night = np.zeros(total_minutes,int)
-            moon_separation = np.zeros((len(self.objects),total_minutes))
-            moon_alts = np.zeros(total_minutes)
-            sun_prevrise = np.zeros(total_minutes)
-            sun_prevset = np.zeros(total_minutes)
-            sun_nextrise = np.zeros(total_minutes)
-            sun_nextset = np.zeros(total_minutes)
-
-            #-- run over all timesteps
-            if midnight is None:
-                for i in range(total_minutes):
-                    sun_prevset[i] = float(self.thesite.previous_setting(sun))
-                    sun_prevrise[i] = float(self.thesite.previous_rising(sun))
-                    sun_nextset[i] = float(self.thesite.next_setting(sun))
-                    sun_nextrise[i] = float(self.thesite.next_rising(sun))
-                    rawdates[i] = float(self.thesite.date)
-                    #-- compute the moon position
-                    moon.compute(self.thesite)
-                    moon_alts[i] = float(moon.alt)
-                    if (sun_prevrise[i]<=sun_prevset[i]):
-                        during_night[i] = 1
-                    for j,star in enumerate(self.objects):
-                        star.compute(self.thesite)
-                        alts[j,i] = float(star.alt)
-                        moon_separation[j,i] = ephem.separation(moon,star)
-                    self.thesite.date += ephem.minute*timestep_minutes
-
-            else:
-                i = 0
-                while i<365:
-                    sun_nextrise[i] = float(self.thesite.next_rising(sun))
-                    sun_prevset[i] = float(self.thesite.previous_setting(sun))
-                    sun_prevrise[i] = float(self.thesite.previous_rising(sun))
-                    sun_nextset[i] = float(self.thesite.next_setting(sun))
-                    if sun_prevrise[i]<=sun_prevset[i]: # now we're in a night
-                        self.thesite.date = ephem.Date((sun_nextrise[i]+sun_prevset[i])/2.)
-                    else:
-                        #-- set 4 hours forwards
-                        self.thesite.date += ephem.minute*60*4
-                        continue
-                    rawdates[i] = float(self.thesite.date)
-                    during_night[i] = 1
-                    for j,star in enumerate(self.objects):
-                        star.compute(self.thesite)
-                        alts[j,i] = float(star.alt)
-                    i += 1
-                    #-- set 1 day forwards
-                    self.thesite.date += ephem.minute*60*24
+                output = getattr(self,'_midnights_%s'%(backend))(365)
+            rawdates,alts,during_night,moon_alts,moon_separation = output[:5]
+            sun_prevrise,sun_prevset,sun_nextrise,sun_nextset = output[5:]
+            total_minutes = len(rawdates)
 
+            nobj = len(self.objects)
             alts = alts.ravel()
-            rawdates = np.outer(np.ones(len(self.objects)),rawdates).ravel()
-            during_night = np.outer(np.ones(len(self.objects),int),during_night).ravel()
+            rawdates = np.outer(np.ones(nobj),rawdates).ravel()
+            during_night = np.outer(np.ones(nobj,int),during_night).ravel()
             moon_separation = moon_separation.ravel()      #
-            moon_alts = np.outer(np.ones(len(self.objects)),moon_alts).ravel()
-            sun_nextrise = np.outer(np.ones(len(self.objects)),sun_nextrise).ravel()
-            sun_prevrise = np.outer(np.ones(len(self.objects)),sun_prevrise).ravel()
-            sun_nextset = np.outer(np.ones(len(self.objects)),sun_nextset).ravel()
-            sun_prevset = np.outer(np.ones(len(self.objects)),sun_prevset).ravel()
+            moon_alts = np.outer(np.ones(nobj),moon_alts).ravel()
+            sun_nextrise = np.outer(np.ones(nobj),sun_nextrise).ravel()
+            sun_prevrise = np.outer(np.ones(nobj),sun_prevrise).ravel()
+            sun_nextset = np.outer(np.ones(nobj),sun_nextset).ravel()
+            sun_prevset = np.outer(np.ones(nobj),sun_prevset).ravel()
 
-            self._objectIndices = np.outer(np.arange(len(self.objects)),np.ones(total_minutes)).ravel()
+            self._objectIndices = np.outer(np.arange(nobj),np.ones(total_minutes)).ravel()
             self._siteIndices = np.zeros_like(alts)
             self._uniqueSites = [self.thesite]
 
@@ -440,62 +399,251 @@ class Ephemeris(object):
                 self.set_site(uniqueSiteNames[i])
                 self._uniqueSites.append(self.thesite)
 
-            #-- define the iterator
-            it = np.broadcast(startdate,self._siteIndices,self._objectIndices)
-
-            #-- set initial arrays
-            alts = np.zeros(it.shape[0])
-            rawdates = np.zeros(it.shape[0])
-            during_night = np.zeros(it.shape[0],int)
-            moon_separation = np.zeros(it.shape[0])
-            moon_alts = np.zeros(it.shape[0])
-            sun_prevrise = np.zeros(it.shape[0])
-            sun_prevset = np.zeros(it.shape[0])
-            sun_nextrise = np.zeros(it.shape[0])
-            sun_nextset = np.zeros(it.shape[0])
-
-            #-- run over all elements
-            for i,element in enumerate(it):
-                #-- set the site and date
-                self.thesite = self._uniqueSites[element[1]]
-                self.set_date(startdate=element[0],days=None,dt=None)
-                #-- determine whether the time corresponds to night or day
-                sun_prevset[i] = float(self.thesite.previous_setting(sun))
-                sun_prevrise[i] = float(self.thesite.previous_rising(sun))
-                sun_nextset[i] = float(self.thesite.next_setting(sun))
-                sun_nextrise[i] = float(self.thesite.next_rising(sun))
-                if (sun_prevrise[i]<=sun_prevset[i]):
-                    during_night[i] = 1
-                rawdates[i] = float(self.thesite.date)
-                #-- compute the moon position
-                moon.compute(self.thesite)
-                moon_alts[i] = float(moon.alt)
-                #-- compute the star's position
-                star = self.objects[element[2]]
-                star.compute(self.thesite)
-                alts[i] = float(star.alt)
-                moon_separation[i] = ephem.separation(moon,star)
+            output = getattr(self,'_multiple_%s'%(backend))(startdate)
+            rawdates,alts,during_night,moon_alts,moon_separation = output[:5]
+            sun_prevrise,sun_prevset,sun_nextrise,sun_nextset = output[5:]
 
         #-- calculate airmass
         airmass = obs_airmass.airmass(90-alts/pi*180,model=airmassmodel)
         moon_airmass = obs_airmass.airmass(90-moon_alts/pi*180,model=airmassmodel)
 
         #-- calculate dates for plotting and output
-        self._plotdates = np.array([date2num(ephem.Date(h).datetime()) for h in rawdates])
-        self._sun_prevset = np.array([date2num(ephem.Date(h).datetime()) for h in sun_prevset])
-        self._sun_prevrise = np.array([date2num(ephem.Date(h).datetime()) for h in sun_prevrise])
-        self._sun_nextset = np.array([date2num(ephem.Date(h).datetime()) for h in sun_nextset])
-        self._sun_nextrise = np.array([date2num(ephem.Date(h).datetime()) for h in sun_nextrise])
-        dates = np.array([str(ephem.Date(h).datetime()) for h in rawdates])
+        self._plotdates = rawdates + _ephem_zeropoint_num
+        self._sun_prevset = sun_prevset + _ephem_zeropoint_num
+        self._sun_prevrise = sun_prevrise + _ephem_zeropoint_num
+        self._sun_nextset = sun_nextset + _ephem_zeropoint_num
+        self._sun_nextrise = sun_nextrise + _ephem_zeropoint_num
+        dates = np.array([str(h) for h in ephem2datetime(rawdates).astype(object)])
         MJDs = rawdates+15019.499999                                                             # the zeropoint of ephem is 1899/12/31 12:00:00.0      15019.499585
 
         #-- the output dictionary
         self.vis = dict(MJDs=MJDs,dates=dates,alts=alts,airmass=airmass,during_night=during_night,moon_alts=moon_alts,moon_airmass=moon_airmass,moon_separation=moon_separation)
-        self.vis.update(dict(sun_prevrise=np.array(num2date(self._sun_prevrise),dtype='U19'),sun_prevset=np.array(num2date(self._sun_prevset),dtype='U19'),sun_nextrise=np.array(num2date(self._sun_nextrise),dtype='U19'),sun_nextset=np.array(num2date(self._sun_nextset),dtype='U19')))
+        for key,value in zip(['sun_prevrise','sun_prevset','sun_nextrise','sun_nextset'],[sun_prevrise,sun_prevset,sun_nextrise,sun_nextset]):
+            self.vis[key] = np.char.replace(np.datetime_as_string(ephem2datetime(value),unit='s'),'T',' ').astype('U19')
         for i,obj in enumerate(self.objects):
             keep = (self._objectIndices == i) & (during_night==1) & (0<=airmass) & (airmass<=2.5)
             logger.info('Object %s: %s visible during night time (%.1f<airmass<%.1f)'%(obj.name,~np.any(keep) and 'not' or '',sum(keep) and airmass[keep].min() or np.nan,sum(keep) and airmass[keep].max() or np.nan))
 
+    def _timesteps_pyephem(self,total_minutes):
+        """
+        Compute ephemeri at regular timesteps at the current site with pyephem.
+        """
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        timestep_minutes = self.dt
+        #-- set initial arrays
+        alts = np.zeros((len(self.objects),total_minutes))
+        rawdates = np.zeros(total_minutes)
+        during_night = np.zeros(total_minutes,int)
+        moon_separation = np.zeros((len(self.objects),total_minutes))
+        moon_alts = np.zeros(total_minutes)
+        sun_prevrise = np.zeros(total_minutes)
+        sun_prevset = np.zeros(total_minutes)
+        sun_nextrise = np.zeros(total_minutes)
+        sun_nextset = np.zeros(total_minutes)
+
+        for i in range(total_minutes):
+            sun_prevset[i] = float(self.thesite.previous_setting(sun))
+            sun_prevrise[i] = float(self.thesite.previous_rising(sun))
+            sun_nextset[i] = float(self.thesite.next_setting(sun))
+            sun_nextrise[i] = float(self.thesite.next_rising(sun))
+            rawdates[i] = float(self.thesite.date)
+            #-- compute the moon position
+            moon.compute(self.thesite)
+            moon_alts[i] = float(moon.alt)
+            if (sun_prevrise[i]<=sun_prevset[i]):
+                during_night[i] = 1
+            for j,star in enumerate(self.objects):
+                star.compute(self.thesite)
+                alts[j,i] = float(star.alt)
+                moon_separation[j,i] = ephem.separation(moon,star)
+            self.thesite.date += ephem.minute*timestep_minutes
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
+    def _midnights_pyephem(self,nights):
+        """
+        Compute ephemeri in the middle of consecutive nights at the current
+        site with pyephem.
+        """
+        sun = ephem.Sun()
+        #-- set initial arrays
+        alts = np.zeros((len(self.objects),nights))
+        rawdates = np.zeros(nights)
+        during_night = np.zeros(nights,int)
+        moon_separation = np.zeros((len(self.objects),nights))
+        moon_alts = np.zeros(nights)
+        sun_prevrise = np.zeros(nights)
+        sun_prevset = np.zeros(nights)
+        sun_nextrise = np.zeros(nights)
+        sun_nextset = np.zeros(nights)
+
+        i = 0
+        while i<nights:
+            sun_nextrise[i] = float(self.thesite.next_rising(sun))
+            sun_prevset[i] = float(self.thesite.previous_setting(sun))
+            sun_prevrise[i] = float(self.thesite.previous_rising(sun))
+            sun_nextset[i] = float(self.thesite.next_setting(sun))
+            if sun_prevrise[i]<=sun_prevset[i]: # now we're in a night
+                self.thesite.date = ephem.Date((sun_nextrise[i]+sun_prevset[i])/2.)
+            else:
+                #-- set 4 hours forwards
+                self.thesite.date += ephem.minute*60*4
+                continue
+            rawdates[i] = float(self.thesite.date)
+            during_night[i] = 1
+            for j,star in enumerate(self.objects):
+                star.compute(self.thesite)
+                alts[j,i] = float(star.alt)
+            i += 1
+            #-- set 1 day forwards
+            self.thesite.date += ephem.minute*60*24
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
+    def _multiple_pyephem(self,startdate):
+        """
+        Compute ephemeri for combinations of times, sites and objects with
+        pyephem.
+        """
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        #-- define the iterator
+        it = np.broadcast(startdate,self._siteIndices,self._objectIndices)
+
+        #-- set initial arrays
+        alts = np.zeros(it.shape[0])
+        rawdates = np.zeros(it.shape[0])
+        during_night = np.zeros(it.shape[0],int)
+        moon_separation = np.zeros(it.shape[0])
+        moon_alts = np.zeros(it.shape[0])
+        sun_prevrise = np.zeros(it.shape[0])
+        sun_prevset = np.zeros(it.shape[0])
+        sun_nextrise = np.zeros(it.shape[0])
+        sun_nextset = np.zeros(it.shape[0])
+
+        #-- run over all elements
+        for i,element in enumerate(it):
+            #-- set the site and date
+            self.thesite = self._uniqueSites[element[1]]
+            self.set_date(startdate=element[0],days=None,dt=None)
+            #-- determine whether the time corresponds to night or day
+            sun_prevset[i] = float(self.thesite.previous_setting(sun))
+            sun_prevrise[i] = float(self.thesite.previous_rising(sun))
+            sun_nextset[i] = float(self.thesite.next_setting(sun))
+            sun_nextrise[i] = float(self.thesite.next_rising(sun))
+            if (sun_prevrise[i]<=sun_prevset[i]):
+                during_night[i] = 1
+            rawdates[i] = float(self.thesite.date)
+            #-- compute the moon position
+            moon.compute(self.thesite)
+            moon_alts[i] = float(moon.alt)
+            #-- compute the star's position
+            star = self.objects[element[2]]
+            star.compute(self.thesite)
+            alts[i] = float(star.alt)
+            moon_separation[i] = ephem.separation(moon,star)
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
+    def _timesteps_numpy(self,total_minutes):
+        """
+        Compute ephemeri at regular timesteps at the current site with numpy.
+        """
+        start = float(self.thesite.date)
+        rawdates = start + np.arange(total_minutes)*ephem.minute*self.dt
+        site = _site_parameters([self.thesite])
+        stars = _star_vectors(self.objects)
+        #-- positions of the sun and the moon only depend on time and site
+        sun_prevrise,sun_prevset,sun_nextrise,sun_nextset = sun_events(rawdates,*site[0])
+        during_night = np.array(sun_prevrise<=sun_prevset,int)
+        zenith = _zenith_vector(rawdates,*site[0][:2])
+        moon = moon_position(rawdates,zenith)
+        moon_alts = _apparent_altitude(moon,zenith,*site[0][2:])
+        #-- objects in chunks of time, to limit the memory use
+        alts = np.zeros((len(self.objects),total_minutes))
+        moon_separation = np.zeros((len(self.objects),total_minutes))
+        for i in range(0,total_minutes,_chunk_size):
+            chunk = slice(i,i+_chunk_size)
+            vectors = precess_vectors(stars[:,None,:],rawdates[chunk])
+            alts[:,chunk] = _apparent_altitude(vectors,zenith[chunk],*site[0][2:])
+            moon_separation[:,chunk] = _separation(vectors,moon[chunk])
+        #-- the site ends at the date after the last timestep
+        self.thesite.date = start + total_minutes*ephem.minute*self.dt
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
+    def _midnights_numpy(self,nights):
+        """
+        Compute ephemeri in the middle of consecutive nights at the current
+        site with numpy.
+
+        The first night is the one at the current date, or the next one when
+        it is day time.
+        """
+        start = float(self.thesite.date)
+        site = _site_parameters([self.thesite])
+        #-- all sun sets and rises in the period, with a margin of a week for
+        #   nights that are shortened by the season
+        sets,rises = _sun_crossings(np.arange(start-1.,start+nights+7.,_sun_grid_step),*site[0])
+        nextrise = rises[np.minimum(np.searchsorted(rises,sets),len(rises)-1)]
+        night = (nextrise>sets) & (nextrise>start)
+        sun_prevset,sun_nextrise = sets[night][:nights],nextrise[night][:nights]
+        if len(sun_prevset)<nights:
+            logger.warning('Only %d nights found at %s'%(len(sun_prevset),self.thesite.name))
+        rawdates = (sun_prevset+sun_nextrise)/2.
+        sun_prevrise,sun_prevset,sun_nextrise,sun_nextset = sun_events(rawdates,*site[0])
+        during_night = np.ones(len(rawdates),int)
+        #-- compute the positions
+        stars = _star_vectors(self.objects)
+        zenith = _zenith_vector(rawdates,*site[0][:2])
+        moon = moon_position(rawdates,zenith)
+        moon_alts = _apparent_altitude(moon,zenith,*site[0][2:])
+        vectors = precess_vectors(stars[:,None,:],rawdates)
+        alts = _apparent_altitude(vectors,zenith,*site[0][2:])
+        moon_separation = _separation(vectors,moon)
+        #-- the site ends a day after the last night
+        self.thesite.date = rawdates[-1] + 1.
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
+    def _multiple_numpy(self,startdate):
+        """
+        Compute ephemeri for combinations of times, sites and objects with
+        numpy.
+        """
+        #-- convert the dates only once
+        if startdate.dtype.kind in 'iuf':
+            rawdates = np.asarray(startdate,float) - _ephem_zeropoint_jd
+        else:
+            rawdates = np.array([float(ephem.Date(date)) for date in startdate])
+        rawdates,siteIndices,objectIndices = np.broadcast_arrays(rawdates,self._siteIndices,self._objectIndices)
+        rawdates = np.array(rawdates,float)
+        stars = _star_vectors(self.objects)
+        site = _site_parameters(self._uniqueSites)
+
+        sun_prevrise = np.zeros(len(rawdates))
+        sun_prevset = np.zeros(len(rawdates))
+        sun_nextrise = np.zeros(len(rawdates))
+        sun_nextset = np.zeros(len(rawdates))
+        zenith = np.zeros((len(rawdates),3))
+        pressure = np.zeros(len(rawdates))
+        temp = np.zeros(len(rawdates))
+        #-- the sun only depends on the time and site
+        for j,(lat,lon,press,tmp) in enumerate(site):
+            keep = siteIndices==j
+            events = sun_events(rawdates[keep],lat,lon,press,tmp)
+            sun_prevrise[keep],sun_prevset[keep],sun_nextrise[keep],sun_nextset[keep] = events
+            zenith[keep] = _zenith_vector(rawdates[keep],lat,lon)
+            pressure[keep] = press
+            temp[keep] = tmp
+        during_night = np.array(sun_prevrise<=sun_prevset,int)
+        #-- the moon and the objects
+        moon = moon_position(rawdates,zenith)
+        moon_alts = _apparent_altitude(moon,zenith,pressure,temp)
+        vectors = precess_vectors(stars[objectIndices],rawdates)
+        alts = _apparent_altitude(vectors,zenith,pressure,temp)
+        moon_separation = _separation(vectors,moon)
+        #-- the site ends at the last given date
+        self.thesite = self._uniqueSites[siteIndices[-1]]
+        self.thesite.date = rawdates[-1]
+        return rawdates,alts,during_night,moon_alts,moon_separation,sun_prevrise,sun_prevset,sun_nextrise,sun_nextset
+
 
     def plot(self,plot_daynight=True,**kwargs):
         """
@@ -599,6 +747,257 @@ class Ephemeris(object):
     #}
 
 
+#{ Vectorized ephemeris engine
+
+#-- zeropoint of pyephem dates (1899/12/31 12:00:00.0) in JD and in
+#   matplotlib's date numbers
+_ephem_zeropoint_jd = 2415020.0
+_ephem_zeropoint_num = date2num(datetime.datetime(1899,12,31,12))
+#-- number of timesteps per block of object positions
+_chunk_size = 10000
+#-- sampling (days) of the sun's altitude to find rises and sets
+_sun_grid_step = 1/48.
+
+def ephem2datetime(djd):
+    """
+    Convert pyephem dates to numpy datetimes.
+
+    Like pyephem, dates are rounded to the microsecond. Missing dates (NaN)
+    are converted to 'NaT'.
+
+    @param djd: pyephem dates (days since 1899/12/31 12:00:00.0)
+    @type djd: float or array
+    @return: dates
+    @rtype: datetime64[us] array
+    """
+    djd = np.asarray(djd,float)
+    finite = np.isfinite(djd)
+    microseconds = np.where(finite,np.round(djd*86400e6),0).astype(np.int64)
+    dates = np.datetime64('1899-12-31T12:00:00','us') + microseconds.astype('timedelta64[us]')
+    dates[~finite] = np.datetime64('NaT')
+    return dates
+
+def sidereal_time(djd,lon):
+    """
+    Local mean sidereal time.
+
+    @param djd: pyephem dates (UT)
+    @type djd: float or array
+    @param lon: longitude (EAST, radians)
+    @type lon: float or array
+    @return: local sidereal time (radians)
+    @rtype: float or array
+    """
+    d = np.asarray(djd) + (_ephem_zeropoint_jd - 2451545.0)
+    T = d/36525.
+    gmst = 280.46061837 + 360.98564736629*d + T**2*(0.000387933 - T/38710000.)
+    return np.fmod(gmst/180.*pi + lon,2*pi)
+
+def sun_position(djd):
+    """
+    Apparent equatorial position of the sun.
+
+    Uses the low-precision formulae of the Astronomical Almanac, accurate to
+    about 0.01 degree between 1950 and 2050.
+
+    @param djd: pyephem dates (UT)
+    @type djd: float or array
+    @return: unit vectors (equinox of date), distance (AU)
+    @rtype: array (...,3), array
+    """
+    n = np.asarray(djd) + (_ephem_zeropoint_jd - 2451545.0)
+    L = 280.460 + 0.9856474*n
+    g = (357.528 + 0.9856003*n)/180.*pi
+    lamb = (L + 1.915*sin(g) + 0.020*sin(2*g))/180.*pi
+    eps = (23.439 - 0.0000004*n)/180.*pi
+    distance = 1.00014 - 0.01671*cos(g) - 0.00014*cos(2*g)
+    vectors = np.array([cos(lamb),cos(eps)*sin(lamb),sin(eps)*sin(lamb)])
+    return np.moveaxis(vectors,0,-1),distance
+
+def moon_position(djd,observer=None):
+    """
+    Equatorial position of the moon.
+
+    Uses the low-precision formulae of the Astronomical Almanac, accurate to
+    about 0.3 degree in longitude and 0.2 degree in latitude.
+
+    If the position of an observer is given, the topocentric direction of the
+    moon is returned as a unit vector, otherwise the geocentric position in
+    Earth radii.
+
+    @param djd: pyephem dates (UT)
+    @type djd: float or array
+    @param observer: geocentric position(s) of the observer (Earth radii, see
+    L{_zenith_vector})
+    @type observer: array (...,3)
+    @return: position(s) of the moon (equinox of date)
+    @rtype: array (...,3)
+    """
+    T = (np.asarray(djd) + (_ephem_zeropoint_jd - 2451545.0))/36525.
+    rad = pi/180.
+    lamb = 218.32 + 481267.881*T + 6.29*sin((135.0 + 477198.87*T)*rad) - 1.27*sin((259.3 - 413335.36*T)*rad)\
+         + 0.66*sin((235.7 + 890534.22*T)*rad) + 0.21*sin((269.9 + 954397.74*T)*rad)\
+         - 0.19*sin((357.5 + 35999.05*T)*rad) - 0.11*sin((186.5 + 966404.03*T)*rad)
+    beta = 5.13*sin((93.3 + 483202.02*T)*rad) + 0.28*sin((228.2 + 960400.89*T)*rad)\
+         - 0.28*sin((318.3 + 6003.15*T)*rad) - 0.17*sin((217.6 - 407332.21*T)*rad)
+    parallax = 0.9508 + 0.0518*cos((135.0 + 477198.87*T)*rad) + 0.0095*cos((259.3 - 413335.36*T)*rad)\
+             + 0.0078*cos((235.7 + 890534.22*T)*rad) + 0.0028*cos((269.9 + 954397.74*T)*rad)
+    lamb,beta,eps = lamb*rad,beta*rad,(23.439 - 0.013*T)*rad
+    distance = 1./sin(parallax*rad)
+    vectors = np.array([cos(beta)*cos(lamb),
+                        cos(eps)*cos(beta)*sin(lamb) - sin(eps)*sin(beta),
+                        sin(eps)*cos(beta)*sin(lamb) + cos(eps)*sin(beta)])
+    vectors = np.moveaxis(vectors*distance,0,-1)
+    if observer is not None:
+        vectors = vectors - observer
+        vectors /= sqrt((vectors**2).sum(axis=-1))[...,None]
+    return vectors
+
+def precess_vectors(vectors,djd):
+    """
+    Precess J2000 unit vectors to the equinox of date.
+
+    The vectors and the dates are broadcast against each other.
+
+    @param vectors: unit vectors (J2000)
+    @type vectors: array (...,3)
+    @param djd: pyephem dates
+    @type djd: float or array
+    @return: unit vectors (equinox of date)
+    @rtype: array (...,3)
+    """
+    epoch = 2000. + (np.asarray(djd) + (_ephem_zeropoint_jd - 2451545.0))/365.25
+    r = barycentric_correction.premat(2000.,epoch)
+    return np.einsum('...ji,...j->...i',r,vectors)
+
+def refraction(alt,pressure=1010.,temp=15.):
+    """
+    Atmospheric refraction for a true altitude.
+
+    Uses Saemundsson's formula, scaled to the pressure and temperature.
+    Below an altitude of -1 degree, the refraction at -1 degree is used
+    (pyephem uses a different extrapolation there).
+
+    @param alt: true (geometric) altitude (radians)
+    @type alt: float or array
+    @param pressure: air pressure (mbar)
+    @type pressure: float or array
+    @param temp: temperature (Celsius)
+    @type temp: float or array
+    @return: refraction (radians), to add to the true altitude
+    @rtype: float or array
+    """
+    h = np.maximum(np.asarray(alt)/pi*180.,-1.)
+    R = 1.02/np.tan((h + 10.3/(h + 5.11))/180.*pi)/60.
+    return R*pressure/1010.*283./(273.+temp)/180.*pi
+
+def sun_events(djd,lat,lon,pressure=1010.,temp=15.):
+    """
+    Previous and next rise and set of the sun at a site.
+
+    As in pyephem, the sun rises and sets when the upper limb crosses the
+    horizon, taking refraction into account. When there is no rise or set
+    within a day and a half of a date (polar day or night), the time is NaN.
+
+    @param djd: pyephem dates
+    @type djd: array
+    @param lat: latitude of the site (radians)
+    @type lat: float
+    @param lon: longitude of the site (EAST, radians)
+    @type lon: float
+    @param pressure: air pressure (mbar)
+    @type pressure: float
+    @param temp: temperature (Celsius)
+    @type temp: float
+    @return: previous rise, previous set, next rise, next set
+    @rtype: 4 x array
+    """
+    djd = np.asarray(djd,float)
+    if not len(djd):
+        return [np.zeros(0) for i in range(4)]
+    #-- sample the sun's altitude only around the requested dates
+    t0 = djd.min() - 1.5
+    margin = int(1.5/_sun_grid_step) + 1
+    steps = np.arange(-margin,margin+1)
+    grid = np.unique(((djd-t0)/_sun_grid_step).astype(int)[:,None] + steps).astype(float)
+    sets,rises = _sun_crossings(t0 + grid*_sun_grid_step,lat,lon,pressure,temp)
+    output = []
+    for events in [rises,sets]:
+        #-- an event at the date itself counts as the next one
+        index = np.searchsorted(events,djd)
+        padded = np.hstack([np.nan,events,np.nan])
+        output.append((padded[index],padded[index+1]))
+    (prevrise,nextrise),(prevset,nextset) = output
+    return prevrise,prevset,nextrise,nextset
+
+def _sun_crossings(grid,lat,lon,pressure,temp):
+    """
+    Find the sun sets and rises between consecutive samples of a time grid.
+
+    Only samples that are separated by one step of L{_sun_grid_step} are
+    considered to be consecutive. The crossings are refined with a few
+    iterations of regula falsi.
+
+    @return: sorted sets, sorted rises
+    @rtype: array, array
+    """
+    def upper_limb(t):
+        vectors,distance = sun_position(t)
+        alt = np.arcsin((vectors*_zenith_vector(t,lat,lon)).sum(axis=-1))
+        semidiameter = 959.63/3600./distance/180.*pi
+        return alt + refraction(alt,pressure,temp) + semidiameter
+    alt = upper_limb(grid)
+    cross = np.nonzero((np.sign(alt[:-1])!=np.sign(alt[1:])) & (np.diff(grid)<1.5*_sun_grid_step))[0]
+    t1,t2 = grid[cross],grid[cross+1]
+    f1,f2 = alt[cross],alt[cross+1]
+    for i in range(4):
+        t = t1 - f1*(t2-t1)/(f2-f1)
+        f = upper_limb(t)
+        left = np.sign(f)==np.sign(f1)
+        t1,f1 = np.where(left,t,t1),np.where(left,f,f1)
+        t2,f2 = np.where(left,t2,t),np.where(left,f2,f)
+    t = t1 - f1*(t2-t1)/(f2-f1)
+    rising = alt[cross]<0
+    return t[~rising],t[rising]
+
+def _zenith_vector(djd,lat,lon):
+    """
+    Unit vector towards the zenith of a site (equinox of date).
+    """
+    lst = sidereal_time(djd,lon)
+    vectors = np.array([cos(lat)*cos(lst),cos(lat)*sin(lst),sin(lat)*np.ones_like(lst)])
+    return np.moveaxis(vectors,0,-1)
+
+def _apparent_altitude(vectors,zenith,pressure,temp):
+    """
+    Altitude of unit vectors, including refraction.
+    """
+    alt = np.arcsin(np.clip((vectors*zenith).sum(axis=-1),-1,1))
+    return alt + refraction(alt,pressure,temp)
+
+def _separation(vectors1,vectors2):
+    """
+    Angular separation between unit vectors.
+    """
+    return np.arccos(np.clip((vectors1*vectors2).sum(axis=-1),-1,1))
+
+def _site_parameters(sites):
+    """
+    Latitude, longitude (radians), pressure and temperature of pyephem sites.
+    """
+    return [(float(site.lat),float(site.lon),site.pressure,site.temp) for site in sites]
+
+def _star_vectors(objects):
+    """
+    J2000 unit vectors of pyephem fixed bodies.
+    """
+    ra = np.array([star._ra for star in objects],float)
+    dec = np.array([star._dec for star in objects],float)
+    return np.column_stack([cos(dec)*cos(ra),cos(dec)*sin(ra),sin(dec)])
+
+#}
+
+
 if __name__=="__main__":
     if len(sys.argv)<2:
         import doctest
@@ -1383,8 +1383,28 @@ class SED(object):
 
 
     def imc(self,teffrange=None,loggrange=None,ebvrange=None,zrange=None,start_from='igrid_search',\
-                 distribution='uniform',points=None,fitmethod='fmin',disturb=True):
-
+                 distribution='uniform',points=None,fitmethod='fmin',disturb=True,threads=1,
+                 seed=None,warm_start=True):
+        """
+        Monte Carlo simulation of the minimizer fit.
+
+        The photometry is first fitted from 25 starting points, and the best
+        solution is kept. Then, C{points-1} realisations of the photometry,
+        perturbed with the errors, are fitted again. Each realisation has its
+        own random seed, derived from C{seed} (or from numpy's global random
+        generator if C{seed} is None), so that the results do not depend on
+        the number of C{threads} the fits are distributed over (see
+        L{fit.imc}). Both rounds of fits use the same pool of workers (see
+        L{fit.imc_pool}).
+
+        @param threads: number of worker processes (or 'max', 'half', 'safe')
+        @type threads: int or str
+        @param seed: seed of the Monte Carlo simulation
+        @type seed: int
+        @param warm_start: start the fits of the realisations from the best
+        solution instead of from random points
+        @type warm_start: bool
+        """
         limits = self.generate_ranges(teffrange=teffrange,loggrange=loggrange,\
                                       ebvrange=ebvrange,zrange=zrange,distribution=distribution,\
                                       start_from=start_from)
@@ -1402,40 +1422,46 @@ class SED(object):
         # -- generate initial guesses
         teffs,loggs,ebvs,zs,radii = fit.generate_grid(self.master['photband'][include],type='single',points=points+25,**limits)
         NrPoints = len(teffs)>points and points or len(teffs)
-        firstoutput = np.zeros((len(teffs)-NrPoints,9))
-        output = np.zeros((NrPoints,9))
+        starts = np.column_stack([teffs,loggs,ebvs,zs])
 
-        # -- fit the original data a number of times
-        for i,(teff,logg,ebv,z) in enumerate(zip(teffs[NrPoints:],loggs[NrPoints:],ebvs[NrPoints:],zs[NrPoints:])):
-            try:
-                fittedpars,warnflag = fit.iminimize2(meas,emeas,photbands,teff=teff,logg=logg,ebv=ebv,z=z,fitmethod=fitmethod)
-                firstoutput[i,1:] = fittedpars
-                firstoutput[i,0] = warnflag
-            except IOError:
-                firstoutput[i,0] = 3
-
-        logger.info("{0}/{1} fits on original data failed (max func call)".format(sum(firstoutput[:,0]==1),firstoutput.shape[0]))
-        logger.info("{0}/{1} fits on original failed (max iter)".format(sum(firstoutput[:,0]==2),firstoutput.shape[0]))
-        logger.info("{0}/{1} fits on original data failed (outside of grid)".format(sum(firstoutput[:,0]==3),firstoutput.shape[0]))
-
-        # -- retrieve the best fitting result and make it the first entry of output
-        keep = (firstoutput[:,0]==0) & (firstoutput[:,1]>0)
-        best = firstoutput[keep,-2].argmin()
-        output[-1,:] = firstoutput[keep][best,:]
-
-        # calculate the factor with which to multiply the scale
-        #factor = np.sqrt(output[-1,5]/len(meas))
-        #print factor
-
-        # -- now do the actual Monte Carlo simulation
-        for i,(teff,logg,ebv,z) in enumerate(zip(teffs[:NrPoints-1],loggs[:NrPoints-1],ebvs[:NrPoints-1],zs[:NrPoints-1])):
-            newmeas = meas + np.random.normal(scale=emeas) #*factor)
-            try:
-                fittedpars,warnflag = fit.iminimize2(newmeas,emeas,photbands,teff,logg,ebv,z,fitmethod=fitmethod)
-                output[i,1:] = fittedpars
-                output[i,0] = warnflag
-            except IOError:
-                output[i,0] = 3
+        # -- draw the seeds of the realisations
+        if seed is None:
+            seeds = np.random.randint(2**31-1,size=NrPoints-1)
+        else:
+            seeds = np.random.RandomState(seed).randint(2**31-1,size=NrPoints-1)
+
+        # -- the fits on the original data and on the realisations share one
+        #   pool of workers, which load the integrated grid only once
+        pool = fit.imc_pool(meas,emeas,photbands,threads=threads,fitmethod=fitmethod)
+        try:
+            # -- fit the original data a number of times
+            firstoutput = fit.imc(meas,emeas,photbands,starts[NrPoints:],pool=pool,fitmethod=fitmethod)
+
+            logger.info("{0}/{1} fits on original data failed (max func call)".format(sum(firstoutput[:,0]==1),firstoutput.shape[0]))
+            logger.info("{0}/{1} fits on original failed (max iter)".format(sum(firstoutput[:,0]==2),firstoutput.shape[0]))
+            logger.info("{0}/{1} fits on original data failed (outside of grid)".format(sum(firstoutput[:,0]==3),firstoutput.shape[0]))
+
+            # -- retrieve the best fitting result and make it the first entry of output
+            keep = (firstoutput[:,0]==0) & (firstoutput[:,1]>0)
+            best = firstoutput[keep,-2].argmin()
+            output = np.zeros((NrPoints,9))
+            output[-1,:] = firstoutput[keep][best,:]
+
+            # calculate the factor with which to multiply the scale
+            #factor = np.sqrt(output[-1,5]/len(meas))
+            #print factor
+
+            # -- now do the actual Monte Carlo simulation
+            if warm_start:
+                starts = np.resize(output[-1,1:5],(NrPoints-1,4))
+            else:
+                starts = starts[:NrPoints-1]
+            fit.imc(meas,emeas,photbands,starts,seeds=seeds,pool=pool,
+                    output=output[:NrPoints-1],fitmethod=fitmethod)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         logger.info("{0}/{1} MC simulations failed (max func call)".format(sum(output[:,0]==1),NrPoints))
         logger.info("{0}/{1} MC simulations failed (max iter)".format(sum(output[:,0]==2),NrPoints))
@@ -1606,15 +1632,34 @@ class SED(object):
         wave,flux,urflux = self.results[label]['model']
         return wave,flux,urflux
 
-    def sample_gridsearch(self,mtype='igrid_search',NrSamples=1,df=None,selfact='chisq'):
+    def sample_gridsearch(self,mtype='igrid_search',NrSamples=1,df=None,selfact='chisq',
+                          weights=None,jitter=None,return_grid=False):
         """
         Retrieve an element from the results of a grid search according to the derived probability.
 
         An array of length "NrSamples" containing 'grid-indices' is returned, so the actual parameter values
         of the corresponding model can be retrieved from the results dictionary.
 
+        The samples are drawn by inverse transform sampling of the cumulative
+        probability (see L{fit.sample_grid}), so that drawing a large number of
+        samples from a large grid is fast.
+
+        If C{return_grid=True}, the samples are returned directly as rows of
+        the results grid (same layout as C{self.results[mtype]['grid']}). With
+        C{jitter}, the fitted parameters are then spread uniformly within a
+        grid cell around the sampled grid point. The cell widths are given per
+        parameter as a dictionary (e.g. C{jitter=dict(teff=250.,logg=0.25)}):
+        the points of a grid search are drawn at random, so the spacing
+        between them says nothing about the resolution of the model grid.
+
         :param NrSamples: the number of samples you wish to draw
         :type NrSamples: int
+        :param weights: extra weights of the grid points, for importance resampling
+        :type weights: array
+        :param jitter: width of the grid cells per parameter
+        :type jitter: dict
+        :param return_grid: return the sampled rows instead of indices
+        :type return_grid: bool
         """
         # -- this function is only checked to work with the results of an igrid_search
         if not 'igrid_search' in mtype:
@@ -1637,18 +1682,25 @@ class SED(object):
             logger.warning('Not enough data to compute CHI2: it will not make sense')
             k = 1
         logger.info('Statistics based on df={0} and Nobs={1}'.format(df,N))
-        factor = max(self.results[mtype]['grid'][selfact][-1]/k,1)
-
-        # -- Compute the pdf and cdf
-        probdensfunc = scipy.stats.distributions.chi2.pdf(self.results[mtype]['grid'][selfact]/factor,k)
-        cumuldensfunc = probdensfunc.cumsum()
-
-        # -- Uniformly sample the cdf, to get a sampling according to the pdf
-        sample = pl.uniform(cumuldensfunc[0],cumuldensfunc[-1],NrSamples)
-        indices = np.zeros(NrSamples,int)
-        for i in range(NrSamples):
-            indices[i] = (abs(cumuldensfunc-sample[i])).argmin()
-        return indices
+        grid = self.results[mtype]['grid']
+        factor = max(grid[selfact][-1]/k,1)
+
+        # -- Compute the pdf, and sample it
+        probdensfunc = scipy.stats.distributions.chi2.pdf(grid[selfact]/factor,k)
+        indices = fit.sample_grid(probdensfunc,size=NrSamples,weights=weights)
+        if not return_grid:
+            return indices
+
+        # -- spread the parameters within their grid cells
+        samples = grid[indices]
+        if jitter:
+            if not isinstance(jitter,dict):
+                raise ValueError('jitter must be a dictionary with the width of the grid cells per parameter')
+            for name,width in jitter.items():
+                if not name in grid.dtype.names:
+                    raise ValueError('Cannot jitter {0}: not a parameter of the grid'.format(name))
+                samples[name] += np.random.uniform(-width/2.,width/2.,NrSamples)
+        return samples
 
     def chi2(self,select=None,reduced=False,label='igrid_search'):
         """
@@ -8,6 +8,7 @@ import astropy.io.fits as pf
 import itertools
 import re
 import copy
+from multiprocessing import Pool,cpu_count
 
 import numpy as np
 from numpy import inf
@@ -255,6 +256,41 @@ def stat_chi2(meas,e_meas,colors,syn,full_output=False, **kwargs):
         else:
             return chisq.sum(axis=0),scale,e_scale
 
+def sample_grid(pdf,size=1,weights=None):
+    """
+    Draw grid points according to their probability.
+
+    The probabilities are cumulated once, and a batch of uniform random
+    numbers is located in the cumulative distribution with a binary search
+    (inverse transform sampling). The random numbers are sorted first, which
+    makes the search much faster for large grids; the samples are shuffled
+    afterwards.
+
+    Extra C{weights} (e.g. the ratio of a target and a proposal density)
+    are multiplied with the probabilities, for importance resampling.
+
+    >>> indices = sample_grid(np.array([0.,1.,3.]),size=1000)
+    >>> sorted(set(indices))
+    [1, 2]
+
+    @param pdf: (unnormalised) probability of every grid point
+    @type pdf: array
+    @param size: number of samples
+    @type size: int
+    @param weights: extra weights of the grid points
+    @type weights: array
+    @return: indices of the sampled grid points
+    @rtype: array of int
+    """
+    if weights is not None:
+        pdf = pdf*weights
+    cdf = np.cumsum(pdf)
+    sample = np.sort(np.random.uniform(0,cdf[-1],size))
+    indices = np.searchsorted(cdf,sample,side='right')
+    #-- guard against round-off at the upper edge
+    indices = np.minimum(indices,len(cdf)-1)
+    return np.random.permutation(indices)
+
 
 def generate_grid_single_pix(photbands, points=None, clear_memory=True, **kwargs):
     """
@@ -1201,6 +1237,140 @@ def iminimize2(meas,e_meas,photbands,*args,**kwargs):
     return optpars,warnflag
 #}
 
+#{ Fitting: Monte Carlo
+
+#-- the fitting problem held by a Monte Carlo worker (see _init_imc_worker)
+_imc_problem = {}
+
+def imc(meas,e_meas,photbands,starts,seeds=None,threads=1,chunksize=4,output=None,pool=None,**kwargs):
+    """
+    Fit the photometry a number of times with L{iminimize2}.
+
+    Every fit C{i} starts from C{starts[i]} (teff,logg,ebv,z). If C{seeds} is
+    given, fit C{i} is done on a realisation of the photometry perturbed with
+    its errors, drawn from a random generator seeded with C{seeds[i]} (a
+    seed of None means no perturbation). Each realisation thus only depends on
+    its own seed, and the results are the same regardless of the number of
+    threads.
+
+    With C{threads>1}, the fits are distributed over a pool of worker
+    processes (see L{imc_pool}). To do several rounds of fits of the same
+    photometry, set up the pool once with L{imc_pool} and pass it as C{pool}:
+    the workers then keep their (memoized) integrated grid between the
+    rounds. The pool is not closed in that case. The rows of C{output} are
+    filled in as the fits finish.
+
+    @param meas: measurements
+    @type meas: array
+    @param e_meas: errors on the measurements
+    @type e_meas: array
+    @param photbands: photometric passbands
+    @type photbands: array
+    @param starts: starting points of the fits
+    @type starts: array (N x 4)
+    @param seeds: random seeds of the realisations
+    @type seeds: list of int
+    @param threads: number of worker processes (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @param chunksize: number of fits sent to a worker at once
+    @type chunksize: int
+    @param output: array to store the results in (created if not given)
+    @type output: array (N x 9)
+    @param pool: pool of workers set up with L{imc_pool} for the same
+    photometry and keyword arguments (C{threads} is then ignored)
+    @type pool: Pool
+    @return: warnflag, fitted parameters and statistics for every fit (a
+    warnflag of 3 means the fit ended outside of the grid)
+    @rtype: array (N x 9)
+    """
+    if seeds is None:
+        seeds = [None]*len(starts)
+    if output is None:
+        output = np.zeros((len(starts),9))
+    tasks = [(i,tuple(start),seed) for i,(start,seed) in enumerate(zip(starts,seeds))]
+
+    own_pool = pool is None
+    if own_pool:
+        pool = imc_pool(meas,e_meas,photbands,threads=threads,**kwargs)
+    if pool is None:
+        _imc_problem.update(dict(meas=meas,e_meas=e_meas,photbands=photbands,kwargs=kwargs))
+        results = map(_imc_fit,tasks)
+    else:
+        results = pool.imap_unordered(_imc_fit,tasks,chunksize=chunksize)
+    try:
+        for i,warnflag,fittedpars in results:
+            output[i,0] = warnflag
+            if fittedpars is not None:
+                output[i,1:len(fittedpars)+1] = fittedpars
+    finally:
+        if own_pool and pool is not None:
+            pool.close()
+            pool.join()
+        _imc_problem.clear()
+    return output
+
+def imc_pool(meas,e_meas,photbands,threads=1,**kwargs):
+    """
+    Set up a pool of worker processes for L{imc}.
+
+    Every worker receives the model defaults and the photometry to fit once,
+    and keeps them (and its memoized integrated grid) for all the fits it
+    does, also over several calls of L{imc} with this pool. Close the pool
+    when done.
+
+    @param meas: measurements
+    @type meas: array
+    @param e_meas: errors on the measurements
+    @type e_meas: array
+    @param photbands: photometric passbands
+    @type photbands: array
+    @param threads: number of worker processes (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @return: pool of workers, or None if C{threads} is 1
+    @rtype: Pool
+    """
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='half':
+        threads = cpu_count()//2
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(int(threads),1)
+    if threads==1:
+        return None
+    problem = dict(meas=meas,e_meas=e_meas,photbands=photbands,kwargs=kwargs)
+    return Pool(threads,initializer=_init_imc_worker,initargs=(model.defaults.copy(),problem))
+
+def _init_imc_worker(defaults,problem):
+    """
+    Set up a Monte Carlo worker process with the model defaults and the
+    photometry to fit.
+    """
+    if defaults!=model.defaults:
+        model.set_defaults(**defaults)
+    _imc_problem.update(problem)
+
+def _imc_fit(task):
+    """
+    Do one fit of the Monte Carlo simulation.
+
+    @param task: index, starting point and seed of the realisation
+    @type task: tuple
+    @return: index, warnflag, fitted parameters (None if the fit failed)
+    @rtype: tuple
+    """
+    i,start,seed = task
+    meas,e_meas = _imc_problem['meas'],_imc_problem['e_meas']
+    if seed is not None:
+        meas = meas + np.random.RandomState(seed).normal(scale=e_meas)
+    try:
+        fittedpars,warnflag = iminimize2(meas,e_meas,_imc_problem['photbands'],
+                                         *start,**_imc_problem['kwargs'])
+    except IOError:
+        return i,3,None
+    return i,warnflag,fittedpars
+#}
+
 
 if __name__=="__main__":
     from ivs.aux import loggers
@@ -22,6 +22,11 @@ except Exception:
 # Set at True to skip integration tests.
 noIntegration = False
 
+def toy_itable(teff,logg,ebv,z,photbands=None,**kwargs):
+    """ Smooth toy model to use in place of model.get_itable """
+    wave = np.arange(1.,len(photbands)+1)
+    return wave**(-teff/5000.)*np.exp(-ebv*wave)*(1+0.05*logg*wave),1.
+
 class SEDTestCase(unittest.TestCase):
     """Add some extra usefull assertion methods to the testcase class"""
 
@@ -466,6 +471,54 @@ class MinimizeFitTestCase(SEDTestCase):
         self.assertListEqual(lumis,['labs'])
 
 
+class SampleGridTestCase(SEDTestCase):
+
+    def testSampleGrid(self):
+        """ fit.sample_grid() """
+        pdf = np.array([0.,1.,3.,6.])
+        weights = np.array([1.,1.,2.,0.5])
+        np.random.seed(1111)
+        indices = fit.sample_grid(pdf,size=100000,weights=weights)
+        freqs = np.bincount(indices,minlength=len(pdf))/100000.
+        self.assertEqual(freqs[0],0.)
+        self.assertArrayAlmostEqual(freqs,pdf*weights/np.sum(pdf*weights),delta=0.005)
+        #-- the samples are not ordered
+        self.assertTrue(np.any(np.diff(indices)<0))
+
+
+class MonteCarloTestCase(SEDTestCase):
+
+    def setUp(self):
+        self.photbands = np.array(['STROMGREN.U','STROMGREN.B','STROMGREN.V','2MASS.J','2MASS.H'])
+        self.meas = 2.*toy_itable(6000.,4.0,0.02,0.,photbands=self.photbands)[0]
+        self.emeas = 0.02*self.meas
+        self.starts = np.column_stack([np.linspace(5000.,7000.,6),np.linspace(3.5,4.5,6),
+                                       np.linspace(0.,0.05,6),np.zeros(6)])
+        self.seeds = np.random.RandomState(1).randint(2**31-1,size=6)
+
+    def testImcThreads(self):
+        """ fit.imc() independent of the number of threads """
+        output1 = fit.imc(self.meas,self.emeas,self.photbands,self.starts,seeds=self.seeds,
+                          threads=1,model_func=toy_itable)
+        output2 = fit.imc(self.meas,self.emeas,self.photbands,self.starts,seeds=self.seeds,
+                          threads=2,model_func=toy_itable)
+        self.assertTrue(np.all(output1==output2))
+        self.assertEqual(len(np.unique(output1[:,1])),len(self.starts))
+
+    def testImcPool(self):
+        """ fit.imc() several rounds on one pool """
+        first = fit.imc(self.meas,self.emeas,self.photbands,self.starts,model_func=toy_itable)
+        second = fit.imc(self.meas,self.emeas,self.photbands,self.starts,seeds=self.seeds,model_func=toy_itable)
+        pool = fit.imc_pool(self.meas,self.emeas,self.photbands,threads=2,model_func=toy_itable)
+        try:
+            self.assertTrue(np.all(first==fit.imc(self.meas,self.emeas,self.photbands,self.starts,pool=pool)))
+            self.assertTrue(np.all(second==fit.imc(self.meas,self.emeas,self.photbands,self.starts,
+                                                   seeds=self.seeds,pool=pool)))
+        finally:
+            pool.close()
+            pool.join()
+
+
 class BuilderTestCase(SEDTestCase):
 
     @classmethod
@@ -590,6 +643,44 @@ class BuilderTestCase(SEDTestCase):
         mock_sed_sbm.assert_called()
 
 
+    def testSampleGridsearch(self):
+        """ builder.sed.sample_gridsearch() with jitter """
+        grid = np.rec.fromarrays([np.array([5000.,6000.,7000.]),np.array([4.,4.5,5.]),np.array([3.,1.,2.])],
+                                 names=['teff','logg','chisq'])
+        self.sed.results['igrid_search']['grid'] = grid
+        self.sed.master = dict(include=np.ones(6,bool))
+        np.random.seed(1111)
+        samples = self.sed.sample_gridsearch(NrSamples=1000,df=2,return_grid=True,jitter=dict(teff=250.))
+        offsets = samples['teff']-np.round(samples['teff'],-3)
+        self.assertTrue(np.all(np.abs(offsets)<=125.))
+        self.assertTrue(np.std(offsets)>50.)
+        self.assertTrue(np.all(np.in1d(samples['logg'],grid['logg'])))
+        self.assertRaises(ValueError,self.sed.sample_gridsearch,NrSamples=10,df=2,return_grid=True,jitter=True)
+
+    @unittest.skipIf(noMock, "Mock not installed")
+    def testImc(self):
+        """ builder.sed.imc() independent of the number of threads """
+        photbands = np.array(['STROMGREN.U','STROMGREN.B','STROMGREN.V','2MASS.J','2MASS.H'])
+        meas = 2.*toy_itable(6000.,4.0,0.02,0.,photbands=photbands)[0]
+        self.sed.master = np.rec.fromarrays([meas,0.02*meas,photbands,np.ones(len(meas),bool)],
+                                            names=['cmeas','e_cmeas','photband','include'])
+        points = 10
+        grid = (np.linspace(5000.,7000.,points+25),np.linspace(3.5,4.5,points+25),
+                np.linspace(0.,0.05,points+25),np.zeros(points+25),np.ones(points+25))
+        self.create_patch(fit, 'generate_grid', return_value=grid)
+        self.create_patch(builder, 'photometry2str', return_value='TEST')
+        self.create_patch(model, 'get_itable', new=toy_itable)
+        self.create_patch(builder.SED, 'set_best_model')
+
+        results = []
+        for threads in [1,2]:
+            self.sed.imc(points=points,threads=threads,seed=3)
+            results.append(self.sed.results['imc']['grid'])
+        self.assertEqual(len(results[0]),points)
+        for name in results[0].dtype.names:
+            self.assertTrue(np.all(results[0][name]==results[1][name]),msg=name)
+
+
 class XIntegrationTestCase(SEDTestCase):
 
     photbands = ['STROMGREN.U', 'STROMGREN.B', 'STROMGREN.V', 'STROMGREN.Y',
@@ -468,9 +468,9 @@ def kepler(times,parameters,itermax=8):
         RVfit = parameters['gamma'].sum()
     else:
         RVfit = 0
-    for pars in parameters:
-        p = [pars['P'],pars['T0'],pars['e'],pars['omega'],pars['K'],0]
-        RVfit += keplerorbit.radial_velocity(p,times=times,itermax=itermax)
+    #-- evaluate all orbits at once (one row per orbit)
+    p = [parameters[name][:,None] for name in ['P','T0','e','omega','K']] + [0]
+    RVfit += keplerorbit.radial_velocity(p,times=times,itermax=itermax).sum(axis=0)
     return RVfit
 
 @check_input
@@ -34,6 +34,7 @@ Apply some filter:
 import logging
 import numpy as np
 from numpy import sqrt,exp,pi,cos,sinc,trapz,average
+from numpy.lib.stride_tricks import as_strided
 
 #from scipy.integrate import trapz
 
@@ -47,7 +48,8 @@ logger = logging.getLogger("TS.FILTERING")
 @defaults_filtering
 @parallel_pergram
 @make_parallel
-def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
+def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,
+                  chunk_size=100000,**kwargs):
     """
     Filter a signal.
 
@@ -83,15 +85,29 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     were used to compute the given point. E.g. for a box filter, it will give
     the number of points over which was averaged.
 
+    The built-in filters are evaluated for all points at once: the window of
+    every point is located with a binary search in the sorted C{x}, box
+    filters use cumulative sums, the INL filter selects the medians of blocks
+    of windows at once, and the Gaussian and Pijpers filters evaluate their
+    weights on blocks of (truncated) windows, or use an FFT convolution if
+    C{x} is equidistant and no template is given. The blocks contain at most
+    C{chunk_size} elements. Other kernels (or a varying C{sigma}) are
+    evaluated point by point.
+
     @param ftype: one of 'gauss','pijpers','box','inl'
     @type ftype: string
+    @param chunk_size: maximum number of elements in a block of windows
+    @type chunk_size: int
     @rtype: tuple
     @return: output from the used filter: typically (x, y, pnts)
     """
+    no_template = x_template is None
     if x_template is None:
         x_template = x + 0.
     if f0 is None: f0 = 0
     if fn is None: fn = len(x_template)
+    #-- the parallel decorator divides the index range in (float) parts
+    f0,fn = int(f0),int(fn)
     #-- set window and kernel function
     ftype = ftype.lower()
     window = globals()[ftype+'_window']
@@ -111,6 +127,21 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
     #-- start running through timeseries (make searchsorted local for speedup)
     logger.debug("FILTER between index %d-%d with step %d"%(f0,fn,step))
     x_template = x_template[f0:fn:step]
+
+    #-- all points at once for the built-in kernels
+    if ftype in ['gauss','pijpers','box','inl'] and not isinstance(kwargs.get('sigma'),np.ndarray):
+        index0 = x.searchsorted(x_template-1e-30-lower_window)
+        indexn = x.searchsorted(x_template+1e-30+higher_window)
+        if no_template and ftype in ['gauss','pijpers']:
+            out = _fft_filter(x,y,np.arange(len(x))[f0:fn:step],index0,indexn,
+                              ftype,**kwargs)
+        else:
+            out = None
+        if out is None:
+            out = globals()['_'+ftype+'_filter'](x,y,x_template,index0,indexn,
+                                                 chunk_size=chunk_size,**kwargs)
+        return tuple([x_template] + list(out))
+
     searchsorted = x.searchsorted
     out = [kernel(x,y,t,index=searchsorted([t-1e-30-lower_window[i],t+1e-30+higher_window[i]]),
                         **kwargs) for i,t in enumerate(x_template)]
@@ -119,9 +150,243 @@ def filter_signal(x,y,ftype,f0=None,fn=None,step=1,x_template=None,**kwargs):
 
 #}
 
+#{ Vectorized filters
+
+def _window_blocks(arrays,index0,indexn,chunk_size=100000):
+    """
+    Divide the windows of all points in blocks.
+
+    For every block of points, yield the slice of the points in the block,
+    the values of each of the C{arrays} in the windows of these points (one
+    row per point, continuing beyond the end of the window) and a mask of the
+    values that belong to the window.
+
+    @param arrays: arrays to cut in windows, of the same length
+    @type arrays: list of arrays
+    @param index0: first index of each window
+    @type index0: array of int
+    @param indexn: last index (exclusive) of each window
+    @type indexn: array of int
+    @param chunk_size: maximum number of values in a block
+    @type chunk_size: int
+    """
+    N = len(arrays[0])
+    npoints = np.maximum(indexn-index0,0)
+    width = max(1,npoints.max() if len(npoints) else 1)
+    rows = max(1,chunk_size//width)
+    offsets = np.arange(width)
+    #-- row k of a view is array[k:k+width]
+    views = []
+    for array in arrays:
+        padded = np.hstack([array,np.zeros(width)+array[-1:]])
+        views.append(as_strided(padded,shape=(N+1,width),strides=padded.strides*2))
+    for i in range(0,len(index0),rows):
+        block = slice(i,i+rows)
+        valid = offsets < npoints[block,None]
+        start = np.minimum(index0[block],N)
+        yield block,[view[start] for view in views],valid
+
+def _gauss_weights(dt,sigma=1.,**kwargs):
+    """
+    Weights of the Gaussian kernel at time lags C{dt}.
+    """
+    return 1./(sqrt(2.*pi)*sigma) * exp( -dt**2./(2.*sigma**2.))
+
+def _pijpers_weights(dt,delta=1.,gamma=0,r=0.0001,**kwargs):
+    """
+    Weights of the Pijpers kernel at time lags C{dt}.
+    """
+    delta = delta*2*pi
+    x = delta * dt
+    return delta/pi * sinc(x/pi) * exp(-1/4. * r**2 * x**2) * cos(gamma*x)
+
+def _weighted_filter(x,y,x_template,index0,indexn,ftype,chunk_size=100000,
+                     norm_weights=True,**kwargs):
+    """
+    Gaussian or Pijpers filter of all points, on blocks of windows.
+
+    The trapezoidal integrals over the windows are weighted sums, with the
+    coefficients of the points inside the data, corrected at the edges of the
+    windows afterwards.
+
+    @return: convolved signal, number of points
+    @rtype: array, array
+    """
+    weights_func = globals()['_'+ftype+'_weights']
+    N = len(x)
+    npoints = np.maximum(indexn-index0,0)
+    integrate = norm_weights or ftype=='pijpers'
+    coeff = np.ones(N)
+    if integrate and N>1:
+        coeff[1:-1] = 0.5*(x[2:]-x[:-2])
+        coeff[0],coeff[-1] = 0.5*(x[1]-x[0]),0.5*(x[-1]-x[-2])
+    convolved = np.zeros(len(x_template))
+    norm_fact = np.zeros(len(x_template))
+    w_first = np.zeros(len(x_template))
+    w_last = np.zeros(len(x_template))
+    for block,(times,cy,c),valid in _window_blocks([x,coeff*y,coeff],index0,indexn,chunk_size):
+        weights = weights_func(times-x_template[block,None],**kwargs)
+        weights *= valid
+        convolved[block] = np.einsum('ij,ij->i',weights,cy)
+        norm_fact[block] = np.einsum('ij,ij->i',weights,c)
+        w_first[block] = weights[:,0]
+        w_last[block] = weights[np.arange(len(weights)),np.maximum(npoints[block]-1,0)]
+    #-- the first and last point of a window only count for half an interval
+    if integrate:
+        for j,k,w in [(index0,index0-1,w_first),(indexn-1,indexn,w_last)]:
+            edge = (npoints>1) & (k>=0) & (k<N)
+            j,k,w = j[edge],k[edge],w[edge]
+            half = 0.5*np.abs(x[j]-x[k])*w
+            convolved[edge] -= half*y[j]
+            norm_fact[edge] -= half
+    with np.errstate(invalid='ignore',divide='ignore'):
+        convolved_signal = convolved/norm_fact
+    convolved_signal[npoints<(integrate and 2 or 1)] = np.nan
+    return convolved_signal,npoints.astype(float)
+
+def _fft_filter(x,y,points,index0,indexn,ftype,norm_weights=True,**kwargs):
+    """
+    Gaussian or Pijpers filter of equidistant points via an FFT convolution.
+
+    The signal is convolved with the kernel over the largest window, after
+    which the points outside the window of each output point are removed
+    again. Returns None if C{x} is not equidistant.
+
+    @param points: indices of the output points in C{x}
+    @type points: array of int
+    @return: convolved signal, number of points
+    @rtype: array, array
+    """
+    N = len(x)
+    if N<2 or not len(points):
+        return None
+    h = (x[-1]-x[0])/(N-1.)
+    if h<=0 or np.abs(np.diff(x)-h).max()>1e-9*h:
+        return None
+    weights_func = globals()['_'+ftype+'_weights']
+    npoints = np.maximum(indexn-index0,0)
+    #-- convolution with the kernel over [i-K,i+K]
+    K = max((points-index0).max(),(indexn-1-points).max(),0)
+    kernel = weights_func(np.arange(-K,K+1)*h,**kwargs)
+    nfft = 2**int(np.ceil(np.log2(N+2*K+1)))
+    fkernel = np.fft.rfft(kernel,nfft)
+    convolved = np.fft.irfft(np.fft.rfft(y,nfft)*fkernel,nfft)[K:K+N][points]
+    norm_fact = np.fft.irfft(np.fft.rfft(np.ones(N),nfft)*fkernel,nfft)[K:K+N][points]
+    #-- remove the points outside the actual windows
+    extra_lo = index0 - np.maximum(points-K,0)
+    extra_hi = np.minimum(points+K+1,N) - indexn
+    if max(extra_lo.max(),extra_hi.max())>K//2+1:
+        return None
+    for start,number in [(np.maximum(points-K,0),extra_lo),(indexn,extra_hi)]:
+        for d in range(number.max()):
+            use = number>d
+            j = start[use]+d
+            weights = weights_func(x[j]-x[points[use]],**kwargs)
+            convolved[use] -= weights*y[j]
+            norm_fact[use] -= weights
+    #-- trapezoidal integration gives half weight to the edges of the window
+    integrate = norm_weights or ftype=='pijpers'
+    if integrate:
+        for j in [index0,indexn-1]:
+            use = npoints>0
+            weights = 0.5*weights_func(x[j[use]]-x[points[use]],**kwargs)
+            convolved[use] -= weights*y[j[use]]
+            norm_fact[use] -= weights
+    with np.errstate(invalid='ignore',divide='ignore'):
+        convolved_signal = convolved/norm_fact
+    convolved_signal[npoints<(integrate and 2 or 1)] = np.nan
+    return convolved_signal,npoints.astype(float)
+
+def _box_filter(x,y,x_template,index0,indexn,norm_weights=True,**kwargs):
+    """
+    Box filter of all points via cumulative sums.
+
+    @return: convolved signal, number of points
+    @rtype: array, array
+    """
+    npoints = np.maximum(indexn-index0,0)
+    #-- subtract the average to limit round-off in the cumulative sums
+    offset = y.mean() if len(y) else 0.
+    cumsum = np.hstack([0.,np.cumsum(y-offset)])
+    convolved_signal = cumsum[np.maximum(indexn,index0)] - cumsum[index0] + npoints*offset
+    if norm_weights:
+        convolved_signal[npoints>0] /= npoints[npoints>0]
+    return convolved_signal,npoints.astype(float)
+
+def _masked_median(values,keep):
+    """
+    Median of the kept values in every row of a 2D array.
+
+    The other values are replaced by -inf and +inf, such that the median of
+    the kept values is found at the same position in every row, and can be
+    selected for all rows at once.
+
+    @return: median of each row (nan if no values are kept)
+    @rtype: array
+    """
+    width = values.shape[1]
+    n = keep.sum(axis=1)
+    below = (width-1)//2 - (n-1)//2
+    rank = np.cumsum(~keep,axis=1)
+    values = np.where(keep,values,np.where(rank<=below[:,None],-np.inf,np.inf))
+    k = (width-1)//2
+    values.partition([k,min(k+1,width-1)],axis=1)
+    lower = values[:,k]
+    upper = np.where(n%2==0,values[:,min(k+1,width-1)],lower)
+    median = (lower+upper)/2.
+    median[n==0] = np.nan
+    return median
+
+def _inl_filter(x,y,x_template,index0,indexn,c=0.6745,sig_level=3.,
+                tolerance=0.01,chunk_size=100000,**kwargs):
+    """
+    Iterative Nonlinear Filter of all points, on blocks of windows.
+
+    Equivalent to L{inl_kernel}, but the outliers of each iteration are
+    removed from the points that remain after the previous one.
+
+    @return: continuum, sigma, number of points
+    @rtype: array, array, array
+    """
+    continuum_out = np.zeros(len(x_template))
+    sigma_out = np.zeros(len(x_template))
+
+    def mad_median(values,keep):
+        median = _masked_median(values,keep)
+        return _masked_median(np.abs(values-median[:,None]),keep)/c,median
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        for block,(values,),valid in _window_blocks([y],index0,indexn,chunk_size):
+            sigma,continuum = mad_median(values,valid)
+            keep = valid & ~(np.abs(continuum[:,None]-values)>sig_level*sigma[:,None])
+            active = np.ones(len(values),bool)
+            max_iter = 3
+            for iteration in range(max_iter):
+                sigma,continuum_ = mad_median(values,keep)
+                continuum_out[block][active] = continuum_[active]
+                sigma_out[block][active] = sigma[active]
+                active &= ~(np.abs((continuum_-continuum)/continuum_)<tolerance)
+                continuum = continuum_
+                keep &= ~(np.abs(continuum[:,None]-values)>sig_level*sigma[:,None])
+    return continuum_out,sigma_out,np.maximum(indexn-index0,0).astype(float)
+
+def _gauss_filter(x,y,x_template,index0,indexn,**kwargs):
+    """
+    Gaussian filter of all points.
+    """
+    return _weighted_filter(x,y,x_template,index0,indexn,'gauss',**kwargs)
+
+def _pijpers_filter(x,y,x_template,index0,indexn,**kwargs):
+    """
+    Pijpers filter of all points.
+    """
+    return _weighted_filter(x,y,x_template,index0,indexn,'pijpers',**kwargs)
+
+#}
+
 #{ Basic functions for convolution-based filters
 
-def _fixed_window(window_width=0):
+def _fixed_window(window_width=0,**kwargs):
     """
     Define general window
     @rtype: (float,float)
@@ -134,7 +399,7 @@ def _fixed_window(window_width=0):
 #}
 #{ Convolution-based filter kernels and Windows
 
-def gauss_window(sigma=1.,limit=4.):
+def gauss_window(sigma=1.,limit=4.,**kwargs):
     """
     Define Gaussian_window
     @rtype: (float,float)
@@ -182,7 +447,7 @@ def gauss_kernel(times, signal, t,sigma=1.,index=(0,-1),norm_weights=True):
     #-- compute convolution kernel -- should we normalize? so that sum(weights)=1
     times_ = times[index0:indexn]
     signal_ = signal[index0:indexn]
-    weights = 1./(sqrt(2.*pi)*sigma) * exp( -(times_-t)**2./(2.*sigma**2.))
+    weights = _gauss_weights(times_-t,sigma=sigma)
     if norm_weights and len(times)>1:
         convolved = trapz(weights*signal_,x=times_-t)
         norm_fact = trapz(weights,x=times_-t)
@@ -265,7 +530,7 @@ def inl_kernel(times_in,signal_in,t,c=0.6745,sig_level=3.,tolerance=0.01,index=(
 
     return continuum_, sigma,len(times)
 
-def pijpers_window(delta=1.):
+def pijpers_window(delta=1.,**kwargs):
     """
     Defines the window for the Pijpers filter.
 
@@ -318,11 +583,8 @@ def pijpers_kernel(times_in, signal_in,t,limit=0.000001,delta=1.,sigma=1.,gamma=
     times = times_in[index0:indexn]
     signal = signal_in[index0:indexn]
 
-    delta = delta*2*pi
-
-    x = delta * (times-t)
     #-- compute convolution kernel -- should we normalize? so that sum(weights)=1
-    weights = delta/pi * sinc(x/pi) * exp(-1/4. * r**2 * x**2) * cos(gamma*x)
+    weights = _pijpers_weights(times-t,delta=delta,gamma=gamma,r=r)
     #-- compensate for severe unequidistant sampling
     convolved = np.trapz(weights*signal,x=times-t)
     norm_fact = np.trapz(weights,x=times-t)
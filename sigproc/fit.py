@@ -431,6 +431,7 @@ from numpy import pi,cos,sin
 import numpy.linalg as la
 from scipy.interpolate import splrep
 import scipy.optimize
+import scipy.linalg
 
 from ivs.aux import progressMeter as progress
 from ivs.sigproc import evaluate
@@ -447,7 +448,7 @@ logger = logging.getLogger('SP.FIT')
 #{Linear fit functions
 
 
-def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
+def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0,design=None):
     """
     Fit a harmonic function.
 
@@ -460,10 +461,21 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
 
     (phase in radians!)
 
+    The same frequencies can be fitted to many signals sharing the same time
+    points at once, by giving the signals as the columns of a 2D array. The
+    parameters of the k-th signal are then found in the k-th row of the
+    returned record array.
+
+    When fitting with a growing set of frequencies on the same time points
+    (e.g. during prewhitening), pass a L{HarmonicDesign} as C{design}: the
+    basis functions and the decomposition of the design matrix of the
+    previous call are then reused. C{sigma}, C{constant} and C{t0} are then
+    taken from the design.
+
     @param times: time points
     @type times: numpy array
     @param signal: observations
-    @type signal: numpy array
+    @type signal: numpy array (Ndata, or Ndata x Nsignals)
     @param freq: frequencies of the harmonics
     @type freq: numpy array or float
     @keyword sigma: standard error of observations
@@ -474,60 +486,40 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
     @type error: boolean
     @keyword t0: time zero point.
     @type t0: float
+    @keyword design: design matrix to (re)use
+    @type design: HarmonicDesign
     @return: parameters
     @rtype: record array
     """
-    #-- Subtract the zero point from the time points.
-    times = times - t0
-
     #-- Prepare the input: if a frequency value is given, put it in a list. If
     #   an iterable is given convert it to an array
     if not hasattr(freq,'__len__'):
         freq = [freq]
     freq = np.asarray(freq)
-    #   do the same for the sigmas
-    if sigma is None:
-        sigma = np.ones_like(signal)
-    elif not hasattr(sigma,'__len__'):
-        sigma = sigma * np.ones_like(signal)
-
-    #-- Determine the number of fit parameters
-    Ndata = len(times)
-    Nfreq = len(freq)
-    if not constant: Nparam = 2*Nfreq
-    else:            Nparam = 2*Nfreq+1
 
     #-- The fit function used is of the form
     #      C + \sum_j a_j sin(2pi\nu_j t_i) + b_j cos(2pi\nu_j t_i)
     #   which is linear in its fit parameters. These parameters p can therefore be
     #   solved by minimizing ||b - A p||, where b are the observations, and A is the
     #   basisfunction matrix, i.e. A[i,j] is the j-th base function evaluated in
-    #   the i-th timepoint. The first Nfreq columns are the amplitudes of the sine,
-    #   the second Nfreq columns are the amplitudes of the cosine, and if requested,
-    #   the last column belongs to the constant
-    A = np.zeros((Ndata,Nparam))
-    for j in range(Nfreq):
-        A[:,j]       = sin(2*pi*freq[j]*times) * sigma
-        A[:,Nfreq+j] = cos(2*pi*freq[j]*times) * sigma
-    if constant:
-        A[:,2*Nfreq] = np.ones(Ndata) * sigma
-
-    b = signal * sigma
-
-    #-- Solve using SVD decomposition
-    fitparam, chisq, rank, s = np.linalg.lstsq(A,b)
+    #   the i-th timepoint (see HarmonicDesign).
+    if design is None:
+        design = HarmonicDesign(times,sigma=sigma,constant=constant,t0=t0)
+    design.set_frequencies(freq)
+    fitparam = design.solve(signal)
+    constant = design.constant
 
     #-- Compute the amplitudes and phases: A_j sin(2pi*\nu_j t_i + phi_j)
-    amplitude = np.zeros(Nfreq)
-    phase = np.zeros(Nfreq)
-    for j in range(Nfreq):
-        amplitude[j] = np.sqrt(fitparam[j]**2 + fitparam[Nfreq+j]**2)
-        phase[j]     = np.arctan2(fitparam[Nfreq+j], fitparam[j])
+    Ndata = len(times)
+    Nfreq = len(freq)
+    amplitude = np.sqrt(fitparam[:Nfreq]**2 + fitparam[Nfreq:2*Nfreq]**2).T
+    phase = np.arctan2(fitparam[Nfreq:2*Nfreq], fitparam[:Nfreq]).T
+    freq = freq*np.ones_like(amplitude)
 
     #-- If no error bars are needed, we are finished here, we collect all parameters
     if constant:
-        constn = np.zeros(len(amplitude))
-        constn[0] = fitparam[2*Nfreq]
+        constn = np.zeros_like(amplitude)
+        constn[...,0] = fitparam[2*Nfreq]
         names = ['const','ampl','freq','phase']
         fpars = [constn,amplitude,freq,phase/(2*pi)]
     else:
@@ -540,6 +532,141 @@ def sine(times, signal, freq, sigma=None,constant=True,error=False,t0=0):
 
     return parameters
 
+class HarmonicDesign(object):
+    """
+    Design matrix of a harmonic fit on a fixed set of time points.
+
+    The columns of the matrix are the (weighted) basis functions
+    C{sin(2pi nu_j t)} and C{cos(2pi nu_j t)} for every frequency, and
+    optionally a constant. The matrix is kept as a thin QR decomposition,
+    which is updated when frequencies are added: the basis functions of
+    frequencies that were already present are not recomputed, and the
+    decomposition of the unchanged leading frequencies is kept.
+
+    >>> times = np.linspace(0,100,1000)
+    >>> signal = 2*np.sin(2*pi*0.5*times) + np.sin(2*pi*0.71*times+1.)
+    >>> design = HarmonicDesign(times)
+    >>> pars1 = sine(times,signal,[0.5],design=design)
+    >>> pars2 = sine(times,signal,[0.5,0.71],design=design)
+
+    Only the columns of the second frequency were added in the second call.
+    """
+    def __init__(self,times,sigma=None,constant=True,t0=0):
+        """
+        Set up an (empty) design matrix.
+
+        @param times: time points
+        @type times: numpy array
+        @param sigma: standard error of observations
+        @type sigma: numpy array or float
+        @param constant: also fit a constant
+        @type constant: boolean
+        @param t0: time zero point
+        @type t0: float
+        """
+        self.times = times - t0
+        if sigma is None:
+            sigma = np.ones_like(self.times)
+        elif not hasattr(sigma,'__len__'):
+            sigma = sigma * np.ones_like(self.times)
+        self.sigma = sigma
+        self.constant = constant
+        self.freq = np.zeros(0)
+        self._columns = {}
+        self._Q = np.zeros((len(self.times),0))
+        self._R = np.zeros((0,0))
+        self._deficient = []
+        if constant:
+            self._append([self.sigma*np.ones(len(self.times))])
+
+    def set_frequencies(self,freq):
+        """
+        Set the frequencies of the harmonics.
+
+        The decomposition is kept for the leading frequencies that did not
+        change, and updated with the columns of the other ones.
+
+        @param freq: frequencies of the harmonics
+        @type freq: numpy array
+        """
+        freq = np.asarray(freq,float)
+        #-- the number of leading frequencies that remain the same
+        keep = 0
+        for f_old,f_new in zip(self.freq,freq):
+            if f_old!=f_new: break
+            keep += 1
+        if keep==len(freq)==len(self.freq):
+            return
+        ncols = (self.constant and 1 or 0) + 2*keep
+        self._Q = self._Q[:,:ncols]
+        self._R = self._R[:ncols,:ncols]
+        self._deficient = self._deficient[:ncols]
+        #-- compute (or take from the cache) the basis functions of the new
+        #   frequencies, and forget the ones of removed frequencies
+        columns = []
+        for f in freq[keep:]:
+            if not f in self._columns:
+                arg = 2*pi*f*self.times
+                self._columns[f] = sin(arg)*self.sigma,cos(arg)*self.sigma
+            columns += list(self._columns[f])
+        self._columns = dict([(f,self._columns[f]) for f in freq])
+        if columns:
+            self._append(columns)
+        self.freq = freq
+
+    def _append(self,columns):
+        """
+        Append columns to the QR decomposition.
+
+        The new columns are orthogonalised against the current ones (twice,
+        for numerical stability), and the remainder is decomposed separately.
+        """
+        C = np.column_stack(columns)
+        norms = np.sqrt((C**2).sum(axis=0))
+        n,m = self._R.shape[0],C.shape[1]
+        R12 = np.zeros((n,m))
+        for i in range(2):
+            if not n: break
+            R12_ = np.dot(self._Q.T,C)
+            C = C - np.dot(self._Q,R12_)
+            R12 += R12_
+        Q22,R22 = la.qr(C)
+        R = np.zeros((n+m,n+m))
+        R[:n,:n] = self._R
+        R[:n,n:] = R12
+        R[n:,n:] = R22
+        self._Q = np.hstack([self._Q,Q22])
+        self._R = R
+        #-- remember which columns are (nearly) linear combinations of the
+        #   previous ones
+        self._deficient += list(np.abs(R22.diagonal())<=1e-10*np.maximum(norms,1e-300))
+
+    def solve(self,signal):
+        """
+        Solve the least-squares problem for one or more signals.
+
+        @param signal: observations
+        @type signal: numpy array (Ndata, or Ndata x Nsignals)
+        @return: coefficients of the sines, of the cosines and of the constant
+        (if any), in that order
+        @rtype: array (Nparam, or Nparam x Nsignals)
+        """
+        sigma = self.sigma if signal.ndim==1 else self.sigma[:,None]
+        b = signal * sigma
+        if not any(self._deficient):
+            coeffs = scipy.linalg.solve_triangular(self._R,np.dot(self._Q.T,b))
+        else:
+            #-- rank deficient: fall back to the minimum norm solution
+            columns = self.constant and [self.sigma*np.ones(len(self.times))] or []
+            for f in self.freq:
+                columns += list(self._columns[f])
+            coeffs = la.lstsq(np.column_stack(columns),b,rcond=-1)[0]
+        #-- reorder from (constant, sin1, cos1, sin2, ...) to
+        #   (sin1, sin2, ..., cos1, cos2, ..., constant)
+        nconst = self.constant and 1 or 0
+        order = list(range(nconst,len(coeffs),2)) + list(range(nconst+1,len(coeffs),2)) + list(range(nconst))
+        return coeffs[order]
+
 def periodic_spline(times, signal, freq, t0=None, order=20, k=3):
     """
     Fit a periodic spline.
@@ -897,13 +1024,17 @@ def gauss(x,y,threshold=0.1,constant=False,full_output=False,
 #}
 #{ Error determination
 
-def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
+def e_sine(times,signal,parameters,correlation_correction=True,limit=10000,chunk_size=1000000):
     """
     Compute the errors on the parameters from a sine fit.
 
     Note: errors on the constant are only calculated when the number of datapoints
     is below 1000. Otherwise, the matrices involved become to huge.
 
+    The derivative matrix and the residuals after each frequency are
+    computed for all frequencies at once, in chunks of at most C{chunk_size}
+    elements to limit the memory use for long timeseries.
+
     @param times: time points
     @type times: numpy array
     @param signal: observations
@@ -918,6 +1049,8 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     The routines skips the estimation of the error on the constant if the timeseries
     is longer than C{limit} datapoints
     @type limit: integer
+    @param chunk_size: maximum number of elements of the intermediate arrays
+    @type chunk_size: integer
     @return: errors
     @rtype: Nx4 array(, Nx3 array)
     """
@@ -935,8 +1068,8 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     T = times.ptp()
 
     #-- do we need to include the constant?
-    if 'const' in parameters.dtype.names:
-        constant = True
+    constant = 'const' in parameters.dtype.names
+    if constant:
         Nparam += 1
 
     #-- these lists will contain the columns and their names
@@ -948,15 +1081,16 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
     if constant and Ndata<limit:
         #   First the derivative matrix: the 1st Nfreq columns the derivative w.r.t.
         #   the amplitude, the 2nd Nfreq columns w.r.t. the phase, and the if relevant
-        #   the last column w.r.t. the constant. From this the covariance matrix.
-        F = np.zeros((Ndata, Nparam))
-        for i in range(Ndata):
-            F[i,0:Nfreq] = sin(2*pi*freq*times[i] + phase)
-            F[i,Nfreq:2*Nfreq] = amplitude * cos(2*pi*freq*times[i] + phase)
-            #-- and for the constant
-            F[i,2*Nfreq] = 1.0
-
-        covariance = np.linalg.inv(np.dot(F.T, F))
+        #   the last column w.r.t. the constant. From this the covariance matrix,
+        #   accumulated over chunks of datapoints.
+        FTF = np.zeros((Nparam,Nparam))
+        step = max(1,chunk_size//Nparam)
+        for i in range(0,Ndata,step):
+            arg = 2*pi*freq*times[i:i+step,None] + phase
+            F = np.hstack([sin(arg),amplitude*cos(arg),np.ones((len(arg),1))])
+            FTF += np.dot(F.T, F)
+
+        covariance = np.linalg.inv(FTF)
         covariance *= chisq / (Ndata - Nparam)
 
         #error_ampl = np.sqrt(covariance.diagonal()[:Nfreq])
@@ -971,25 +1105,30 @@ def e_sine(times,signal,parameters,correlation_correction=True,limit=10000):
         errors.append(np.zeros(Nfreq))
         names.append('e_const')
 
-    #-- other variables
+    #-- other variables: the residuals after subtracting the first i
+    #   frequencies are computed for a block of frequencies at once
     errors_ = np.zeros((Nfreq,3))
     residus = signal + 0.
-    for i in range(1,Nfreq+1):
-        residus -= evaluate.sine(times,parameters[i-1:i])
-        a       = parameters[i-1]['ampl']
-        sigma_m = np.std(residus)
+    step = max(1,chunk_size//max(Ndata,1))
+    for i in range(0,Nfreq,step):
+        pars = parameters[i:i+step]
+        sines = pars['ampl'][:,None]*sin(2*pi*(pars['freq'][:,None]*times+pars['phase'][:,None]))
+        if constant:
+            sines = pars['const'][:,None] + sines
+        residuals = np.subtract.accumulate(np.vstack([residus,sines]),axis=0)[1:]
+        residus = residuals[-1]
+        a       = pars['ampl']
+        sigma_m = np.std(residuals,axis=1)
 
         #-- error on amplitude, frequency and phase (in that order)
-        errors_[i-1,0] = np.sqrt(2./Ndata) * sigma_m
-        errors_[i-1,1] = np.sqrt(6./Ndata) * 1. / (pi*T) * sigma_m / a
-        errors_[i-1,2] = np.sqrt(2./Ndata) * sigma_m / a
+        errors_[i:i+step,0] = np.sqrt(2./Ndata) * sigma_m
+        errors_[i:i+step,1] = np.sqrt(6./Ndata) * 1. / (pi*T) * sigma_m / a
+        errors_[i:i+step,2] = np.sqrt(2./Ndata) * sigma_m / a
 
         #-- correct for correlation effects
         if correlation_correction:
-            rho = max(1,get_correlation_factor(residus))
-            errors_[i-1,0] *= np.sqrt(rho)
-            errors_[i-1,1] *= np.sqrt(rho)
-            errors_[i-1,2] *= np.sqrt(rho)
+            rho = np.maximum(1,get_correlation_factor(residuals))
+            errors_[i:i+step] *= np.sqrt(rho)[:,None]
 
     #-- collect results and return
     e_parameters = np.rec.fromarrays(errors+[errors_[:,0],errors_[:,1],errors_[:,2]],
@@ -2579,6 +2718,9 @@ def get_correlation_factor(residus, full_output=False):
 
     The errors are then underestimated by a factor 1/sqrt(rho).
 
+    If C{residus} is a 2D array, the correlation factor of every row is
+    returned.
+
     @param residus: residus after the fit
     @type residus: numpy array
     @param full_output: if True, the groups of data with same sign will be returned
@@ -2586,20 +2728,23 @@ def get_correlation_factor(residus, full_output=False):
     @return: rho(,same sign groups)
     @rtype: float(,list)
     """
-    same_sign_groups = [1]
-
-    for i in range(1,len(residus)):
-        if np.sign(residus[i])==np.sign(residus[i-1]):
-            same_sign_groups[-1] += 1
-        else:
-            same_sign_groups.append(0)
-
-    rho = np.average(same_sign_groups)
-
-    logger.debug("Correlation factor rho = %f, sqrt(rho)=%f"%(rho,np.sqrt(rho)))
+    residus = np.asarray(residus)
+    signs = np.sign(residus)
+    same_sign = signs[...,1:]==signs[...,:-1]
+    #-- the first group starts with one element, and every change of sign
+    #   starts a new (empty) group; the other elements join the current group
+    nr_same = same_sign.sum(axis=-1)
+    nr_groups = 1 + (residus.shape[-1]-1) - nr_same
+    rho = (1. + nr_same) / nr_groups
+
+    if residus.ndim==1:
+        logger.debug("Correlation factor rho = %f, sqrt(rho)=%f"%(rho,np.sqrt(rho)))
 
     if full_output:
-        return rho, same_sign_groups
+        groups = np.cumsum(~same_sign,axis=-1)
+        same_sign_groups = np.bincount(groups[same_sign],minlength=nr_groups)
+        same_sign_groups[0] += 1
+        return rho, same_sign_groups.tolist()
     else:
         return rho
 
@@ -103,6 +103,7 @@ we plot the LSD profile when taking binarity into account.
 import pylab as pl
 import numpy as np
 import numpy.linalg as la
+import scipy.sparse
 from ivs.sigproc import evaluate
 import itertools
 
@@ -117,12 +118,17 @@ def lsd(velos,V,S,rvs,masks,Lambda=0.):
     of C{(centers,weights)} (if you give only one mask, give
     C{masks=[(centers,weights)]}.
 
+    The line pattern matrix is built as a sparse matrix (see L{line_pattern}),
+    so that masks with many lines and long spectra can be handled. All
+    observations (columns of C{V}) share the mask, and are deconvolved at
+    once.
+
     See Donati, 1997 for the original paper and Kochukhov, 2010 for extensions.
 
     @parameter velos: velocity vector of observations
     @type velos: array of length N_spec
     @parameter V: observation array
-    @type V: N_obs x N_spec array
+    @type V: N_spec x N_obs array
     @parameter S: weights of individual pixels
     @type S: array of length N_spec
     @parameter rvs: radial velocity vector to compute the profile on
@@ -135,46 +141,24 @@ def lsd(velos,V,S,rvs,masks,Lambda=0.):
     @rtype: 2D array, 2D array
     """
     #-- some global parameters
-    m,n = len(rvs),len(velos)
-    Nspec = V.shape[1]
+    m = len(rvs)
     Nmask = len(masks)
-    V = np.matrix(V)-1
-
-    #-- weights of the individual pixels
-    S = np.matrix(np.diag(S))
-    #-- line masks (yes, this can be vectorized but I'm too lazy for the moment)
-    M = np.matrix(np.zeros((n,m*len(masks))))
-    for N,(line_centers,weights) in enumerate(masks):
-        for l,lc in enumerate(line_centers):
-            for i in range(n):
-                for j in range(m-1):
-                    vi = velos[i]-lc
-                    if not (rvs[j]<vi<rvs[j+1]): continue
-                    M[i,j+  N*m] = weights[l]*(rvs[j+1]-vi)/(rvs[j+1]-rvs[j])
-                    M[i,j+1+N*m] = weights[l]*(vi    -rvs[j])/(rvs[j+1]-rvs[j])
-    M = np.matrix(M)
-    #-- regularization parameter
-    if Lambda:
-        R = np.matrix(np.zeros((m*Nmask,m*Nmask)))
-        for i in range(1,m-1):
-            R[i,i] = 2
-            R[i-1,i] = -1
-            R[i+1,i] = -1
-        R[0,0] = 1
-        R[1,0] = -1
-        R[-1,-1] = 1
-        R[-2,-1] = -1
-    #-- compute the LSD
-    X = M.T*(S**2)
-    XM = X*M
+    V = np.asarray(V,float)-1
+    if V.ndim==1:
+        V = V[:,None]
+
+    #-- line masks and weights of the individual pixels
+    M = line_pattern(velos,rvs,masks)
+    S = np.asarray(S,float).ravel()
+    X = M.T.multiply(S**2).tocsr()
+    #-- compute the LSD: the normal equations are only of size m.Nmask, the
+    #   same for all observations
+    XM = (X*M).toarray()
     if Lambda:
-        XM = XM+Lambda*R
+        XM = XM+Lambda*regularization_matrix(m,Nmask).toarray()
     cc = X*V # this is in fact the cross correlation profile
     #-- XM is of shape (mxm), cc is of shape (mxNspec)
-    #-- we can solve this system quickly ourselves or call numpy. I find the
-    #   latter more elegant, but it might be slower.
-    #Z = la.inv(XM)*cc
-    Z,res,rank,s = la.lstsq(XM,cc)
+    Z,res,rank,s = la.lstsq(XM,cc,rcond=-1)
     #-- retrieve LSD profile and cross-correlation function
     Z = np.array(Z.T)
     cc = np.array(cc.T)
@@ -190,6 +174,79 @@ def lsd(velos,V,S,rvs,masks,Lambda=0.):
     #-- that's it!
     return Z_,C_
 
+def line_pattern(velos,rvs,masks):
+    """
+    Construct the line pattern matrix of LSD.
+
+    Every line of a mask contributes to the pixels whose velocity relative to
+    the line center falls within the C{rvs} grid, by linear interpolation
+    between the two neighbouring velocity bins. Contributions of overlapping
+    lines are added.
+
+    The matrix is built in one pass: the pixels near each line are located
+    with a binary search, so the cost scales with the number of nonzero
+    elements instead of with N_spec x N_lines.
+
+    @parameter velos: velocity vector of observations
+    @type velos: array of length N_spec
+    @parameter rvs: radial velocity vector to compute the profile on
+    @type rvs: array of length N_rv
+    @parameter masks: list of tuples (center velocities, weights)
+    @type masks: list (length N_mask) of tuples of 1D arrays
+    @return: line pattern matrix
+    @rtype: sparse matrix (N_spec x (N_rv.N_mask))
+    """
+    velos = np.asarray(velos,float)
+    rvs = np.asarray(rvs,float)
+    m,n = len(rvs),len(velos)
+    order = np.argsort(velos)
+    sorted_velos = velos[order]
+    rows,cols,values = [],[],[]
+    for N,(line_centers,weights) in enumerate(masks):
+        line_centers = np.asarray(line_centers,float)
+        weights = np.asarray(weights,float)
+        #-- candidate pixels of every line (one extra on both sides to be
+        #   safe from round-off, the exact selection is done below)
+        start = np.maximum(sorted_velos.searchsorted(line_centers+rvs[0])-1,0)
+        stop = np.minimum(sorted_velos.searchsorted(line_centers+rvs[-1],side='right')+1,n)
+        counts = np.maximum(stop-start,0)
+        line = np.repeat(np.arange(len(line_centers)),counts)
+        pixel = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts-start,counts)]
+        #-- velocity bin of every pixel
+        vi = velos[pixel]-line_centers[line]
+        j = rvs.searchsorted(vi,side='right')-1
+        keep = (j>=0) & (j<m-1)
+        keep[keep] = (rvs[j[keep]]<vi[keep]) & (vi[keep]<rvs[j[keep]+1])
+        pixel,line,vi,j = pixel[keep],line[keep],vi[keep],j[keep]
+        w = weights[line]/(rvs[j+1]-rvs[j])
+        rows += [pixel,pixel]
+        cols += [j+N*m,j+1+N*m]
+        values += [w*(rvs[j+1]-vi),w*(vi-rvs[j])]
+    if not rows:
+        return scipy.sparse.csr_matrix((n,m*len(masks)))
+    M = scipy.sparse.coo_matrix((np.hstack(values),(np.hstack(rows),np.hstack(cols))),
+                                shape=(n,m*len(masks)))
+    return M.tocsr()
+
+def regularization_matrix(m,Nmask=1):
+    """
+    Tikhonov regularization matrix of LSD profiles.
+
+    For every profile, this penalizes the differences between neighbouring
+    velocity bins.
+
+    @parameter m: number of velocity bins of a profile
+    @type m: int
+    @parameter Nmask: number of profiles
+    @type Nmask: int
+    @return: regularization matrix
+    @rtype: sparse matrix ((m.Nmask) x (m.Nmask))
+    """
+    diagonal = 2*np.ones(m)
+    diagonal[0] = diagonal[-1] = 1
+    R = scipy.sparse.diags([-np.ones(m-1),diagonal,-np.ones(m-1)],[-1,0,1])
+    return scipy.sparse.kron(scipy.sparse.identity(Nmask),R).tocsr()
+
 def __generate_test_spectra(Nspec,binary=False,noise=0.01):
     spec_length = 1000 # n
     velo_length = 100 # m
@@ -1,40 +1,77 @@
 """
 Compute the moments of a line profile.
+
+A single profile:
+
+>>> velo = np.linspace(-100,100,201)
+>>> flux = 1 - 0.5*np.exp(-(velo-10)**2/(2*20.**2))
+>>> moms,e_moms = moments(velo,flux,SNR=200.)
+
+A stack of profiles (one per row, on a common velocity grid) is integrated at
+once, giving one column of moments per profile:
+
+>>> fluxes = np.array([flux,flux[::-1]])
+>>> moms,e_moms = moments(velo,fluxes,SNR=[200.,150.])
+
+For a long list of profile files, L{moments_fromfiles} reads the files
+(optionally in parallel), and L{iter_moments_fromfiles} yields the moments
+chunk by chunk, so that they can be written out while the rest is computed.
 """
+from multiprocessing import Pool,cpu_count
 import numpy as np
 import scipy.integrate
-import pylab as pl
 from ivs import config
 
 def moments(velo,flux,SNR=200.,max_mom=3):
     """
     Compute the moments from a line profile.
+
+    If C{flux} is 2D, every row is a profile and all profiles are integrated at
+    once. C{velo} is then either the common velocity grid or an array with
+    the same shape as C{flux}, and C{SNR} a float or one value per profile.
+    The moments and errors then have one column per profile.
+
+    @param velo: velocities
+    @type velo: array
+    @param flux: normalised flux (1D) or fluxes (2D, one profile per row)
+    @type flux: array
+    @param SNR: signal to noise ratio of the profile(s)
+    @type SNR: float or array
+    @param max_mom: maximum moment to compute
+    @type max_mom: integer
+    @return: moments, errors on the moments
+    @rtype: array (max_mom+1) or (max_mom+1 x Nprofiles), idem
     """
-    mymoms,e_mymoms = np.zeros(max_mom+1),np.zeros(max_mom+1)
+    velo = np.asarray(velo,float)
+    flux = np.asarray(flux,float)
+    SNR = np.asarray(SNR,float)
+    if flux.ndim>1:
+        SNR = SNR.reshape(-1,1)
+    #-- velo^n for all moments n, on a separate axis before the velocities
+    powers = velo[...,None,:]**np.arange(max_mom+1)[:,None]
+    if velo.ndim>1:
+        velo = velo[...,None,:]
 
-    #-- compute zeroth moment (equivalent width)
-    m0 = scipy.integrate.simps( (1-flux),x=velo)
+    #-- integrate the profile times velo^n for all n at once. The zeroth
+    #   moment is the equivalent width.
+    integrals = scipy.integrate.simps((1-flux)[...,None,:]*powers,x=velo,axis=-1)
+    m0 = integrals[...,0]
 
     #-- to calculate the uncertainties, we need the error in each velocity
     #   bin, and the error on the zeroth moment
     sigma_i = 1./SNR / np.sqrt(flux)
-    Delta_v0 = np.sqrt(scipy.integrate.simps( sigma_i,x=velo)**2)
-    e_m0 = np.sqrt(2)*(Delta_v0/m0)
-
-    mymoms[0] = m0
-    e_mymoms[0] = e_m0
+    Delta_v0 = np.abs(scipy.integrate.simps(sigma_i,x=velo[...,0,:] if velo.ndim>1 else velo,axis=-1))
+    Delta_vn = np.abs(scipy.integrate.simps(sigma_i[...,None,:]*powers,axis=-1))
+    mymoms = integrals/m0[...,None]
+    mymoms[...,0] = m0
+    e_mymoms = np.sqrt( (Delta_vn/m0[...,None])**2 + (Delta_v0/m0)[...,None]**2*mymoms**2 )
+    e_mymoms[...,0] = np.sqrt(2)*(Delta_v0/m0)
 
-    #-- calculate other moments
-    for n in range(1,max_mom+1):
-        mymoms[n] = scipy.integrate.simps((1-flux)*velo**n,x=velo)/ m0
-        #-- and the uncertainty on it
-        Delta_vn = np.sqrt(scipy.integrate.simps(sigma_i*velo**n)**2)
-        e_mymoms[n] = np.sqrt(  (Delta_vn/m0)**2 + (Delta_v0/m0 * mymoms[n])**2 )
+    return mymoms.T,e_mymoms.T
 
-    return mymoms,e_mymoms
 
-
-def moments_fromfiles(filelist,read_func,max_mom=3,**kwargs):
+def moments_fromfiles(filelist,read_func,max_mom=3,threads=1,chunksize=1000,
+                      velo=None,plot=False,**kwargs):
     """
     Compute the moments from a list of files containing line profiles.
 
@@ -46,6 +83,11 @@ def moments_fromfiles(filelist,read_func,max_mom=3,**kwargs):
     m2: variance
     m3: skewness
 
+    The files are read in a pool of C{threads} processes (then C{read_func}
+    must be a module level function), and the moments of each chunk of
+    C{chunksize} profiles are computed at once (see
+    L{iter_moments_fromfiles}).
+
     @param filelist: list of filenames
     @type filelist: list of strings
     @param read_func: function which reads in a file and returns velocities (array),
@@ -53,6 +95,14 @@ def moments_fromfiles(filelist,read_func,max_mom=3,**kwargs):
     @type read_func: Python function
     @param max_mom: maximum moment to compute
     @type max_mom: integer
+    @param threads: number of processes to read the files (or 'max', 'half', 'safe')
+    @type threads: int or str
+    @param chunksize: number of profiles integrated at once
+    @type chunksize: integer
+    @param velo: common velocity grid to interpolate all profiles on
+    @type velo: array
+    @param plot: plot the profiles (with an offset) with pylab
+    @type plot: bool
     @return: a list containing the moments and a list containing the errors
     @rtype: [max_mom x array],[max_mom x array]
 
@@ -65,16 +115,110 @@ def moments_fromfiles(filelist,read_func,max_mom=3,**kwargs):
 
     output = [np.zeros(len(filelist)) for i in range(max_mom+1)]
     errors = [np.zeros(len(filelist)) for i in range(max_mom+1)]
-    for i,f in enumerate(filelist):
-        #-- read in the profile
-        velo,flux,SNR = read_func(f,**kwargs)
-        mymoms,e_mymoms = moments(velo,flux,SNR)
-        for n in range(len(mymoms)):
-            output[n][i] = mymoms[n]
-            errors[n][i] = e_mymoms[n]
-        pl.plot(velo,flux+i*0.01)
+    for indices,mymoms,e_mymoms in iter_moments_fromfiles(filelist,read_func,
+                        max_mom=max_mom,threads=threads,chunksize=chunksize,
+                        velo=velo,plot=plot,**kwargs):
+        for n in range(max_mom+1):
+            output[n][indices] = mymoms[n]
+            errors[n][indices] = e_mymoms[n]
     return output,errors
 
+
+def iter_moments_fromfiles(filelist,read_func,max_mom=3,threads=1,chunksize=1000,
+                           velo=None,plot=False,**kwargs):
+    """
+    Compute the moments from a list of files containing line profiles, chunk by chunk.
+
+    The profiles of a chunk are stacked and integrated at once with
+    L{moments}, each on its own velocity grid. If a common velocity grid
+    C{velo} is given, all profiles are interpolated onto it first.
+
+    Only one chunk of profiles is kept in memory, and the results are
+    yielded as soon as a chunk is done:
+
+    >>> for indices,moms,e_moms in iter_moments_fromfiles(filelist,get_profile_from_file,chunksize=100):
+    ...     pass
+
+    See L{moments_fromfiles} for the meaning of the arguments.
+
+    @return: indices of the profiles in C{filelist}, their moments and errors
+    @rtype: iterator over (array, (max_mom+1 x N) array, (max_mom+1 x N) array)
+    """
+    start = 0
+    chunk = []
+    for profile in _read_profiles(filelist,read_func,threads,kwargs):
+        chunk.append(profile)
+        if len(chunk)==chunksize:
+            yield _chunk_moments(chunk,start,max_mom,velo,plot)
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield _chunk_moments(chunk,start,max_mom,velo,plot)
+
+
+def _chunk_moments(chunk,start,max_mom,velo,plot):
+    """
+    Stack a chunk of profiles and compute their moments at once.
+
+    Without a common velocity grid, profiles with the same number of
+    velocities are stacked on their own grids.
+    """
+    velos,fluxes,SNRs = list(zip(*chunk))
+    SNRs = np.array(SNRs)
+    mymoms = np.zeros((max_mom+1,len(chunk)))
+    e_mymoms = np.zeros((max_mom+1,len(chunk)))
+    if velo is not None:
+        fluxes = [np.interp(velo,v,f) for v,f in zip(velos,fluxes)]
+        velos = [velo]*len(chunk)
+        mymoms,e_mymoms = moments(velo,np.array(fluxes),SNRs,max_mom=max_mom)
+    else:
+        lengths = np.array([len(v) for v in velos])
+        for length in np.unique(lengths):
+            group = np.flatnonzero(lengths==length)
+            mymoms[:,group],e_mymoms[:,group] = moments(np.array([velos[i] for i in group]),
+                              np.array([fluxes[i] for i in group]),SNRs[group],max_mom=max_mom)
+    if plot:
+        import pylab as pl
+        for i,(v,f) in enumerate(zip(velos,fluxes)):
+            pl.plot(v,f+(start+i)*0.01)
+    return np.arange(start,start+len(chunk)),mymoms,e_mymoms
+
+
+def _read_profiles(filelist,read_func,threads,kwargs):
+    """
+    Read the line profiles of a list of files, in the order of the files.
+
+    With C{threads>1}, the files are read in a pool of worker processes.
+    """
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='half':
+        threads = cpu_count()//2
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(min(int(threads),len(filelist)),1)
+    jobs = ((read_func,filename,kwargs) for filename in filelist)
+    if threads==1:
+        for job in jobs:
+            yield _read_profile(job)
+        return
+    pool = Pool(threads)
+    try:
+        for profile in pool.imap(_read_profile,jobs,chunksize=16):
+            yield profile
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _read_profile(job):
+    """
+    Read one line profile (for L{_read_profiles}).
+    """
+    read_func,filename,kwargs = job
+    velo,flux,SNR = read_func(filename,**kwargs)
+    return np.asarray(velo,float),np.asarray(flux,float),float(SNR)
+
 def profiles_fromfiles(filelist,read_func,max_mom=3,**kwargs):
     """
     Compute an average profile from a file list of profiles.
@@ -140,4 +284,5 @@ if __name__=="__main__":
         return filedata[0],filedata[1],SNR
 
     doctest.testmod()
+    import pylab as pl
     pl.show()
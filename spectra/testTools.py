@@ -217,3 +217,62 @@ class MergeCosmicClippingTestCase2(SpectrumTestCase):
                         msg=' Exceptional deviation from expected acceptions! ')
         self.assertTrue(len(rejected[0]) > 250 and len(rejected[0]) < 400,
                         msg=' Exceptional deviation from expected rejections! ')
+
+class CrossCorrelateTestCase(SpectrumTestCase):
+    """ Testcase using a synthetic spectrum with 40 absorption lines, shifted over 12.3 km/s """
+
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(1111)
+        wave = np.linspace(4000,4400,20000)
+        lines = np.random.uniform(4010,4390,40)
+        temp_flux = 1 - np.sum(0.4*np.exp(-(wave[:,None]-lines)**2/0.05),axis=1)
+        obj_flux = tools.doppler_shift(wave,12.3,flux=temp_flux)
+
+        cls.wave = wave[200:-200]
+        cls.obj_flux = np.array([obj_flux[200:-200],tools.doppler_shift(cls.wave,-5.,flux=obj_flux[200:-200])])
+        cls.temp_wave = wave
+        cls.temp_flux = temp_flux
+
+    def testShift(self):
+        """ spectra.tools.cross_correlate() shift method """
+        velocity,correlation = tools.cross_correlate(self.wave,self.obj_flux[0],self.temp_wave,
+                                                     self.temp_flux,step=0.5,nsteps=100,method='shift')
+        self.assertEqual(correlation.shape,velocity.shape)
+        self.assertAlmostEqual(correlation[0],1.)
+        self.assertAlmostEqual(tools.ccf_peak(velocity,correlation),12.3,delta=0.05)
+
+    def testFFT(self):
+        """ spectra.tools.cross_correlate() FFT method """
+        velocity,ccf_shift = tools.cross_correlate(self.wave,self.obj_flux,self.temp_wave,
+                                                   self.temp_flux,step=0.5,nsteps=100,method='shift')
+        velocity,ccf_fft = tools.cross_correlate(self.wave,self.obj_flux,self.temp_wave,
+                                                 self.temp_flux,step=0.5,nsteps=100,method='fft')
+        self.assertEqual(ccf_fft.shape,(2,len(velocity)))
+        self.assertArrayAlmostEqual(ccf_shift.ravel(),ccf_fft.ravel(),delta=1e-3)
+        self.assertArrayAlmostEqual(tools.ccf_peak(velocity,ccf_fft),[12.3,7.3],delta=0.05)
+
+    def testMethod(self):
+        """ spectra.tools.cross_correlate() method """
+        velocity,ccf_shift = tools.cross_correlate(self.wave,self.obj_flux[0],self.temp_wave,
+                                                   self.temp_flux,step=0.5,nsteps=100,
+                                                   method='shift',chunk_size=100000)
+        velocity,ccf_default = tools.cross_correlate(self.wave,self.obj_flux[0],self.temp_wave,
+                                                     self.temp_flux,step=0.5,nsteps=100,
+                                                     chunk_size=100000)
+        velocity,ccf_auto = tools.cross_correlate(self.wave,self.obj_flux[0],self.temp_wave,
+                                                  self.temp_flux,step=0.5,nsteps=100,
+                                                  method='auto',chunk_size=100000)
+        velocity,ccf_fft = tools.cross_correlate(self.wave,self.obj_flux[0],self.temp_wave,
+                                                 self.temp_flux,step=0.5,nsteps=100,method='fft')
+        self.assertArrayEqual(ccf_default,ccf_shift)
+        self.assertArrayEqual(ccf_auto,ccf_fft)
+        self.assertRaises(ValueError,tools.cross_correlate,self.wave,self.obj_flux[0],
+                          self.temp_wave,self.temp_flux,method='direct')
+
+    def testTwoStep(self):
+        """ spectra.tools.cross_correlate() two step """
+        velocity,correlation = tools.cross_correlate(self.wave,self.obj_flux,self.temp_wave,
+                                                     self.temp_flux,step=0.5,nsteps=50,two_step=True)
+        self.assertEqual(velocity.shape,(2,100))
+        self.assertArrayAlmostEqual(tools.ccf_peak(velocity,correlation),[12.3,7.3],delta=0.05)
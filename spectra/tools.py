@@ -82,8 +82,8 @@ from ivs.spectra import pyrotin4
 import numpy as np
 import logging
 from numpy import pi,sqrt
-import scipy.stats
 from scipy.signal import fftconvolve, medfilt
+from scipy.ndimage import median_filter
 from ivs.timeseries import pergrams
 from ivs.units import conversions
 from ivs.units import constants
@@ -438,20 +438,28 @@ def combine(list_of_spectra,R=200.,lambda0=(950.,'AA'),lambdan=(3350.,'AA')):
     binned_fluxes = np.zeros((Ns,Nw))
     binned_errors = np.inf*np.ones((Ns,Nw))
 
+    #   The borders of the first bin and of the first and last pixel of each
+    #   spectrum wrap around, so they have no overlap with anything. The other
+    #   pixels and bins partition the wavelength axis: every segment between
+    #   the merged pixel and bin borders is the overlap of exactly one pixel
+    #   with one bin.
+    bin_edges = lamc_j[1:]
     for snr,(wave,flux,err) in enumerate(list_of_spectra):
-        wave0 = np.roll(wave,1)
-        wave1 = np.roll(wave,-1)
-        lam_i0_dc = 0.5*(wave0+wave)
-        lam_i1_dc = 0.5*(wave1+wave)
-        dlam_i = lam_i1_dc-lam_i0_dc
-
-        for j in range(Nw):
-            A = np.min(np.vstack([lamc_j[j+1]*np.ones(len(wave)),lam_i1_dc]),axis=0)
-            B = np.max(np.vstack([lamc_j[j]*np.ones(len(wave)),lam_i0_dc]),axis=0)
-            overlaps = scipy.stats.threshold(A-B,threshmin=0)
-            norm = np.sum(overlaps)
-            binned_fluxes[snr,j] = np.sum(flux*overlaps)/norm
-            binned_errors[snr,j] = np.sqrt(np.sum((err*overlaps)**2))/norm
+        wave,flux,err = np.asarray(wave,float),np.asarray(flux,float),np.asarray(err,float)
+        pixel_edges = 0.5*(wave[1:]+wave[:-1])
+        edges = np.union1d(pixel_edges,bin_edges)
+        centers = 0.5*(edges[1:]+edges[:-1])
+        overlaps = np.diff(edges)
+        pixel = np.digitize(centers,pixel_edges)
+        bins = np.digitize(centers,bin_edges)
+        keep = (pixel>=1) & (pixel<=len(wave)-2) & (bins>=1) & (bins<=Nw-1)
+        pixel,bins,overlaps = pixel[keep],bins[keep],overlaps[keep]
+        norm = np.bincount(bins,weights=overlaps,minlength=Nw)
+        sum_flux = np.bincount(bins,weights=flux[pixel]*overlaps,minlength=Nw)
+        sum_err = np.bincount(bins,weights=(err[pixel]*overlaps)**2,minlength=Nw)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            binned_fluxes[snr] = sum_flux/norm
+            binned_errors[snr] = np.sqrt(sum_err)/norm
 
     #-- STEP 3: all available spectra sets are co-added, using the inverse
     #   square of the bin uncertainty as weight
@@ -468,7 +476,7 @@ def combine(list_of_spectra,R=200.,lambda0=(950.,'AA'),lambdan=(3350.,'AA')):
 
 def merge_cosmic_clipping(waves, fluxes, vrads=None, vrad_units='km/s', sigma=3.0,
                           base='average', offset='std', window=51, runs=2,
-                          full_output=False, **kwargs):
+                          full_output=False, block_size=100000, **kwargs):
     """
     Method to combine a set of spectra while removing cosmic rays by comparing the
     spectra with each other and removing the outliers.
@@ -499,6 +507,12 @@ def merge_cosmic_clipping(waves, fluxes, vrads=None, vrad_units='km/s', sigma=3.
     Returns the wavelengths and fluxes of the merged spectra, and if full_output
     is True, also a list of accepted and rejected points, produced by np.where()
 
+    The spectra are processed in blocks of C{block_size} wavelength points, so
+    that only the rebinned fluxes of one block of all spectra are in memory at
+    the same time. When C{offset='std'}, every run needs the standard deviation
+    of the whole normalised spectra, so the blocks are then passed through
+    C{runs+1} times.
+
     @param waves: list of wavelengths
     @param fluxes: list of fluxes
     @param vrads: list of radial velocities (optional)
@@ -507,6 +521,7 @@ def merge_cosmic_clipping(waves, fluxes, vrads=None, vrad_units='km/s', sigma=3.
     @param window: window size used in median filter
     @param runs: number of iterations through the spectra
     @param full_output: True is need to return accepted and rejected
+    @param block_size: number of wavelength points processed at once
 
     @return: wavelenght and flux of merged spectrum (, accepted and rejected points)
     @rtype: array, array (, tuple, tuple)
@@ -516,48 +531,120 @@ def merge_cosmic_clipping(waves, fluxes, vrads=None, vrad_units='km/s', sigma=3.
     base = getattr(np.ma, base)
 
     # If vrads are given, shift the spectra to zero velocity
-    if vrads != None:
-        for i, (wave, rv) in enumerate(zip(waves, vrads)):
-            waves[i] = doppler_shift(wave, -rv, vrad_units=vrad_units)
+    if vrads is not None:
+        waves = [doppler_shift(wave, -rv, vrad_units=vrad_units) for wave, rv in zip(waves, vrads)]
 
     # setup output arrays
-    wave = waves[0]
-    flux = np.zeros_like(waves[0])
+    wave = np.asarray(waves[0])
+    flux = np.zeros(len(wave))
+    if full_output:
+        mask = np.zeros((len(waves),len(wave)),bool)
+
+    # when everything fits in one block, it only needs to be computed once
+    starts = range(0, len(wave), block_size)
+    if len(starts) == 1:
+        cached = [_merge_block(waves, fluxes, wave, window)]
+    def blocks():
+        if len(starts) == 1:
+            yield 0, cached[0]
+        else:
+            for start in starts:
+                yield start, _merge_block(waves, fluxes, wave[start:start+block_size], window)
+
+    # the offset of each run is the median of the standard deviations of all
+    # normalised spectra, after clipping in the previous runs. Accumulate the
+    # number of points, mean and sum of squared deviations per spectrum.
+    offsets = []
+    for i in range(runs):
+        if offset != 'std':
+            offsets.append(0.)
+            continue
+        count, mean, m2 = np.zeros((3, len(waves)))
+        for start, (fo, fc, fn) in blocks():
+            fn = _clip_block(fn, base, sigma, offsets)
+            n_ = fn.count(axis=1)
+            mean_ = fn.mean(axis=1).filled(0.)
+            m2_ = (fn.var(axis=1)*n_).filled(0.)
+            total = np.maximum(count+n_, 1)
+            m2 += m2_ + (mean_-mean)**2*count*n_/total
+            mean += (mean_-mean)*n_/total
+            count += n_
+        spec_std = np.sqrt(m2[count>0]/count[count>0])
+        offsets.append(np.median(spec_std))
 
-    # define a rough continuum for each spectrum by using median smoothing
-    fc = np.array([np.interp(wave, w_, medfilt(f_, window)) for w_, f_ in zip(waves, fluxes)])
-    fc = np.ma.masked_array( fc, mask = fc == 0. )
+    # sum the original flux over all spectra
+    for start, (fo, fc, fn) in blocks():
+        fn = _clip_block(fn, base, sigma, offsets)
+        block_mask = np.ma.getmaskarray(fn)
+        flux[start:start+block_size] = np.sum( np.where(block_mask, fc, fo), axis=0)
+        if full_output:
+            mask[:,start:start+block_size] = block_mask
+    logger.debug('Merged %i spectra with sigma = %f and base = %s'%(len(waves), sigma, base))
 
-    # convert all spectra to same wavelength scale and calc normalized spectra
-    fo = np.array([np.interp(wave, w_, f_) for w_, f_ in zip(waves, fluxes)])
-    fo = np.ma.masked_array( fo, mask=np.isfinite(fo) == False )
+    if full_output:
+        rejected = np.where(mask)
+        accepted = np.where(mask == False)
+        return wave, flux, accepted, rejected
+    else:
+        return wave, flux
+
+def _merge_block(waves, fluxes, wave, window):
+    """
+    Rebin a block of all spectra for L{merge_cosmic_clipping}.
+
+    Only the part of each spectrum that is needed for the block (including
+    the margin of the median filter) is used, which gives the same result as
+    filtering and interpolating the whole spectrum. The (faster) ndimage
+    median filter gives the same result as C{scipy.signal.medfilt} for finite
+    fluxes.
+
+    @return: rebinned flux, rough continuum and normalised flux (masked where
+    not finite)
+    @rtype: array, array, masked array
+    """
+    half = window//2
+    fo, fc = np.zeros((2, len(waves), len(wave)))
+    for i, (w_, f_) in enumerate(zip(waves, fluxes)):
+        w_, f_ = np.asarray(w_), np.asarray(f_, float)
+        lo = max(w_.searchsorted(wave[0])-1, 0)
+        hi = min(w_.searchsorted(wave[-1], side='right')+1, len(w_))
+        # define a rough continuum by using median smoothing
+        lo_, hi_ = max(lo-half, 0), min(hi+half, len(w_))
+        if np.isfinite(f_[lo_:hi_]).all():
+            continuum = median_filter(f_[lo_:hi_], size=window, mode='constant')
+        else:
+            continuum = medfilt(f_[lo_:hi_], window)
+        continuum = continuum[lo-lo_:hi-lo_]
+        fc[i] = np.interp(wave, w_[lo:hi], continuum)
+        # convert all spectra to same wavelength scale
+        fo[i] = np.interp(wave, w_[lo:hi], f_[lo:hi])
 
     # calculate normalized flux from fc and fo
-    fn = np.array([f_/c_ for f_, c_ in zip(fo, fc)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fn = np.where(fc == 0., fo, fo/fc)
     fn = np.ma.masked_array( fn, mask=np.isfinite(fn) == False )
+    return fo, fc, fn
 
-    for i in range(runs):
+def _clip_block(fn, base, sigma, offsets):
+    """
+    Sigma clip a block of normalised spectra for L{merge_cosmic_clipping}.
+
+    @return: normalised flux, masked where clipped
+    @rtype: masked array
+    """
+    fn = fn.copy()
+    for offset in offsets:
         # calculate average and standard deviation for each wavelength bin
-        a = base(fn, axis=0)
-        if offset == 'std': a += np.median(np.ma.std(fn, axis=1))
+        a = base(fn, axis=0) + offset
         s = np.ma.std(fn, axis=0)
 
         # perform sigma clipping
         fn.mask = np.ma.mask_or( fn.mask, np.ma.make_mask(fn > a+sigma*s) )
-
-    # sum the original flux over all spectra
-    flux = np.sum( np.where(fn.mask, fc, fo), axis=0)
-    logger.debug('Merged %i spectra with sigma = %f and base = %s'%(len(waves), sigma, base))
-
-    if full_output:
-        rejected = np.where(fn.mask)
-        accepted = np.where(fn.mask == False)
-        return wave, flux, accepted, rejected
-    else:
-        return wave, flux
+    return fn
 
 def cross_correlate(obj_wave, obj_flux, temp_wave, temp_flux, step=0.3, nsteps=500,
-                    start_dev=0.0, two_step=False, verbose=False, **kwargs):
+                    start_dev=0.0, two_step=False, verbose=False, method='shift',
+                    chunk_size=10000000, **kwargs):
     """
     Cross correlate a spectrum with a template, working in velocity space. The velocity
     range is controlled by using step, nsteps and start_dev as:
@@ -567,30 +654,211 @@ def cross_correlate(obj_wave, obj_flux, temp_wave, temp_flux, step=0.3, nsteps=5
     If two_step is set to True, then it will run twice, and in the second run focus on
     the velocity where the correlation is at its maximum.
 
-    Returns the velocity and the normalized correlation function
+    Several spectra (sharing C{obj_wave}) and several templates (sharing
+    C{temp_wave}) can be correlated at once, by giving 2D flux arrays with one
+    spectrum or template per row. The correlation function then has shape
+    (N_spectra, N_templates, N_velocity), leaving out the dimensions of 1D
+    inputs.
+
+    Two methods are available:
+
+        - C{method='shift'}: the template is linearly interpolated onto the
+        wavelengths of the spectrum for all velocities at once (in chunks of
+        C{chunk_size} elements). This is exact, but scales as N_velocity x
+        N_pixels.
+        - C{method='fft'}: spectrum and template are resampled once onto a
+        common log-lambda grid with a pixel size of one velocity step, on
+        which a doppler shift is a translation. The correlation is then
+        computed for all shifts with FFTs, and interpolated onto the
+        requested velocities. This is accurate to the resampling of the
+        spectra.
+
+    The default is the shift method. With C{method='auto'}, the shift method
+    is used when N_velocity x N_pixels is smaller than C{chunk_size}, and the
+    FFT method otherwise.
+
+    Use L{ccf_peak} to locate the maximum of the correlation function to
+    sub-step precision.
+
+    Example usage:
+
+    >>> wave = np.linspace(4000,4100,2000)
+    >>> temp_flux = 1-0.5*np.exp(-(wave-4050)**2/0.5)
+    >>> obj_flux = doppler_shift(wave,15.,flux=temp_flux)
+    >>> velocity,correlation = cross_correlate(wave[100:-100],obj_flux[100:-100],wave,temp_flux,step=0.5,nsteps=100)
+    >>> print(np.round(ccf_peak(velocity,correlation),1))
+    15.0
+
+    @param obj_wave: wavelengths of the spectrum
+    @type obj_wave: 1D array
+    @param obj_flux: flux of the spectrum (or spectra)
+    @type obj_flux: 1D or 2D array
+    @param temp_wave: wavelengths of the template
+    @type temp_wave: 1D array
+    @param temp_flux: flux of the template (or templates)
+    @type temp_flux: 1D or 2D array
+    @param step: velocity step (km/s)
+    @type step: float
+    @param nsteps: number of steps on both sides of C{start_dev}
+    @type nsteps: int
+    @param start_dev: central velocity (km/s)
+    @type start_dev: float
+    @param two_step: refine the velocity grid around the maximum
+    @type two_step: bool
+    @param method: one of 'shift', 'fft' or 'auto'
+    @type method: str
+    @param chunk_size: maximum number of elements of intermediate arrays
+    @type chunk_size: int
+    @return: velocity, normalized correlation function
+    @rtype: array, array
     """
-
-    def correlate(dvel):
-        rebin_flux = interp1d(temp_wave * ( 1 + 1000. * dvel / constants.cc ), temp_flux)(obj_wave)
-        s2 = np.sqrt(np.sum(rebin_flux**2)/len(rebin_flux)) #RMS uncertainty
-        return 1. / ( len(obj_flux) * s1 * s2 ) * np.sum( obj_flux * rebin_flux )
+    obj_wave = np.asarray(obj_wave,float)
+    temp_wave = np.asarray(temp_wave,float)
+    obj_flux = np.asarray(obj_flux,float)
+    temp_flux = np.asarray(temp_flux,float)
+    shape = obj_flux.shape[:-1]+temp_flux.shape[:-1]
+    obj_flux = obj_flux.reshape((-1,obj_flux.shape[-1]))
+    temp_flux = temp_flux.reshape((-1,temp_flux.shape[-1]))
+    order = np.argsort(temp_wave)
+    temp_wave,temp_flux = temp_wave[order],temp_flux[:,order]
 
     #-- First correlation
-    s1 = np.sqrt(sum(obj_flux**2)/len(obj_flux)) #RMS uncertainty
     velocity = np.arange(start_dev - nsteps * step , start_dev + nsteps * step , step)
-    correlation = np.array([correlate(dvel) for dvel in velocity])
-
-    #-- Possible second correlation
+    correlators = {'shift':_correlate_shift,'fft':_correlate_fft}
+    if method=='auto':
+        method = (len(velocity)*len(obj_wave)<chunk_size) and 'shift' or 'fft'
+    if not method in correlators:
+        raise ValueError("don't understand method {}, use one of 'shift', 'fft' or 'auto'".format(method))
+    correlate = correlators[method]
+    correlation = correlate(obj_wave,obj_flux,temp_wave,temp_flux,velocity,
+                            step=step,chunk_size=chunk_size)
+
+    #-- Possible second correlation, each spectrum-template pair on its own
+    #   velocity grid
     if two_step:
-        start_dev = velocity[correlation == np.max(correlation)]
-        velocity = np.arange(start_dev - nsteps * step , start_dev + nsteps * step , step)
-        correlation = np.array([correlate(dvel) for dvel in velocity])
+        velocities,correlations = [],[]
+        for i in range(len(obj_flux)):
+            for j in range(len(temp_flux)):
+                start_dev = velocity[np.argmax(correlation[i,j])]
+                velocities.append(np.arange(start_dev - nsteps * step , start_dev + nsteps * step , step))
+                correlations.append(correlate(obj_wave,obj_flux[i:i+1],temp_wave,temp_flux[j:j+1],
+                                              velocities[-1],step=step,chunk_size=chunk_size)[0,0])
+        velocity = np.array(velocities).reshape(shape+(-1,))
+        correlation = np.array(correlations)
+        if not shape:
+            velocity = velocity[0]
 
     #-- 'normalize' the correlation function
-    correlation = correlation / correlation[0]
+    correlation = correlation.reshape(shape+(-1,))
+    correlation = correlation / correlation[...,:1]
 
     return velocity, correlation
 
+def ccf_peak(velocity, correlation):
+    """
+    Locate the maximum of a cross correlation function to sub-step precision.
+
+    A parabola is fitted through the maximum of the correlation function and
+    its two neighbours. If the maximum lies on the edge of the velocity grid,
+    the velocity of the maximum itself is returned.
+
+    Batches of correlation functions (see L{cross_correlate}) are handled at
+    once: the peak is located along the last axis.
+
+    @param velocity: velocity grid (km/s)
+    @type velocity: array
+    @param correlation: cross correlation function
+    @type correlation: array
+    @return: velocity of the maximum (km/s)
+    @rtype: float or array
+    """
+    correlation = np.asarray(correlation,float)
+    shape = correlation.shape[:-1]
+    n = correlation.shape[-1]
+    velocity = (np.asarray(velocity,float)*np.ones_like(correlation)).reshape((-1,n))
+    correlation = correlation.reshape((-1,n))
+    rows = np.arange(len(correlation))
+    imax = np.argmax(correlation,axis=-1)
+    i = imax.clip(1,n-2)
+    x0,x1,x2 = [velocity[rows,i+k] for k in (-1,0,1)]
+    y0,y1,y2 = [correlation[rows,i+k] for k in (-1,0,1)]
+    #-- vertex of the parabola through the three points
+    num = (x1-x0)**2*(y1-y2) - (x1-x2)**2*(y1-y0)
+    den = (x1-x0)*(y1-y2) - (x1-x2)*(y1-y0)
+    edge = (imax!=i) | (den==0)
+    peak = np.where(edge,velocity[rows,imax],x1 - 0.5*num/np.where(den==0,1.,den))
+    if not shape:
+        return float(peak[0])
+    return peak.reshape(shape)
+
+def _correlate_shift(obj_wave,obj_flux,temp_wave,temp_flux,velocity,chunk_size=10000000,**kwargs):
+    """
+    Cross correlate spectra and templates by shifting the templates.
+
+    @return: correlation function of shape (N_spectra, N_templates, N_velocity)
+    @rtype: 3D array
+    """
+    nobj = obj_flux.shape[-1]
+    s1 = np.sqrt(np.sum(obj_flux**2,axis=-1)/nobj) #RMS uncertainty
+    numerator = np.zeros((len(obj_flux),len(temp_flux),len(velocity)))
+    s2 = np.zeros((len(temp_flux),len(velocity)))
+    scale = 1 + 1000. * velocity / constants.cc
+    chunk = max(1,chunk_size//nobj)
+    for start in range(0,len(velocity),chunk):
+        #-- wavelengths of the template that end up on the spectrum's pixels
+        x = obj_wave/scale[start:start+chunk,None]
+        if x.min()<temp_wave[0] or x.max()>temp_wave[-1]:
+            raise ValueError('Shifted template does not cover the wavelength range of the spectrum')
+        for j,flux in enumerate(temp_flux):
+            rebin_flux = np.interp(x.ravel(),temp_wave,flux).reshape(x.shape)
+            s2[j,start:start+chunk] = np.sqrt(np.sum(rebin_flux**2,axis=-1)/nobj) #RMS uncertainty
+            numerator[:,j,start:start+chunk] = np.dot(obj_flux,rebin_flux.T)
+    return numerator / ( nobj * s1[:,None,None] * s2[None] )
+
+def _correlate_fft(obj_wave,obj_flux,temp_wave,temp_flux,velocity,step=0.3,**kwargs):
+    """
+    Cross correlate spectra and templates via FFTs on a log-lambda grid.
+
+    The sums over the pixels of the spectrum are approximated by integrals
+    over the log-lambda grid, weighted with the local pixel density of the
+    spectrum.
+
+    @return: correlation function of shape (N_spectra, N_templates, N_velocity)
+    @rtype: 3D array
+    """
+    nobj = obj_flux.shape[-1]
+    s1 = np.sqrt(np.sum(obj_flux**2,axis=-1)/nobj) #RMS uncertainty
+    #-- log-lambda grid with one velocity step per pixel: a shift over a
+    #   velocity v is a translation over lag ln(1+v/c)/dln pixels
+    dln = np.log(1 + 1000. * abs(step) / constants.cc)
+    log_obj_wave = np.log(obj_wave)
+    grid = np.arange(log_obj_wave[0],log_obj_wave[-1],dln)
+    lag = np.log(1 + 1000. * velocity / constants.cc)/dln
+    lag_min,lag_max = int(np.floor(lag.min())),int(np.ceil(lag.max()))
+    #-- spectra on the grid, weighted with the pixel density
+    density = np.interp(grid,log_obj_wave,np.gradient(np.arange(nobj,dtype=float),log_obj_wave))
+    density *= nobj/density.sum()
+    obj_log = np.array([np.interp(grid,log_obj_wave,flux) for flux in obj_flux])*density
+    #-- templates on the grid, for all lags: element k+m corresponds to pixel
+    #   k of the spectrum at lag lag_max-m
+    temp_grid = grid[0] + np.arange(-lag_max,len(grid)-lag_min)*dln
+    if temp_grid[0]<np.log(temp_wave[0]) or temp_grid[-1]>np.log(temp_wave[-1]):
+        raise ValueError('Shifted template does not cover the wavelength range of the spectrum')
+    temp_log = np.array([np.interp(temp_grid,np.log(temp_wave),flux) for flux in temp_flux])
+    #-- correlations for all lags, c[m] = sum_k a[k] b[k+m]
+    nfft = 2**int(np.ceil(np.log2(len(temp_grid))))
+    nlags = lag_max-lag_min+1
+    temp_fft = np.fft.rfft(temp_log,nfft)
+    temp2_fft = np.fft.rfft(temp_log**2,nfft)
+    def correlate(a,b_fft):
+        return np.fft.irfft(np.conj(np.fft.rfft(a,nfft))*b_fft,nfft)[...,:nlags][...,::-1]
+    s2 = np.sqrt(np.abs(correlate(density,temp2_fft))/nobj) #RMS uncertainty
+    correlation = np.array([correlate(flux,temp_fft) for flux in obj_log])
+    correlation /= ( nobj * s1[:,None,None] * s2[None] )
+    #-- interpolate onto the requested velocities
+    lags = np.arange(lag_min,lag_max+1)
+    return np.array([[np.interp(lag,lags,corr) for corr in row] for row in correlation])
+
 def get_response(instrument='hermes'):
     """
     Returns the response curve of the given instrument. Up till now only a HERMES
@@ -127,6 +127,20 @@ Model: y = a_0 * x^3 + a_1 * x^1 + a_2 * sin(2*pi*1*f1*x) + a_3 * cos(2*pi*1*f1*
 Expected number of observations: 10
 
 
+Selecting submodels
+===================
+
+To find out which regressors are really needed, all submodels of a model can be
+ranked by an information criterion. The fits of the submodels are derived from
+a single QR decomposition of the full model, so that none of the submodels
+needs to be decomposed again:
+
+>>> myModel = PolynomialModel(x, "x", [0,1,2,3])
+>>> best = myModel.rankSubmodels(obs, criterion="BIC", top=3, nested=False)
+>>> best[0]["names"]
+['x^1', 'x^2', 'x^3']
+
+
 Notes
 =====
 The package is aimed to be robust and efficient.
@@ -146,10 +160,13 @@ The package is aimed to be robust and efficient.
 
 import sys
 import copy
+import heapq
 from math import sqrt,log,pi
 from itertools import combinations
+from multiprocessing import Pool,cpu_count
 import numpy as np
 import scipy.stats as stats
+from scipy.linalg import solve_triangular
 
 
 
@@ -1113,6 +1130,167 @@ class LinearModel(object):
 
 
 
+    def rankSubmodels(self, observations, criterion = "BIC", top = 10, Nmin = 1, Nmax = None,
+                      nested = True, ranks = None, threads = 1):
+
+        """
+        Fits all submodels to the observations, and returns the best ones
+
+        The submodels are the same as those generated by L{submodels}, but
+        instead of setting up and decomposing a new LinearModel for each of
+        them, all submodels are fitted using one QR decomposition of the design
+        matrix of the full model, augmented with the observations. Walking
+        through the submodels, the QR decomposition of each submodel is derived
+        from the one of its parent by inserting the columns of the extra
+        regressors. The cost of each fit is therefore independent of the
+        number of observations.
+
+        The regression coefficients, sum of squared residuals, AIC, BIC and
+        F-statistic of the submodels are defined as in L{LinearFit}.
+
+        Example:
+
+        >>> np.random.seed(1111)
+        >>> x = linspace(0,10,100)
+        >>> lm = PolynomialModel(x, "x", [0,1,2,3,4])
+        >>> obs = 1.0 + 0.5 * x**2 + normal(0.0, 1.0, 100)
+        >>> best = lm.rankSubmodels(obs, criterion="BIC", top=5, nested=False)
+        >>> best[0]["names"]
+        ['1', 'x^2']
+        >>> fit = best[0]["model"].fitData(obs)
+
+        @param observations: array with the observations y_i
+        @type observations: ndarray
+        @param criterion: criterion to rank the submodels: "BIC", "AIC" or
+                          "sumSqResiduals" (lowest first), or "Fstatistic"
+                          (highest first)
+        @type criterion: string
+        @param top: number of submodels to return
+        @type top: integer
+        @param Nmin: see L{submodels}
+        @type Nmin: integer
+        @param Nmax: see L{submodels}
+        @type Nmax: integer
+        @param nested: see L{submodels}
+        @type nested: boolean
+        @param ranks: see L{submodels}
+        @type ranks: list with integers
+        @param threads: number of worker processes to rank the submodels in
+                        (or 'max', 'half', 'safe')
+        @type threads: integer or string
+        @return: the best submodels, best first. Each submodel is a dictionary
+                 with the keys "indices" and "names" of its regressors,
+                 "coefficients", "sumSqResiduals", "AIC", "BIC", "Fstatistic",
+                 and "model", the submodel as a LinearModel instance.
+        @rtype: list
+
+        """
+
+        if len(observations) != self._nObservations:
+            raise ValueError("Number of observations should be %d != %d" % (self._nObservations, len(observations)))
+
+        if criterion not in ["BIC", "AIC", "sumSqResiduals", "Fstatistic"]:
+            raise ValueError("Unknown criterion %s" % criterion)
+
+        # Group the regressors with the same rank, from low (most important) to
+        # high (least important) rank
+
+        if ranks is None:
+            ranks = np.arange(self._nParameters)
+        ranks = np.asarray(ranks)
+        uniqueRanks = np.unique(ranks)
+        groups = [np.where(ranks == m)[0] for m in uniqueRanks]
+        if Nmax is None:
+            Nmax = len(uniqueRanks)
+
+        # Decompose the (weighted) design matrix augmented with the (weighted)
+        # observations once. If [A y] = Q R, the least squares fit of y with the
+        # columns 'indices' of A is the one of the last column of R with the
+        # columns 'indices' of R.
+
+        observations = np.double(observations)
+        if self._covMatrixObserv is not None:
+            weightedObservations = np.linalg.solve(self._choleskyLower, observations)
+        else:
+            weightedObservations = observations
+        R = np.linalg.qr(np.column_stack([self._designMatrix, weightedObservations]), mode='r')
+
+        # The AIC, BIC and F-statistic use the unweighted residuals. With a covariance
+        # matrix, their sum of squares follows from the Gram matrix of the unweighted
+        # design matrix augmented with the observations.
+
+        if self._covMatrixObserv is not None:
+            unweighted = np.column_stack([np.dot(self._choleskyLower, self._designMatrix), observations])
+            gramMatrix = np.dot(unweighted.T, unweighted)
+        else:
+            gramMatrix = None
+
+        # The sample variance for the coefficient of determination depends on
+        # whether the submodel has an intercept
+
+        constant = np.array([len(np.unique(self._designMatrix[:,n])) == 1 for n in range(self._nParameters)])
+        sampleVariance = (np.sum(np.square(observations)), np.sum(np.square(observations - np.mean(observations))))
+
+        problem = dict(R=R, gramMatrix=gramMatrix, groups=groups, Nmin=Nmin, Nmax=Nmax, nested=nested,
+                       criterion=criterion, top=top, constant=constant, sampleVariance=sampleVariance,
+                       nObservations=self._nObservations, svdTOL=self._svdTOL)
+
+        # Non-nested submodels are ranked per subtree of submodels that start with
+        # the same regressor group. These subtrees can be ranked in parallel.
+
+        if nested:
+            firstGroups = [0]
+        else:
+            firstGroups = list(range(len(groups)))
+
+        if threads == 'max':
+            threads = cpu_count()
+        elif threads == 'half':
+            threads = cpu_count()//2
+        elif threads == 'safe':
+            threads = cpu_count()-1
+        threads = max(min(int(threads), len(firstGroups)), 1)
+
+        if threads == 1:
+            _submodelProblem.update(problem)
+            try:
+                bestSubmodels = [best for first in firstGroups for best in _rankSubmodelTree(first)]
+            finally:
+                _submodelProblem.clear()
+        else:
+            pool = Pool(threads, initializer=_initSubmodelWorker, initargs=(problem,))
+            try:
+                bestSubmodels = [best for bests in pool.imap_unordered(_rankSubmodelTree, firstGroups) for best in bests]
+            finally:
+                pool.close()
+                pool.join()
+
+        # Merge the best submodels of all subtrees
+
+        bestSubmodels = sorted(bestSubmodels, key=lambda best: best[0])[:top]
+        output = []
+        for key,indices,fit in bestSubmodels:
+            names = [self._regressorNames[k] for k in indices]
+            if self._covMatrixObserv is not None:
+                model = LinearModel(self._designMatrix[:,indices], names, self._covMatrixObserv, regressorsAreWeighted=True)
+            else:
+                model = LinearModel(self._designMatrix[:,indices], names)
+            fit.update(indices=indices, names=names, model=model)
+            output.append(fit)
+
+        return output
+
+
+
+
+
+
+
+
+
+
+
+
     def copy(self):
 
         """
@@ -2080,4 +2258,186 @@ class LinearFit(object):
 
 
 
+#-- the problem that is being solved by rankSubmodels, shared with the worker processes
+_submodelProblem = {}
+
+def _initSubmodelWorker(problem):
+
+    """
+    Sets up a worker process for LinearModel.rankSubmodels()
+    """
+
+    _submodelProblem.update(problem)
+
+
+
+
+def _rankSubmodelTree(first):
+
+    """
+    Fits all submodels of LinearModel.rankSubmodels() that start with a given
+    regressor group, and returns the best ones.
+
+    The submodels are visited depth first. The QR decomposition of a submodel
+    is derived from the one of its parent by inserting the columns of the new
+    regressor group with (reorthogonalised) Gram-Schmidt. If a submodel turns
+    out to be rank deficient, it and all its descendants are fitted with a
+    least squares solution using the small matrix R instead.
+
+    @param first: index of the first regressor group
+    @type first: integer
+    @return: sorting key, indices of the regressors and fit of the best submodels
+    @rtype: list of tuples
+
+    """
+
+    problem = _submodelProblem
+    R, groups, criterion = problem['R'], problem['groups'], problem['criterion']
+    Nmin, Nmax, top = problem['Nmin'], problem['Nmax'], problem['top']
+    y = R[:,-1]
+    best = []
+
+    # Each entry on the stack is a submodel: the chosen groups, the indices of
+    # the regressors, the QR decomposition (Q, Rsub) of R[:,indices], the
+    # projection z = Q^T y of the observations and the residuals y - Q z. Q is
+    # None if the submodel is rank deficient.
+
+    stack = [([], [], np.zeros((R.shape[0], 0)), np.zeros((0, 0)), np.zeros(0), y)]
+    while stack:
+        chosen, indices, Q, Rsub, z, residuals = stack.pop()
+        if len(chosen) >= Nmin:
+            if Q is None:
+                coefficients = np.linalg.lstsq(R[:,indices], y, rcond=problem['svdTOL'])[0]
+                residuals = y - np.dot(R[:,indices], coefficients)
+            elif problem['gramMatrix'] is not None:
+                coefficients = solve_triangular(Rsub, z)
+            else:
+                coefficients = None
+            fit = _submodelStatistics(indices, coefficients, residuals)
+            key = (criterion == 'Fstatistic' and -fit[criterion] or fit[criterion], len(chosen), tuple(chosen))
+            if key[0] != key[0]:
+                key = (np.inf,) + key[1:]
+            # keep the 'top' best in a heap with the worst on top
+            item = ((-key[0], -key[1], tuple(-n for n in key[2])), (key, indices, fit, coefficients, Rsub, z))
+            if len(best) < top:
+                heapq.heappush(best, item)
+            elif item[0] > best[0][0]:
+                heapq.heapreplace(best, item)
+        if len(chosen) == Nmax:
+            continue
+        if not chosen:
+            nextGroups = [first]
+        elif problem['nested']:
+            nextGroups = chosen[-1]+1 < len(groups) and [chosen[-1]+1] or []
+        else:
+            nextGroups = list(range(chosen[-1]+1, len(groups)))
+        # push in reverse order, so that the submodels are visited in order
+        for n in nextGroups[::-1]:
+            newQ, newRsub, newz, newResiduals = Q, Rsub, z, residuals
+            for k in groups[n]:
+                if newQ is None:
+                    break
+                newQ, newRsub, newz, newResiduals = _insertColumn(newQ, newRsub, newz, newResiduals, R[:,k], problem['svdTOL'])
+            stack.append((chosen + [n], indices + list(groups[n]), newQ, newRsub, newz, newResiduals))
+
+    # only the coefficients of the best submodels are needed
+    output = []
+    for item in best:
+        key, indices, fit, coefficients, Rsub, z = item[1]
+        if coefficients is None:
+            coefficients = solve_triangular(Rsub, z)
+        fit['coefficients'] = coefficients
+        output.append((key, indices, fit))
+    return output
+
+
+
+
+def _insertColumn(Q, Rsub, z, residuals, column, tolerance):
+
+    """
+    Inserts a column at the end of a QR decomposition.
+
+    @return: the new Q, R, projection z = Q^T y and residuals y - Q z, or None's
+             if the new column is (numerically) a linear combination of the
+             previous ones.
+    @rtype: tuple
+
+    """
+
+    h = np.dot(Q.T, column)
+    w = column - np.dot(Q, h)
+    h2 = np.dot(Q.T, w)
+    w -= np.dot(Q, h2)
+    h += h2
+    norm = sqrt(np.dot(w, w))
+    k = Rsub.shape[0]
+    scale = sqrt(np.dot(column, column))
+    if k:
+        scale = max(scale, np.abs(Rsub.diagonal()).max())
+    if norm <= tolerance * scale:
+        return None, None, None, None
+    q = w / norm
+    newRsub = np.zeros((k+1, k+1))
+    newRsub[:k,:k] = Rsub
+    newRsub[:k,k] = h
+    newRsub[k,k] = norm
+    projection = np.dot(q, residuals)
+    return np.column_stack([Q, q]), newRsub, np.append(z, projection), residuals - projection * q
+
+
+
+
+def _submodelStatistics(indices, coefficients, residuals):
+
+    """
+    Computes the statistics of a submodel.
+
+    See L{LinearFit} for the definitions of the statistics.
+
+    @return: sumSqResiduals, AIC, BIC and Fstatistic
+    @rtype: dictionary
+
+    """
+
+    problem = _submodelProblem
+    nObservations = problem['nObservations']
+    nParameters = len(indices)
+
+    if problem['gramMatrix'] is None:
+        sumSqResiduals = float(np.dot(residuals, residuals))
+    else:
+        v = np.append(-coefficients, 1.0)
+        columns = list(indices) + [-1]
+        sumSqResiduals = float(np.dot(v, np.dot(problem['gramMatrix'][columns][:,columns], v)))
+
+    # As in LinearModel.degreesOfFreedom(), the trace of the hat matrix counts all
+    # singular vectors, also for rank deficient submodels
+
+    degreesOfFreedom = nObservations - min(nParameters, nObservations)
+
+    # Include the sigma of the noise in the number of unknown fit parameters
+
+    nParam = nParameters + 1
+    if sumSqResiduals > 0:
+        logLikelihood = nObservations * log(sumSqResiduals / nObservations)
+    else:
+        logLikelihood = -np.inf
+    BIC = logLikelihood + nParam * log(nObservations)
+    if (nObservations - nParam - 1) == 0:
+        AIC = np.nan
+    else:
+        AIC = logLikelihood + 2*nParam + 2.0*nParam*(nParam+1)/(nObservations - nParam - 1)
+    Rsq = 1.0 - sumSqResiduals / problem['sampleVariance'][int(problem['constant'][indices].any())]
+    if Rsq < 1.0:
+        Fstatistic = Rsq / (1-Rsq) * degreesOfFreedom / max(nParameters-1, 1)
+    else:
+        Fstatistic = np.inf
+
+    return dict(sumSqResiduals=sumSqResiduals, AIC=AIC, BIC=BIC, Fstatistic=Fstatistic)
+
+
+
+
+
 __all__ = [LinearModel, PolynomialModel, HarmonicModel, LinearFit]
@@ -2,9 +2,29 @@
 # -*- coding: utf-8 -*-
 """
 Principal component analysis
+
+The NIPALS and full SVD methods need the complete (mean centered) matrix in
+memory and cost O(N*M^2) for an N x M matrix. Two further backends return the
+same (Scores, Loadings, explained_var) triplet when only the first few
+principal components are needed:
+
+    - C{PCA_randomized}: truncated SVD from a random projection of the
+      matrix (Halko, Martinsson & Tropp 2011). The matrix is centered and
+      scaled implicitly, so no centered copy is made.
+    - C{PCA_incremental}: reads the matrix in chunks of rows (e.g. from a
+      C{numpy.memmap} or a FITS table) and updates a truncated SVD chunk by
+      chunk, so the memory needed does not depend on the number of rows.
+
+The signs of the components are arbitrary and may differ between methods.
+
+>>> X = np.random.normal(size=(1000,50))
+>>> T,P,ev = PCA_svd(X)
+>>> T,P,ev = PCA_randomized(X,PCs=5)
+>>> T,P,ev = PCA_incremental(X,PCs=5,chunksize=200)
 """
+import numpy as np
 from numpy import array, average, corrcoef, mat, shape, std, sum, transpose, zeros
-from numpy.linalg import svd
+from numpy.linalg import svd, qr
 
 
 __author__ = "Henning Risvik"
@@ -22,13 +42,8 @@ def mean_center(X):
     @return: Mean centered X (always has same dimensions as X)
 
     """
-    (rows, cols) = shape(X)
-    new_X = zeros((rows, cols), float)
-    _averages = average(X, 0)
-
-    for row in range(rows):
-        new_X[row, 0:cols] = X[row, 0:cols] - _averages[0:cols]
-    return new_X
+    X = np.asarray(X, float)
+    return X - average(X, 0)
 
 
 def standardization(X):
@@ -41,16 +56,49 @@ def standardization(X):
     @return: Standardized X (always has same dimensions as X)
 
     """
-    (rows, cols) = shape(X)
-    new_X = zeros((rows, cols))
+    X = np.asarray(X, float)
     _STDs = std(X, 0)
 
-    for value in _STDs:
-        if value == 0: raise ZeroDivisionError('division by zero, cannot proceed')
+    if np.any(_STDs == 0): raise ZeroDivisionError('division by zero, cannot proceed')
+
+    return X / _STDs
+
+
+def column_statistics(X, chunksize=10000):
+    """
+    Mean and standard deviation of each column, reading X in chunks of rows.
+
+    The chunk results are combined with the pairwise update of Chan et al.
+    (1979), which avoids the loss of precision of summing squares.
+
+    @param X: 2-dimensional matrix of number data (anything that can be sliced in rows, e.g. a numpy memmap).
+    @type X: numpy array
+
+    @param chunksize: Number of rows read at once.
+    @type chunksize: int
 
-    for row in range(rows):
-        new_X[row, 0:cols] = X[row, 0:cols] / _STDs[0:cols]
-    return new_X
+    @return: (means, STDs), both with one value per column
+    """
+    rows = shape(X)[0]
+    n, means, M2 = 0, 0., 0.
+    for chunk in _row_chunks(X, chunksize):
+        n_chunk = len(chunk)
+        means_chunk = chunk.mean(0)
+        M2_chunk = ((chunk - means_chunk)**2).sum(0)
+        delta = means_chunk - means
+        M2 = M2 + M2_chunk + delta**2 * n*n_chunk/(n+n_chunk)
+        means = means + delta * n_chunk/(n+n_chunk)
+        n += n_chunk
+    return means, np.sqrt(M2/rows)
+
+
+def _row_chunks(X, chunksize):
+    """
+    Iterate over chunks of rows of X as float arrays.
+    """
+    rows = shape(X)[0]
+    for start in range(0, rows, chunksize):
+        yield np.asarray(X[start:start+chunksize], float)
 
 #}
 
@@ -508,11 +556,8 @@ def PCA_svd(X, standardize=True):
 
     (rows, cols) = shape(X)
 
-    # Singular Value Decomposition
-    [U, S, V] = svd(X)
-
-    # adjust if matrix shape does not match:
-    if shape(S)[0] < shape(U)[0]: U = U[:, 0:shape(S)[0]]
+    # Singular Value Decomposition (without the unused columns of U)
+    [U, S, V] = svd(X, full_matrices=False)
 
     Scores = U * S # all Scores (T)
     Loadings = V # all Loadings (P)
@@ -524,6 +569,136 @@ def PCA_svd(X, standardize=True):
     return Scores, Loadings, explained_var
 
 
+def PCA_randomized(X, standardize=True, PCs=10, oversamples=10, iterations=2, seed=None):
+    """
+    PCA by randomized truncated SVD and get Scores, Loadings, E
+
+    The column space of X is sampled with C{PCs+oversamples} random vectors,
+    refined with a few power iterations, and the SVD is computed in that
+    subspace only (Halko, Martinsson & Tropp 2011). Centering and scaling are
+    applied implicitly in the matrix products, so X is never copied.
+
+    @param X: 2-dimensional matrix of number data.
+    @type X: numpy array
+
+    @param standardize: Wheter X should be standardized or not.
+    @type standardize: bool
+
+    @param PCs: Number of Principal Components.
+    @type PCs: int
+
+    @param oversamples: Number of extra random vectors used to sample the column space of X.
+    @type oversamples: int
+
+    @param iterations: Number of power iterations (more are needed if the singular values decay slowly).
+    @type iterations: int
+
+    @param seed: Seed for the random number generator.
+    @type seed: int
+
+    @return: (Scores, Loadings, explained_var)
+
+    """
+    (rows, cols) = shape(X)
+    means, scales, total = _scaling(X, standardize)
+    shift = means / scales
+
+    def dot(B): # standardized X times B
+        return np.dot(X, B / scales[:,None]) - np.dot(shift, B)
+
+    def tdot(C): # transpose of standardized X times C
+        return np.dot(transpose(X), C) / scales[:,None] - np.outer(shift, C.sum(0))
+
+    PCs = min(PCs, rows, cols)
+    samples = min(PCs + oversamples, rows, cols)
+
+    Q = dot(np.random.RandomState(seed).normal(size=(cols, samples)))
+    for i in range(iterations):
+        Q = qr(Q)[0]
+        Q = dot(qr(tdot(Q))[0])
+    Q = qr(Q)[0]
+
+    [U, S, V] = svd(transpose(tdot(Q)), full_matrices=False)
+
+    Scores = np.dot(Q, U[:, :PCs]) * S[:PCs] # all Scores (T)
+    Loadings = V[:PCs] # all Loadings (P)
+    explained_var = S[:PCs]**2 / total
+
+    return Scores, Loadings, explained_var
+
+
+def PCA_incremental(X, standardize=True, PCs=10, oversamples=10, chunksize=10000):
+    """
+    PCA by incremental SVD over chunks of rows and get Scores, Loadings, E
+
+    X is read three times in chunks of C{chunksize} rows: once for the column
+    means and standard deviations, once to update a truncated SVD (Ross et al.
+    2008), and once to project the rows on the loadings. Apart from the
+    scores, the memory needed is independent of the number of rows, so X can
+    be a C{numpy.memmap} or a FITS table column that does not fit in memory.
+
+    The SVD keeps C{PCs+oversamples} components and is updated with blocks of
+    twice as many rows, so each update costs O((PCs+oversamples)^2 M) for M
+    columns. The result is exact when the rank of X does not exceed
+    C{PCs+oversamples}, and otherwise approximates the leading components.
+
+    @param X: 2-dimensional matrix of number data (anything that can be sliced in rows).
+    @type X: numpy array
+
+    @param standardize: Wheter X should be standardized or not.
+    @type standardize: bool
+
+    @param PCs: Number of Principal Components.
+    @type PCs: int
+
+    @param oversamples: Number of extra components kept while updating the SVD.
+    @type oversamples: int
+
+    @param chunksize: Number of rows read at once.
+    @type chunksize: int
+
+    @return: (Scores, Loadings, explained_var)
+
+    """
+    (rows, cols) = shape(X)
+    means, scales, total = _scaling(X, standardize, chunksize)
+    PCs = min(PCs, rows, cols)
+    kept = PCs + oversamples
+    block = 2 * kept
+
+    S = zeros(0)
+    V = zeros((0, cols))
+    for chunk in _row_chunks(X, chunksize):
+        chunk = (chunk - means) / scales
+        for start in range(0, len(chunk), block):
+            [U, S, V] = svd(np.vstack([S[:,None] * V, chunk[start:start+block]]), full_matrices=False)
+            S, V = S[:kept], V[:kept]
+    S, V = S[:PCs], V[:PCs]
+
+    Scores = zeros((rows, len(S)), float) # all Scores (T)
+    for start, chunk in zip(range(0, rows, chunksize), _row_chunks(X, chunksize)):
+        Scores[start:start+len(chunk)] = np.dot((chunk - means) / scales, transpose(V))
+    Loadings = V # all Loadings (P)
+    explained_var = S**2 / total
+
+    return Scores, Loadings, explained_var
+
+
+def _scaling(X, standardize, chunksize=10000):
+    """
+    Column means and scales of X, and the total sum of squares of the
+    centered and scaled matrix (to compute the explained variance).
+    """
+    means, STDs = column_statistics(X, chunksize)
+    if standardize:
+        if np.any(STDs == 0): raise ZeroDivisionError('division by zero, cannot proceed')
+        scales = STDs
+    else:
+        scales = np.ones_like(STDs)
+    total = shape(X)[0] * sum((STDs / scales)**2)
+    return means, scales, total
+
+
 #}
 
 #{ Correlation Loadings
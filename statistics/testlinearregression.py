@@ -621,6 +621,87 @@ class LinearSubmodelGeneratorTestCase(unittest.TestCase):
 
 
 
+class LinearSubmodelRankingTestCase(unittest.TestCase):
+
+    """
+    Test the LinearModel.rankSubmodels() method
+    """
+
+    def setUp(self):
+
+       np.random.seed(1111)
+       self.nObservations = 50
+       self.x = np.linspace(0.0, 5.0, self.nObservations)
+       x = self.x   # local shorter alias
+       self.observations = 1.0 + 0.5 * x**2 + 2.0 * np.sin(3*x) + np.random.normal(0.0, 0.3, self.nObservations)
+       self.linearModel = LinearModel([np.ones_like(x), x, x**2, x**3, np.sin(3*x), np.cos(3*x)],
+                                      ["1", "x", "x^2", "x^3", "sin(3x)", "cos(3x)"])
+
+
+    def tearDown(self):
+       pass
+
+
+    def bruteForce(self, criterion, **kwargs):
+
+        # Fit every submodel with a new LinearModel
+
+        results = []
+        for model in self.linearModel.submodels(**kwargs):
+            fit = model.fitData(self.observations)
+            value = dict(BIC=fit.BICvalue, AIC=fit.AICvalue, Fstatistic=fit.Fstatistic)[criterion]()
+            results.append((criterion == "Fstatistic" and -value or value, model.regressorNames(), fit))
+        return sorted(results, key=lambda result: result[0])
+
+
+    def testRankSubmodels(self):
+
+        for criterion in ["BIC", "AIC", "Fstatistic"]:
+            expected = self.bruteForce(criterion, Nmin=1, nested=False)
+            best = self.linearModel.rankSubmodels(self.observations, criterion=criterion, top=10, nested=False)
+            self.assertEqual(len(best), 10)
+            for submodel,(value,names,fit) in zip(best, expected):
+                self.assertEqual(submodel["names"], names)
+                self.assertTrue(np.allclose(submodel["coefficients"], fit.regressionCoefficients(), rtol=1.0e-8, atol=1.e-10))
+                self.assertAlmostEqual(submodel["sumSqResiduals"], fit.sumSqResiduals(), places=8)
+                self.assertAlmostEqual(submodel["BIC"], fit.BICvalue(), places=8)
+                self.assertAlmostEqual(submodel["AIC"], fit.AICvalue(), places=8)
+                self.assertAlmostEqual(submodel["Fstatistic"] / fit.Fstatistic(), 1.0, places=8)
+                self.assertTrue(isinstance(submodel["model"], LinearModel))
+
+
+    def testRankNestedSubmodels(self):
+
+        ranks = [0,1,1,2,3,3]
+        expected = self.bruteForce("BIC", Nmin=2, nested=True, ranks=ranks)
+        best = self.linearModel.rankSubmodels(self.observations, top=10, Nmin=2, nested=True, ranks=ranks)
+        self.assertEqual([submodel["names"] for submodel in best], [names for value,names,fit in expected])
+
+
+    def testRankSubmodelsInParallel(self):
+
+        best1 = self.linearModel.rankSubmodels(self.observations, top=20, nested=False, threads=1)
+        best2 = self.linearModel.rankSubmodels(self.observations, top=20, nested=False, threads=2)
+        self.assertEqual([submodel["indices"] for submodel in best1], [submodel["indices"] for submodel in best2])
+        self.assertTrue(np.allclose([submodel["BIC"] for submodel in best1], [submodel["BIC"] for submodel in best2]))
+
+
+    def testRankDegenerateSubmodels(self):
+
+        # The last regressor is a linear combination of the first two
+
+        x = self.x
+        linearModel = LinearModel([np.ones_like(x), x, x**2, 2.0 + 3.0*x], ["1", "x", "x^2", "2+3x"])
+        best = linearModel.rankSubmodels(self.observations, top=15, nested=False)
+        for submodel in best:
+            fit = submodel["model"].fitData(self.observations)
+            self.assertAlmostEqual(submodel["sumSqResiduals"], fit.sumSqResiduals(), places=8)
+            self.assertTrue(np.allclose(submodel["Fstatistic"], fit.Fstatistic(), rtol=1.0e-8, atol=1.e-8))
+
+
+
+
+
 class LinearFitTestCase(unittest.TestCase):
 
     """
@@ -955,6 +1036,7 @@ suite += unittest.TestLoader().loadTestsFromTestCase(WeightedPolynomialModelTest
 suite += unittest.TestLoader().loadTestsFromTestCase(HarmonicModelTestCase)
 suite += unittest.TestLoader().loadTestsFromTestCase(WeightedHarmonicModelTestCase)
 suite += unittest.TestLoader().loadTestsFromTestCase(LinearSubmodelGeneratorTestCase)
+suite += unittest.TestLoader().loadTestsFromTestCase(LinearSubmodelRankingTestCase)
 suite += unittest.TestLoader().loadTestsFromTestCase(LinearFitTestCase)
 suite += unittest.TestLoader().loadTestsFromTestCase(WeightedLinearFitTestCase)
 
@@ -0,0 +1,110 @@
+"""
+Unit tests covering pca.py
+"""
+
+
+import unittest
+import os
+import tempfile
+import numpy as np
+from .pca import mean_center, standardization, column_statistics, PCA_svd, PCA_randomized, PCA_incremental
+
+
+
+class PCATestCase(unittest.TestCase):
+
+    """
+    Compare the truncated PCA backends with the full SVD.
+    """
+
+    def setUp(self):
+
+        # Matrix of rank 5 plus a little noise, with different column offsets and scales
+
+        np.random.seed(1)
+        self.rows, self.cols, self.rank = 2000, 40, 5
+        basis = np.random.normal(size=(self.rank, self.cols)) * np.arange(self.rank, 0, -1)[:,None]
+        coeffs = np.random.normal(size=(self.rows, self.rank))
+        self.X = np.dot(coeffs, basis) + 1.e-3 * np.random.normal(size=(self.rows, self.cols))
+        self.X = self.X * np.linspace(1., 3., self.cols) + np.linspace(-10., 10., self.cols)
+
+
+
+    def assertSameComponents(self, reference, result, PCs, rtol):
+        """
+        Compare (Scores, Loadings, explained_var) up to the sign of each component.
+        """
+        signs = np.sign(np.sum(reference[1][:PCs] * result[1], axis=1))
+        self.assertTrue(np.allclose(reference[2][:PCs], result[2], rtol=rtol, atol=0))
+        self.assertTrue(np.allclose(reference[1][:PCs], signs[:,None] * result[1], rtol=0, atol=rtol))
+        scale = np.abs(reference[0][:,:PCs]).max()
+        self.assertTrue(np.allclose(reference[0][:,:PCs], signs * result[0], rtol=0, atol=rtol*scale))
+
+
+
+    def testPreprocessing(self):
+        """
+        mean_center() and standardization() on the whole matrix, column_statistics() in chunks
+        """
+
+        centered = mean_center(self.X)
+        self.assertTrue(np.allclose(centered.mean(0), 0.0))
+        self.assertTrue(np.allclose(standardization(centered).std(0), 1.0))
+
+        means, stds = column_statistics(self.X, chunksize=333)
+        self.assertTrue(np.allclose(means, self.X.mean(0), rtol=1.e-12))
+        self.assertTrue(np.allclose(stds, self.X.std(0), rtol=1.e-12))
+
+        X = self.X.copy()
+        X[:,3] = 1.0
+        self.assertRaises(ZeroDivisionError, standardization, X)
+        self.assertRaises(ZeroDivisionError, PCA_randomized, X)
+        self.assertRaises(ZeroDivisionError, PCA_incremental, X)
+
+
+
+    def testRandomized(self):
+        """
+        PCA_randomized() versus PCA_svd()
+        """
+
+        for standardize in [True, False]:
+            reference = PCA_svd(self.X, standardize=standardize)
+            result = PCA_randomized(self.X, standardize=standardize, PCs=self.rank, seed=3)
+            self.assertEqual(result[0].shape, (self.rows, self.rank))
+            self.assertEqual(result[1].shape, (self.rank, self.cols))
+            self.assertSameComponents(reference, result, self.rank, 1.e-6)
+
+
+
+    def testIncremental(self):
+        """
+        PCA_incremental() versus PCA_svd(), also from a memory mapped file
+        """
+
+        for standardize in [True, False]:
+            reference = PCA_svd(self.X, standardize=standardize)
+            result = PCA_incremental(self.X, standardize=standardize, PCs=self.rank, chunksize=150)
+            self.assertSameComponents(reference, result, self.rank, 1.e-6)
+
+        # Out-of-core matrix
+
+        handle, filename = tempfile.mkstemp(suffix='.dat')
+        os.close(handle)
+        try:
+            X = np.memmap(filename, dtype=float, mode='w+', shape=self.X.shape)
+            X[:] = self.X
+            X.flush()
+            X = np.memmap(filename, dtype=float, mode='r', shape=self.X.shape)
+            result = PCA_incremental(X, PCs=self.rank, chunksize=256)
+            self.assertSameComponents(PCA_svd(self.X), result, self.rank, 1.e-6)
+            del X
+        finally:
+            os.remove(filename)
+
+
+
+suite = [unittest.TestLoader().loadTestsFromTestCase(PCATestCase)]
+
+allTests = unittest.TestSuite(suite)
+unittest.TextTestRunner(verbosity=2).run(allTests)
@@ -18,6 +18,9 @@ def parallel_pergram(fctn):
     Run periodogram calculations in parallel.
 
     This splits up the frequency range between f0 and fn in 'threads' parts.
+    If a frequency step df is given, every part gets its own frequencies of the
+    global grid f0+k*df (with fn included, as in the periodograms), such that
+    no frequency is computed twice.
 
     This must decorate a 'make_parallel' decorator.
     """
@@ -44,11 +47,18 @@ def parallel_pergram(fctn):
         if fctn.__name__ in ['fasper']:
             threads = 1
 
+        #-- define the start and end frequencies of each thread: on the grid
+        #   if there is one, such that the parts do not overlap
+        if kwargs.get('df',None):
+            df = kwargs['df']
+            nf = int((fn-f0)/df+0.001)+1
+            steps = np.linspace(0,nf,int(threads)+1).astype(int)
+            ranges = [(f0+start*df,f0+(end-1)*df) for start,end in zip(steps[:-1],steps[1:]) if end>start]
+        else:
+            ranges = [(f0 + i*(fn-f0) / threads,f0 +(i+1)*(fn-f0) / threads) for i in range(int(threads))]
+
         #-- distribute the periodogram calcs over different threads, and wait
-        for i in range(int(threads)):
-            #-- define new start and end frequencies
-            kwargs['f0'] = f0 + i*(fn-f0) / threads
-            kwargs['fn'] = f0 +(i+1)*(fn-f0) / threads
+        for i,(kwargs['f0'],kwargs['fn']) in enumerate(ranges):
             logger.debug("parallel: starting process %s: f=%.4f-%.4f"%(i,kwargs['f0'],kwargs['fn']))
             p = Process(target=fctn, args=myargs, kwargs=kwargs)
             p.start()
@@ -150,6 +150,8 @@ or
 Author: Pieter Degroote
 """
 import logging
+from concurrent import futures
+from multiprocessing import cpu_count
 import numpy as np
 import pylab as pl
 from ivs.sigproc import fit
@@ -371,6 +373,10 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
     residuals = signal.copy()
     frequencies = []
     stop_criteria = []
+    #-- harmonic fits on the same time points reuse their design matrix
+    model_kwargs = dict()
+    if model=='sine':
+        model_kwargs['design'] = fit.HarmonicDesign(times)
     while maxiter:
         #-- compute the next frequency from the residuals
         params,pergram,this_fit = find_frequency(times,residuals,method=method,
@@ -380,7 +386,7 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
 
         #-- do the fit including all frequencies
         frequencies.append(params['freq'][-1])
-        allparams = getattr(fit,model)(times,signal,frequencies)
+        allparams = getattr(fit,model)(times,signal,frequencies,**model_kwargs)
 
         #-- if there's a need to optimize, optimize the last n parameters
         if optimize>0:
@@ -428,7 +434,7 @@ def iterative_prewhitening(times,signal,maxiter=1000,optimize=0,method='scargle'
 
 
 def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
-                subs_av=True,full_output=False,**kwargs):
+                subs_av=True,full_output=False,chunk_size=10000000,**kwargs):
     """
     Compute a 2D periodogram.
 
@@ -437,7 +443,18 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     x are time points (length N)
     y are second axis units (e.g. wavelengths) (length NxM)
 
-    If the periodogram/wavelength combination has a large range, this script
+    For the default Scargle periodogram and sine model (without weights,
+    optimization, zooming in or SNR-based peak selection), the periodograms
+    and the sine fits of all wavelength bins are computed at once with matrix
+    operations (see L{pergrams.scargle_2D}). The wavelength bins are then
+    handled in blocks, such that the periodograms of one block contain at
+    most C{chunk_size} elements. With C{threads>1}, that many blocks are
+    computed in parallel. Other methods and models, or any keyword argument
+    the matrix version does not know (only C{f0}, C{fn}, C{df}, C{nyq_stat},
+    C{norm} and C{correlation_correction} are passed on), make
+    L{find_frequency} be called for each wavelength bin separately.
+
+    If the periodogram/wavelength combination has a large range, the latter
     can produce a B{ValueError} or B{MemoryError}. To solve this, you could
     iterate this function over a subset of wavelength bins yourself, and write
     the results to a file.
@@ -497,6 +514,9 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     >>> p = pl.subplot(224)
     >>> p = pl.errorbar(wavel,output['pars']['phase'],yerr=output['pars']['e_phase'],fmt='ro-')
 
+    @param chunk_size: maximum number of elements of the periodograms of one
+    block of wavelength bins
+    @type chunk_size: int
     @return: dict with keys C{avprof} (2D array), C{pars} (rec array), C{model} (1D array), C{pergram} (freqs,2Darray)
     @rtype: dict
     """
@@ -507,6 +527,24 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
     else:
         matrix_av = 0.
 
+    #-- all wavelength bins at once if possible: only if every keyword is one
+    #   that the matrix version handles (or one without effect when there is
+    #   no zooming in)
+    fast_keys = ['method','model','optimize','prewhiteningorder_snr',
+                 'prewhiteningorder_snr_window','model_kwargs','scale_df',
+                 'max_loops','scale_region','weights','f0','fn','df',
+                 'nyq_stat','norm','threads','correlation_correction']
+    if weights_2d is None and kwargs.get('weights') is None \
+           and not [key for key in kwargs if not key in fast_keys] \
+           and kwargs.get('method','scargle')=='scargle' \
+           and kwargs.get('model','sine')=='sine' and not kwargs.get('optimize',0) \
+           and not kwargs.get('prewhiteningorder_snr',False) and not kwargs.get('model_kwargs') \
+           and not kwargs.get('scale_df',0):
+        output = _spectrum_2D_sine(x,matrix,full_output=full_output,
+                                   chunk_size=chunk_size,**kwargs)
+        output['avprof'] = matrix_av
+        return output
+
     #-- prepare output of sine-parameters
     params = []
     freq_spectrum = []
@@ -519,8 +557,9 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
             kwargs['weights'] = weights
 
         #-- make sure output is always a tuple, in case full output was asked
-        #   we don't want iterative zoom in so set scale_df=0
-        out = find_frequency(x,signal,full_output=full_output,scale_df=0,**kwargs)
+        #   we don't want iterative zoom in unless scale_df is given
+        kwargs.setdefault('scale_df',0)
+        out = find_frequency(x,signal,full_output=full_output,**kwargs)
 
         #-- add the parameters of this wavelength bin to the list
         if full_output:
@@ -540,6 +579,123 @@ def spectrum_2D(x,y,matrix,weights_2d=None,show_progress=False,
 
     return output
 
+def _spectrum_2D_sine(times,matrix,full_output=False,chunk_size=10000000,
+                      threads=1,correlation_correction=True,**kwargs):
+    """
+    Scargle periodograms and sine fits of all columns of a matrix.
+
+    The frequency of the highest peak is determined for every column, and a
+    sine with a constant is fitted at that frequency, as L{find_frequency}
+    does without zooming in. The columns are handled in blocks of at most
+    C{chunk_size} periodogram elements, possibly in parallel threads.
+
+    @return: dict with keys C{pars} (rec array) and if C{full_output},
+    C{model} (2D array) and C{pergram} (freqs,2Darray)
+    @rtype: dict
+    """
+    pergram_kwargs = dict([(key,kwargs[key]) for key in ['f0','fn','df','nyq_stat','norm'] if key in kwargs])
+    freqs = _frequency_grid(times,matrix,**pergram_kwargs)
+    width = max(1,chunk_size//(len(freqs)+len(times)))
+    blocks = [matrix[:,i:i+width] for i in range(0,matrix.shape[1],width)]
+    logger.info('Scargle periodograms of %d wavelength bins in %d block(s)'%(matrix.shape[1],len(blocks)))
+
+    def do_block(block):
+        freqs,spectra = pergrams.scargle_2D(times,block,**pergram_kwargs)
+        frequency = freqs[np.argmax(spectra,axis=0)]
+        params,mymodel = _sine_columns(times,block,frequency,
+                            correlation_correction=correlation_correction)
+        if not full_output:
+            spectra = mymodel = None
+        return params,spectra,mymodel
+
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = min(int(threads),len(blocks))
+    if threads>1:
+        with futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(do_block,blocks))
+    else:
+        results = [do_block(block) for block in blocks]
+
+    #-- prepare output
+    output = {}
+    output['pars'] = np.hstack([result[0] for result in results]).view(np.recarray)
+    if full_output:
+        output['pergram'] = freqs,np.hstack([result[1] for result in results])
+        output['model'] = np.hstack([result[2] for result in results])
+    return output
+
+@defaults_pergram
+def _frequency_grid(times,signal,f0=None,fn=None,df=None,**kwargs):
+    """
+    Frequencies at which the periodograms are computed.
+    """
+    nf = int((fn-f0)/df+0.001)+1
+    return f0 + np.arange(nf)*df
+
+def _sine_columns(times,matrix,freq,correlation_correction=True,limit=10000):
+    """
+    Fit a sine with a constant to every column of a matrix.
+
+    Every column has its own frequency. The parameters and their errors are
+    the same as those of L{fit.sine} and L{fit.e_sine} for a single frequency.
+
+    @param times: time points
+    @type times: numpy array (N)
+    @param matrix: observations, one signal per column
+    @type matrix: numpy array (N x M)
+    @param freq: frequency of every column
+    @type freq: numpy array (M)
+    @return: parameters and errors, model
+    @rtype: record array (M), array (N x M)
+    """
+    Ndata = len(times)
+    T = times.ptp()
+    arg = 2*np.pi*times[:,None]*freq
+    sin_,cos_ = np.sin(arg),np.cos(arg)
+
+    #-- normal equations of C + a sin(2pi f t) + b cos(2pi f t) for every column
+    ATA = np.empty((len(freq),3,3))
+    ATA[:,0,0] = (sin_**2).sum(axis=0)
+    ATA[:,1,1] = (cos_**2).sum(axis=0)
+    ATA[:,2,2] = Ndata
+    ATA[:,0,1] = ATA[:,1,0] = (sin_*cos_).sum(axis=0)
+    ATA[:,0,2] = ATA[:,2,0] = sin_.sum(axis=0)
+    ATA[:,1,2] = ATA[:,2,1] = cos_.sum(axis=0)
+    ATb = np.column_stack([(sin_*matrix).sum(axis=0),(cos_*matrix).sum(axis=0),matrix.sum(axis=0)])
+    a,b,const = np.linalg.solve(ATA,ATb[:,:,None])[:,:,0].T
+    ampl = np.sqrt(a**2+b**2)
+    phase = np.arctan2(b,a)/(2*np.pi)
+    mymodel = const + a*sin_ + b*cos_
+    residuals = matrix - mymodel
+
+    #-- errors, see fit.e_sine
+    if Ndata<limit:
+        chisq = (residuals**2).sum(axis=0)
+        arg = arg + phase
+        F = [np.sin(arg),ampl*np.cos(arg),np.ones_like(arg)]
+        FTF = np.empty((len(freq),3,3))
+        for i in range(3):
+            for j in range(i,3):
+                FTF[:,i,j] = FTF[:,j,i] = (F[i]*F[j]).sum(axis=0)
+        covariance = np.linalg.inv(FTF) * (chisq / (Ndata-3))[:,None,None]
+        e_const = np.sqrt(covariance[:,2,2])
+    else:
+        e_const = np.zeros_like(const)
+    sigma_m = np.std(residuals,axis=0)
+    e_ampl = np.sqrt(2./Ndata) * sigma_m
+    e_freq = np.sqrt(6./Ndata) * 1. / (np.pi*T) * sigma_m / ampl
+    e_phase = np.sqrt(2./Ndata) * sigma_m / ampl
+    if correlation_correction:
+        rho = np.sqrt(np.maximum(1,fit.get_correlation_factor(residuals.T)))
+        e_ampl,e_freq,e_phase = e_ampl*rho,e_freq*rho,e_phase*rho
+
+    params = np.rec.fromarrays([const,ampl,freq,phase,e_const,e_ampl,e_freq,e_phase],
+                   names=['const','ampl','freq','phase','e_const','e_ampl','e_freq','e_phase'])
+    return params,mymodel
+
 @defaults_pergram
 def time_frequency(times,signal,window_width=None,n_windows=100,
          window='rectangular',detrend=None,**kwargs):
@@ -554,6 +710,15 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
 
     Extra kwargs go to L{find_frequency}
 
+    For the default Scargle periodogram and sine model (without detrending,
+    weights, optimization, zooming in or SNR-based peak selection), the
+    periodograms of all slices are computed at once with
+    L{pergrams.scargle_windows}, which does not recompute the trigonometric
+    terms of time points shared by overlapping slices. The sine fits are still
+    done per slice. Any other keyword argument (the fast version only knows
+    C{f0}, C{fn}, C{df}, C{nyq_stat}, C{norm} and C{correlation_correction})
+    makes L{find_frequency} be called for each slice separately.
+
     @param n_windows: number of slices
     @type n_windows: integer
     @param window_width: width of each slice (defaults to T/20)
@@ -577,6 +742,22 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
     df = kwargs.pop('df')
     nyq_stat = kwargs.pop('nyq_stat',fn)
 
+    #-- all periodograms at once if possible: only if every keyword is one
+    #   that the fast version handles (or one without effect when there is
+    #   no zooming in)
+    fast_keys = ['method','model','optimize','prewhiteningorder_snr',
+                 'prewhiteningorder_snr_window','model_kwargs','scale_df',
+                 'max_loops','scale_region','weights','norm',
+                 'correlation_correction']
+    if detrend is None and kwargs.get('weights',None) is None \
+           and not [key for key in kwargs if not key in fast_keys] \
+           and kwargs.get('method','scargle')=='scargle' \
+           and kwargs.get('model','sine')=='sine' and not kwargs.get('optimize',0) \
+           and not kwargs.get('prewhiteningorder_snr',False) and not kwargs.get('model_kwargs') \
+           and not kwargs.get('scale_df',0):
+        return _time_frequency_scargle(times,signal,stft_times,window_width,f0=f0,
+                                       fn=fn,df=df,nyq_stat=nyq_stat,**kwargs)
+
     #-- prepare arrays for parameters, points and spectrum
     pars = []
     pnts = np.zeros(n_windows)
@@ -590,7 +771,8 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
             times_,signal_ = detrend(times_,signal_)
         pnts[i] = len(times_)
         if len(times_)>1:
-            output = find_frequency(times_,signal_,full_output=True,f0=f0,fn=fn,df=df,nyq_stat=nyq_stat,scale_df=0,**kwargs)
+            kwargs.setdefault('scale_df',0)
+            output = find_frequency(times_,signal_,full_output=True,f0=f0,fn=fn,df=df,nyq_stat=nyq_stat,**kwargs)
             if spec is None:
                 spec = np.ones((n_windows,len(output[1][1])))
             pars.append(output[0])
@@ -614,6 +796,49 @@ def time_frequency(times,signal,window_width=None,n_windows=100,
     out['pergram']   = (output[1][0],spec)
     return out
 
+def _time_frequency_scargle(times,signal,stft_times,window_width,
+                            correlation_correction=True,**kwargs):
+    """
+    Short Time Scargle periodograms and sine fits of all slices.
+
+    The slices and the output are the same as in L{time_frequency}.
+    """
+    #-- the points of each slice, as selected in time_frequency
+    starts = np.searchsorted(times,stft_times-window_width,side='left')
+    stops = np.searchsorted(times,stft_times+window_width,side='right')
+    for i,t in enumerate(stft_times):
+        region = np.nonzero(abs(times[starts[i]:stops[i]]-t) <= (window_width/2.))[0]
+        if len(region):
+            starts[i],stops[i] = starts[i]+region[0],starts[i]+region[-1]+1
+        else:
+            stops[i] = starts[i]
+
+    pergram_kwargs = dict([(key,kwargs[key]) for key in ['f0','fn','df','nyq_stat','norm'] if key in kwargs])
+    freqs,spec = pergrams.scargle_windows(times,signal,starts,stops,**pergram_kwargs)
+
+    #-- the sine fit at the highest peak of every slice
+    pars = []
+    for i in range(len(stft_times)):
+        times_ = times[starts[i]:stops[i]]
+        signal_ = signal[starts[i]:stops[i]]
+        if len(times_)>1:
+            params = fit.sine(times_,signal_,freqs[np.argmax(spec[i])])
+            errors = fit.e_sine(times_,signal_,params,correlation_correction=correlation_correction)
+            pars.append(numpy_ext.recarr_join(params,errors))
+        else:
+            pars.append(None)
+            spec[i] = np.nan
+    #-- slices with too few points get undefined parameters
+    dtype = [mypars.dtype for mypars in pars if mypars is not None][0]
+    nanpars = np.rec.array(np.nan*np.ones(len(dtype.names)),dtype=dtype)
+    pars = [nanpars if mypars is None else mypars for mypars in pars]
+
+    out = {}
+    out['times']     = stft_times
+    out['pars']      = np.hstack(pars)
+    out['pergram']   = (freqs,spec)
+    return out
+
 #{ Convenience stop-criteria
 
 def stopcrit_scargle_prob(times,signal,modelfunc,allparams,pergram,crit_value):
@@ -127,6 +127,7 @@ from scipy import optimize
 from ivs.units import conversions
 from ivs.units.constants import *
 from ivs.coordinates import vectors
+from ivs.aux.decorators import memoized
 
 logger = logging.getLogger('IVS.KEPLER')
 
@@ -154,6 +155,10 @@ def radial_velocity(parameters,times=None,theta=None,itermax=8):
         5. inclination of the orbit (radians)
         6. systemic velocity RV0 (RV of centre of mass of system) (km/s)
 
+    The parameters can also be arrays that broadcast against the times, e.g.
+    columns of periods, eccentricities etc. to evaluate a grid of orbits in
+    one call (one row per orbit).
+
     The periastron passage T0 can be derived via x0 by calculating
 
     T0 = x0/(2pi*Freq) + times[0]
@@ -344,7 +349,7 @@ def orbit_on_sky(times,parameters,distance=None,component='primary'):
 
 
 
-def true_anomaly(M,e,itermax=8):
+def true_anomaly(M,e,itermax=8,table=None):
     """
     Calculation of true and eccentric anomaly in Kepler orbits.
 
@@ -352,28 +357,23 @@ def true_anomaly(M,e,itermax=8):
 
     See p.39 of Hilditch, 'An Introduction To Close Binary Stars'
 
+    M and e can be arrays of any shape that broadcast against each other, e.g.
+    times in a row and eccentricities in a column to evaluate a grid of orbits
+    at once. See L{eccentric_anomaly} for the solution of Kepler's equation.
+
     @parameter M: phase
-    @type M: float
+    @type M: float or array
     @parameter e: eccentricity
-    @type e: float
+    @type e: float or array
     @keyword itermax: maximum number of iterations
     @type itermax: integer
+    @keyword table: number of points in a lookup table of the eccentric
+    anomaly (only for a single eccentricity)
+    @type table: integer
     @return: eccentric anomaly (E), true anomaly (theta)
     @rtype: float,float
     """
-    #-- initial value
-    Fn = M + e*np.sin(M) + e**2/2.*np.sin(2*M)
-    #-- iterative solving of the transcendent Kepler's equation
-    for i in range(itermax):
-        F = Fn
-        Mn = F-e*np.sin(F)
-        Fn = F+(M-Mn)/(1.-e*np.cos(F))
-        keep = F!=0 #-- take care of zerodivision
-        if hasattr(F,'__iter__'):
-            if np.all(abs((Fn-F)[keep]/F[keep])<0.00001):
-                break
-        elif (abs((Fn-F)/F)<0.00001):
-            break
+    Fn = eccentric_anomaly(M,e,itermax=itermax,table=table)
     #-- relationship between true anomaly (theta) and eccentric
     #   anomalie (Fn)
     true_an = 2.*np.arctan(np.sqrt((1.+e)/(1.-e))*np.tan(Fn/2.))
@@ -381,6 +381,103 @@ def true_anomaly(M,e,itermax=8):
 
 
 
+def eccentric_anomaly(M,e,itermax=8,table=None,tol=1e-12):
+    """
+    Solve Kepler's equation M = E - e sin(E) for the eccentric anomaly E.
+
+    M and e are broadcast against each other. Starting from the guess
+    E = M + 0.85 e sign(sin M), each element is refined with the fourth order
+    iteration of Danby (1987, Celest. Mech. 40, 303), which converges in a
+    few steps for all eccentricities below 1. An element stops iterating as
+    soon as its correction is smaller than the square root of C{tol}: as the
+    iteration converges (at least) cubically, its error is then well below
+    C{tol}. Slowly converging (highly eccentric) elements thus do not keep
+    the others iterating.
+
+    For a single eccentricity, C{table} gives the number of points of a
+    lookup table of E over M in [0,pi]. The table is computed once per
+    eccentricity (and then cached) and gives a starting guess that usually
+    converges in one iteration, which pays off when the same orbit is
+    evaluated many times.
+
+    >>> E = eccentric_anomaly(np.linspace(0,2*np.pi,5),0.5)
+
+    @parameter M: mean anomaly (radians)
+    @type M: float or array
+    @parameter e: eccentricity
+    @type e: float or array
+    @keyword itermax: maximum number of iterations
+    @type itermax: integer
+    @keyword table: number of points in the lookup table (only for a single eccentricity)
+    @type table: integer
+    @keyword tol: absolute tolerance on E (radians)
+    @type tol: float
+    @return: eccentric anomaly (radians), continuous with M
+    @rtype: float or array
+    """
+    M,e = np.asarray(M,float),np.asarray(e,float)
+    #-- a single eccentricity is not expanded to the shape of M
+    if e.ndim:
+        M,e = np.broadcast_arrays(M,e)
+        e = e.ravel()
+    shape = M.shape
+    M = M.ravel()
+    #-- reduce M to [-pi,pi], and add the number of revolutions afterwards
+    revolutions = 2*np.pi*np.round(M/(2*np.pi))
+    M = M - revolutions
+    #-- starting guess
+    if table is not None:
+        if e.ndim and np.any(e!=e[0]):
+            raise ValueError('lookup table of the eccentric anomaly needs a single eccentricity')
+        M_table,E_table = _kepler_table(float(e.flat[0]),int(table))
+        E = np.sign(M)*np.interp(np.abs(M),M_table,E_table)
+    else:
+        #   (sin(M) has the sign of M in [-pi,pi])
+        E = M + 0.85*e*np.sign(M)
+    #-- iterate only on the elements that did not converge yet
+    active = np.arange(len(M))
+    for i in range(itermax):
+        if len(active)<len(M):
+            Ea,Ma = E[active],M[active]
+            ea = e[active] if e.ndim else e
+        else:
+            Ea,ea,Ma = E,e,M
+        esin,ecos = ea*np.sin(Ea),ea*np.cos(Ea)
+        f = Ea - esin - Ma
+        f1 = 1. - ecos
+        d1 = -f/f1
+        d2 = -f/(f1 + d1*esin/2.)
+        d3 = -f/(f1 + d2*esin/2. + d2**2*ecos/6.)
+        E[active] = Ea + d3
+        active = active[np.abs(d3)>np.sqrt(tol)]
+        if not len(active):
+            break
+    else:
+        logger.debug('Kepler equation did not converge for %d elements'%(len(active)))
+    E = (E + revolutions).reshape(shape)
+    if not shape:
+        E = E[()]
+    return E
+
+
+
+@memoized
+def _kepler_table(e,size):
+    """
+    Lookup table of the eccentric anomaly for one eccentricity.
+
+    @parameter e: eccentricity
+    @type e: float
+    @parameter size: number of points
+    @type size: integer
+    @return: mean anomaly on [0,pi], eccentric anomaly
+    @rtype: array,array
+    """
+    M = np.linspace(0,np.pi,size)
+    return M,eccentric_anomaly(M,e,itermax=50)
+
+
+
 
 def calculate_phase(T,e,omega,pshift=0):
     """
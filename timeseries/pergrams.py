@@ -123,7 +123,9 @@ Least-square fitting: L{gls} and L{kepler}.
 
 ]]include figure]]ivs_timeseries_pergrams_lsq.png]
 
-Phase folding techniques: L{box} and L{pdm}
+Phase folding techniques: L{box} and L{pdm}. The vectorized L{box_py} and
+L{pdm_py} fold many frequencies at once in bounded memory, and L{box_py} can
+search several ranges of transit lengths in one pass.
 
 >>> f1,a1 = box(times,signal,fn=0.35)
 >>> f2,a2 = pdm(times,signal,fn=0.35)
@@ -139,6 +141,7 @@ Phase folding techniques: L{box} and L{pdm}
 
 """
 import logging
+from multiprocessing import Pool,cpu_count
 import numpy as np
 from numpy import pi
 from scipy.special import jn
@@ -246,6 +249,169 @@ def scargle(times, signal, f0=None, fn=None, df=None, norm='amplitude',
         s1 = fact**2 * s1 * T
     return f1, s1
 
+@defaults_pergram
+def scargle_2D(times, signals, f0=None, fn=None, df=None, norm='amplitude',
+               chunk_size=1000000):
+    """
+    Scargle periodograms of many signals sampled at the same time points.
+
+    This is the (unweighted) periodogram of L{scargle}, computed for all
+    columns of C{signals} at once, e.g. all wavelength bins of a series of
+    spectra. The trigonometric terms only depend on the time points, so they
+    are computed once for all signals, and the periodograms follow from a
+    matrix product. The frequencies are handled in blocks, such that the
+    tables of trigonometric terms contain at most C{chunk_size} elements.
+
+    >>> times = np.linspace(0,10,200)
+    >>> signals = np.column_stack([np.sin(2*pi*f*times) for f in [1.,2.,3.]])
+    >>> freq,ampl = scargle_2D(times,signals,fn=5.)
+    >>> print(freq[ampl.argmax(axis=0)].round(2))
+    [1. 2. 3.]
+
+    @param times: time points
+    @type times: numpy array (N)
+    @param signals: observations, one signal per column
+    @type signals: numpy array (N x M, or N)
+    @param norm: type of normalisation
+    @type norm: str
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param chunk_size: maximum number of elements of the trigonometric tables
+    @type chunk_size: int
+    @return: frequencies, amplitude spectra (one column per signal)
+    @rtype: array, array (Nf x M, or Nf)
+    """
+    signals = np.asarray(signals,float)
+    is_1D = signals.ndim==1
+    if is_1D:
+        signals = signals[:,None]
+    n = len(times)
+    T = times.ptp()
+    nf = int((fn-f0)/df+0.001)+1
+    f1 = f0 + np.arange(nf)*df
+    s1 = np.zeros((nf,signals.shape[1]))
+
+    #-- the same sums as in the Fortran routine of scargle, for a block of
+    #   frequencies at a time
+    step = max(1,chunk_size//max(n,1))
+    for i in range(0,nf,step):
+        arg = np.fmod(2*pi*f1[i:i+step,None]*times,2*pi)
+        sin_,cos_ = np.sin(arg),np.cos(arg)
+        ss = np.dot(sin_,signals)
+        sc = np.dot(cos_,signals)
+        ss2 = (2*sin_*cos_).sum(axis=1)[:,None]
+        sc2 = (cos_**2-sin_**2).sum(axis=1)[:,None]
+        s1[i:i+step] = (sc**2*(n-sc2) + ss**2*(n+sc2) - 2*ss*sc*ss2) / (n**2-sc2**2-ss2**2)
+
+    #-- normalisation
+    fact  = np.sqrt(4./n)
+    if norm =='distribution': # statistical distribution
+        s1 /= np.var(signals,axis=0)
+    elif norm == "amplitude": # amplitude spectrum
+        s1 = fact * np.sqrt(s1)
+    elif norm == "density": # power density
+        s1 = fact**2 * s1 * T
+    if is_1D:
+        s1 = s1[:,0]
+    return f1, s1
+
+@defaults_pergram
+def scargle_windows(times, signal, starts, stops, f0=None, fn=None, df=None,
+                    norm='amplitude', anchor=256):
+    """
+    Scargle periodograms of (overlapping) slices of one timeseries.
+
+    Slice C{i} contains the points C{times[starts[i]:stops[i]]}. Each
+    periodogram is the same as L{scargle} (without weights) of that slice,
+    but the trigonometric terms of every time point are computed only once
+    for all slices. For each frequency, the terms are summed between
+    consecutive slice boundaries, and the sums over the slices follow from
+    cumulative sums of these pieces. The cost is thus independent of the
+    overlap between the slices.
+
+    As in the Fortran routine of L{scargle}, the terms of the next frequency
+    are found by rotating those of the previous one. They are recomputed
+    directly every C{anchor} frequencies to avoid accumulating round-off
+    errors.
+
+    >>> times = np.linspace(0,100,2000)
+    >>> signal = np.sin(2*pi*(1+0.01*times)*times)
+    >>> starts = np.arange(0,1500,100)
+    >>> freq,ampl = scargle_windows(times,signal,starts,starts+500,f0=0.5,fn=4.,df=0.01)
+    >>> ampl.shape
+    (15, 351)
+
+    @param times: time points
+    @type times: numpy array
+    @param signal: observations
+    @type signal: numpy array
+    @param starts: first index of every slice
+    @type starts: array of int
+    @param stops: last index (exclusive) of every slice
+    @type stops: array of int
+    @param norm: type of normalisation
+    @type norm: str
+    @param f0: start frequency
+    @type f0: float
+    @param fn: stop frequency
+    @type fn: float
+    @param df: step frequency
+    @type df: float
+    @param anchor: number of frequencies after which the trigonometric terms
+    are recomputed
+    @type anchor: int
+    @return: frequencies, amplitude spectra (one row per slice)
+    @rtype: array, array (Nslices x Nf)
+    """
+    starts = np.asarray(starts,int)
+    stops = np.asarray(stops,int)
+    nf = int((fn-f0)/df+0.001)+1
+    f1 = f0 + np.arange(nf)*df
+
+    #-- the slices consist of pieces between consecutive boundaries: the
+    #   sums over the pieces are computed for every frequency, the sums over
+    #   the slices are differences of the cumulative sums of the pieces
+    bounds = np.unique(np.hstack([starts,stops]))
+    bounds = bounds[bounds<len(times)]
+    first = np.searchsorted(bounds,starts)
+    last = np.searchsorted(bounds,stops)
+    if not len(bounds):
+        bounds = np.zeros(1,int)
+    sx = np.zeros((nf,len(bounds)+1),complex)
+    s2 = np.zeros((nf,len(bounds)+1),complex)
+    rotate = np.exp(2j*pi*df*times)
+    for k in range(nf):
+        if k%anchor==0:
+            phasor = np.exp(2j*pi*np.fmod(f1[k]*times,1.))
+        else:
+            phasor *= rotate
+        sx[k,1:] = np.add.reduceat(signal*phasor,bounds)
+        s2[k,1:] = np.add.reduceat(phasor**2,bounds)
+    sx = np.cumsum(sx,axis=1)
+    s2 = np.cumsum(s2,axis=1)
+    sx = (sx[:,last]-sx[:,first]).T
+    s2 = (s2[:,last]-s2[:,first]).T
+
+    #-- Scargle periodogram of every slice, as in the Fortran routine
+    n = (stops-starts)[:,None].astype(float)
+    ss,sc = sx.imag,sx.real
+    ss2,sc2 = s2.imag,s2.real
+    with np.errstate(invalid='ignore',divide='ignore'):
+        s1 = (sc**2*(n-sc2) + ss**2*(n+sc2) - 2*ss*sc*ss2) / (n**2-sc2**2-ss2**2)
+        fact  = np.sqrt(4./n)
+        if norm =='distribution': # statistical distribution
+            s1 /= np.array([np.var(signal[i:j]) for i,j in zip(starts,stops)])[:,None]
+        elif norm == "amplitude": # amplitude spectrum
+            s1 = fact * np.sqrt(s1)
+        elif norm == "density": # power density
+            T = np.array([times[i:j].ptp() if j>i else 0. for i,j in zip(starts,stops)])
+            s1 = fact**2 * s1 * T[:,None]
+    return f1, s1
+
 
 
 @defaults_pergram
@@ -509,7 +675,8 @@ def schwarzenberg_czerny(times, signal, f0=None, fn=None, df=None, nh=2, mode=1)
 
     return frequencies,th
 
-def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
+def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False,
+             accuracy=1e-10):
 
     """
     Computes the modulus square of the fourier transform.
@@ -518,6 +685,10 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
     The normalisation is such that a signal A*sin(2*pi*nu_0*t)
     gives power A^2 at nu=nu_0
 
+    The Fourier transform is computed with a non-uniform FFT to the given
+    accuracy (relative to the sum of the absolute values of the signal),
+    see L{nufft}. If C{accuracy} is None, it is summed directly.
+
     @param time: time points [0..Ntime-1]
     @type time: ndarray
     @param signal: signal [0..Ntime-1]
@@ -528,21 +699,26 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
     @type fn: float
     @param df: see f0
     @type df: float
+    @param accuracy: accuracy of the non-uniform FFT (None for direct sums)
+    @type accuracy: float
     @return: power spectrum of the signal
     @rtype: array
     """
 
     freqs = np.arange(f0,fn,df)
     Ntime = len(time)
-    Nfreq = int(np.ceil((fn-f0)/df))
+    Nfreq = len(freqs)
 
-    A = np.exp(1j*2.*pi*f0*time) * signal
-    B = np.exp(1j*2.*pi*df*time)
-    ft = np.zeros(Nfreq, complex)
-    ft[0] = A.sum()
-    for k in range(1,Nfreq):
-        A *= B
-        ft[k] = np.sum(A)
+    if accuracy:
+        ft = nufft(time, signal, f0, df, Nfreq, accuracy=accuracy)
+    else:
+        A = np.exp(1j*2.*pi*f0*time) * signal
+        B = np.exp(1j*2.*pi*df*time)
+        ft = np.zeros(Nfreq, complex)
+        ft[0] = A.sum()
+        for k in range(1,Nfreq):
+            A *= B
+            ft[k] = np.sum(A)
 
     if full_output:
         return freqs,ft**2*4.0/Ntime**2
@@ -550,7 +726,7 @@ def DFTpower(time, signal, f0=None, fn=None, df=None, full_output=False):
         return freqs,(ft.real**2 + ft.imag**2) * 4.0 / Ntime**2
 
 
-def DFTpower2(time, signal, freqs):
+def DFTpower2(time, signal, freqs, accuracy=1e-10):
 
     """
     Computes the power spectrum of a signal using a discrete Fourier transform.
@@ -558,21 +734,31 @@ def DFTpower2(time, signal, freqs):
     The main difference between DFTpower and DFTpower2, is that the latter allows for non-equidistant
     frequencies for which the power spectrum will be computed.
 
+    Equidistant frequencies are computed with a non-uniform FFT to the given
+    accuracy (see L{nufft}), unless C{accuracy} is None.
+
     @param time: time points, not necessarily equidistant
     @type time: ndarray
     @param signal: signal corresponding to the given time points
     @type signal: ndarray
     @param freqs: frequencies for which the power spectrum will be computed. Unit: inverse of 'time'.
     @type freqs: ndarray
+    @param accuracy: accuracy of the non-uniform FFT (None for direct sums)
+    @type accuracy: float
     @return: power spectrum. Unit: square of unit of 'signal'
     @rtype: ndarray
     """
 
-    powerSpectrum = np.zeros(len(freqs))
+    grid = accuracy and _equidistant(freqs)
 
-    for i, freq in enumerate(freqs):
-        arg = 2.0 * np.pi * freq * time
-        powerSpectrum[i] = np.sum(signal * np.cos(arg))**2 + np.sum(signal * np.sin(arg))**2
+    if grid:
+        ft = nufft(time, signal, grid[0], grid[1], len(freqs), accuracy=accuracy)
+        powerSpectrum = ft.real**2 + ft.imag**2
+    else:
+        powerSpectrum = np.zeros(len(freqs))
+        for i, freq in enumerate(freqs):
+            arg = 2.0 * np.pi * freq * time
+            powerSpectrum[i] = np.sum(signal * np.cos(arg))**2 + np.sum(signal * np.sin(arg))**2
 
     powerSpectrum = powerSpectrum * 4.0 / len(time)**2
     return(powerSpectrum)
@@ -743,13 +929,18 @@ def FFTpowerdensity(signal, timestep):
 
 
 
-def weightedpower(time, signal, weight, freq):
+def weightedpower(time, signal, weight, freq, accuracy=1e-10):
 
     """
     Compute the weighted power spectrum of a time signal.
     For each given frequency a weighted sine fit is done using
     chi-square minimization.
 
+    For equidistant frequencies, the sums in the normal equations are computed
+    with two non-uniform FFTs to the given accuracy (see L{nufft}): the
+    products of sines and cosines are written in terms of the double angle.
+    If C{accuracy} is None, they are summed directly.
+
     @param time: time points [0..Ntime-1]
     @type time: ndarray
     @param signal: observations [0..Ntime-1]
@@ -759,11 +950,33 @@ def weightedpower(time, signal, weight, freq):
     @param freq: frequencies [0..Nfreq-1] for which the power
                  needs to be computed
     @type freq: ndarray
+    @param accuracy: accuracy of the non-uniform FFT (None for direct sums)
+    @type accuracy: float
     @return: weighted power [0..Nfreq-1]
     @rtype: array
 
     """
 
+    grid = accuracy and _equidistant(freq)
+
+    if grid:
+        f0,df = grid
+        # sum(w*y*exp(i*theta)) and sum(w*exp(2*i*theta)), theta = 2*pi*f*t
+        ft1 = nufft(time, weight*signal, f0, df, len(freq), accuracy=accuracy)
+        ft2 = nufft(time, weight, 2*f0, 2*df, len(freq), accuracy=accuracy)
+        a11 = (weight.sum() - ft2.real) / 2.
+        a12 = ft2.imag / 2.
+        a22 = (weight.sum() + ft2.real) / 2.
+        b1 = ft1.imag
+        b2 = ft1.real
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denominator = a11*a22-a12*a12
+            A = (b1*a22-b2*a12)/denominator
+            B = (b2*a11-b1*a12)/denominator
+        result = A*A+B*B
+        result[freq == 0.0] = np.sum(signal)/len(signal)
+        return result
+
     result = np.zeros(len(freq))
 
     for i in range(len(freq)):
@@ -933,13 +1146,16 @@ def box(times, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75 )
     u = np.zeros(n)
     v = np.zeros(n)
 
-    #-- frequency vector and variables
-    nf = (fn-f0)/df
-    if f0<2./T: f0=2./T
+    #-- frequency vector and variables (the same grid as in the Fortran
+    #   routine, which starts at f0 in steps of df). Frequencies below 2/T are
+    #   skipped in whole steps, such that the parts computed in parallel stay
+    #   on the same grid
+    if f0<2./T: f0 += np.ceil((2./T-f0)/df)*df
+    nf = int((fn-f0)/df + 0.001) + 1
 
     #-- calculate EEBLS spectrum and model parameters
     power,depth,qtran,in1,in2 = eebls.eebls(times,signal,u,v,nf,f0,df,Nbin,qmi,qma,n)
-    frequencies = np.linspace(f0,fn,nf)
+    frequencies = f0 + df*np.arange(nf)
 
     #-- to return parameters of fit, do this:
     # pars = [max_freq,depth,qtran+(1./float(nb)),(in1-1)/float(nb),in2/float(nb)]
@@ -1003,7 +1219,7 @@ def kepler(times,signal, f0=None, fn=None, df=None, e0=0., en=0.91, de=0.1,
 
 
 
-def Zwavelet(time, signal, freq, position, sigma=10.0):
+def Zwavelet(time, signal, freq, position, sigma=10.0, threads=1):
 
     """
     Weighted Wavelet Z-transform of Foster (1996)
@@ -1018,6 +1234,11 @@ def Zwavelet(time, signal, freq, position, sigma=10.0):
     Mind the max, min order for position. It's often useful to try log(Z)
     and/or different sigmas.
 
+    The weighted inner products are computed for blocks of (position,
+    frequency) pairs at once, and the 3x3 normal equations are solved in
+    closed form. Blocks of frequencies can be computed in parallel with
+    C{threads} processes ('max', 'safe' or an integer).
+
     @param time: time points [0..Ntime-1]
     @type time: ndarray
     @param signal: observed data points [0..Ntime-1]
@@ -1029,71 +1250,125 @@ def Zwavelet(time, signal, freq, position, sigma=10.0):
     @type position: ndarray
     @param sigma: smoothing parameter in time domain: sigma in Foster's paper
     @type sigma: float
+    @param threads: number of processes
+    @type threads: integer or str
     @return: Z[0..Npos-1, 0..Nfreq-1]: the Z-transform: time-freq diagram
     @rtype: array
 
     """
 
-    y = np.zeros(3)
-    S = np.zeros([3,3])
-    Z = np.zeros([len(position),len(freq)])
+    freq = np.atleast_1d(np.asarray(freq, float))
+    position = np.atleast_1d(np.asarray(position, float))
 
-    for i in range(len(position)):
+    if threads=='max':
+        threads = cpu_count()
+    elif threads=='safe':
+        threads = cpu_count()-1
+    threads = max(min(int(threads), len(freq)), 1)
 
-        tau = position[i]
-        arg = 2.0*pi*(time-tau)
+    # Split the frequencies in blocks, one per process, but never keep more
+    # than a few million weights in memory at once
 
-        for j in range(len(freq)):
+    blocksize = int(np.ceil(len(freq) / float(threads)))
+    blocksize = max(1, min(blocksize, 2**22 // len(time)))
+    blocks = [(time, signal, freq[k:k+blocksize], position, sigma)
+              for k in range(0, len(freq), blocksize)]
 
-            nu = freq[j]
+    if threads == 1:
+        Z = [_zwavelet_block(block) for block in blocks]
+    else:
+        pool = Pool(threads)
+        try:
+            Z = pool.map(_zwavelet_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
 
-            # Compute statistical weights akin the Morlet wavelet
+    # That's it!
 
-            weight = np.exp(-(time-tau)**2 * (nu / 2./sigma)**2)
-            W = np.sum(weight)
+    return np.hstack(Z)
 
-            # Compute the base functions. A 3rd base function is the constant 1.
 
-            cosine = np.cos(arg*nu)
-            sine = np.sin(arg*nu)
 
-            print(arg, nu)
-            print(sine, cosine)
+def _zwavelet_block(args):
 
-            # Compute the innerproduct of the base functions
-            # phi_0 = 1 (constant), phi_1 = cosine, phi_2 = sine
+    """
+    Weighted Wavelet Z-transform for a block of frequencies (see L{Zwavelet})
 
-            S[0,0] = 1.0
-            S[0,1] = S[1,0] = np.sum(weight * 1.0 * cosine) / W
-            S[0,2] = S[2,0] = np.sum(weight * 1.0 * sine) / W
-            S[1,1] = np.sum(weight * cosine * cosine) / W
-            S[1,2] = S[2,1] = np.sum(weight * cosine * sine) / W
-            S[2,2] = np.sum(weight * sine * sine) / W
-            print(S)
-            invS = np.linalg.inv(S)
+    @param args: time, signal, freq, position, sigma
+    @type args: tuple
+    @return: Z[0..Npos-1, 0..Nfreq-1]
+    @rtype: array
+    """
 
-            # Determine the best-fit coefficients y_k of the base functions
+    time, signal, freq, position, sigma = args
+    Z = np.zeros([len(position),len(freq)])
+    chunksize = max(1, 2**22 // (len(freq) * len(time)))
 
-            for k in range(3):
-                y[k] =   np.sum(weight * 1.0 * signal) / W * invS[k,0]     \
-                       + np.sum(weight * cosine * signal) / W * invS[k,1]  \
-                       + np.sum(weight * sine * signal) / W * invS[k,2]
+    for start in range(0, len(position), chunksize):
 
-            # Compute the best-fit model
+        # Time differences for the positions in this chunk [Npos,1,Ntime]
+        # and frequencies [1,Nfreq,1]
 
-            model = y[0] + y[1] * cosine + y[2] * sine
+        dt = (time - position[start:start+chunksize,None])[:,None,:]
+        nu = freq[None,:,None]
 
-            # Compute the weighted variation of the signal and the model functions
+        # Compute statistical weights akin the Morlet wavelet
 
-            Vsignal = np.sum(weight * signal**2) / W -  (np.sum(weight * signal) / W)**2
-            Vmodel = np.sum(weight * model**2) / W -  (np.sum(weight * model) / W)**2
+        weight = np.exp(-dt**2 * (nu / 2./sigma)**2)
+        W = weight.sum(axis=-1)
 
-            # Calculate the weighted Wavelet Z-Transform
+        # Compute the base functions. A 3rd base function is the constant 1.
 
-            Neff = W**2 / np.sum(weight**2)
-            Z[i,j] = (Neff - 3) * Vmodel / 2. / (Vsignal - Vmodel)
+        arg = 2.0*pi*dt*nu
+        cosine = np.cos(arg)
+        sine = np.sin(arg)
 
-    # That's it!
+        # Compute the innerproduct of the base functions
+        # phi_0 = 1 (constant), phi_1 = cosine, phi_2 = sine
+
+        wcos = weight * cosine
+        wsin = weight * sine
+        S01 = wcos.sum(axis=-1) / W
+        S02 = wsin.sum(axis=-1) / W
+        S11 = (wcos * cosine).sum(axis=-1) / W
+        S12 = (wcos * sine).sum(axis=-1) / W
+        S22 = (wsin * sine).sum(axis=-1) / W
+
+        # Innerproducts of the base functions with the signal
+
+        b0 = np.dot(weight, signal) / W
+        b1 = np.dot(wcos, signal) / W
+        b2 = np.dot(wsin, signal) / W
+
+        # Determine the best-fit coefficients y_k of the base functions, with
+        # the inverse of the symmetric matrix S (with S00 = 1) via its cofactors
+
+        C00 = S11*S22 - S12**2
+        C01 = S02*S12 - S01*S22
+        C02 = S01*S12 - S02*S11
+        C11 = S22 - S02**2
+        C12 = S01*S02 - S12
+        C22 = S11 - S01**2
+        det = C00 + S01*C01 + S02*C02
+
+        y0 = (C00*b0 + C01*b1 + C02*b2) / det
+        y1 = (C01*b0 + C11*b1 + C12*b2) / det
+        y2 = (C02*b0 + C12*b1 + C22*b2) / det
+
+        # Compute the weighted variation of the signal and the model functions
+        # model = y0 + y1 * cosine + y2 * sine, using the innerproducts
+
+        Vsignal = np.dot(weight, signal**2) / W - b0**2
+        Mmodel = y0 + y1*S01 + y2*S02
+        M2model = (y0**2 + y1**2*S11 + y2**2*S22
+                   + 2*y0*y1*S01 + 2*y0*y2*S02 + 2*y1*y2*S12)
+        Vmodel = M2model - Mmodel**2
+
+        # Calculate the weighted Wavelet Z-Transform
+
+        Neff = W**2 / (weight**2).sum(axis=-1)
+        Z[start:start+chunksize] = (Neff - 3) * Vmodel / 2. / (Vsignal - Vmodel)
 
     return Z
 
@@ -1104,7 +1379,8 @@ def Zwavelet(time, signal, freq, position, sigma=10.0):
 @defaults_pergram
 @parallel_pergram
 @make_parallel
-def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
+def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.,
+           chunksize=None):
 
     """
     Computes the theta-statistics to do a Phase Dispersion Minimisation.
@@ -1114,6 +1390,10 @@ def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
 
     Inclusion of linear frequency shift by Pieter Degroote (see Cuypers 1986)
 
+    The time series is folded with C{chunksize} frequencies at once, and the
+    bin statistics of all these folds are collected with C{np.bincount}. The
+    memory needed is thus set by C{chunksize} times the number of time points.
+
     @param time: time points  [0..Ntime-1]
     @type time: ndarray
     @param signal: observed data points [0..Ntime-1]
@@ -1130,6 +1410,9 @@ def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
     @type Ncover: integer
     @param D: linear frequency shift parameter
     @type D: float
+    @param chunksize: number of frequencies folded at once (default: about
+    4 million phases at once)
+    @type chunksize: integer
     @return: theta-statistic for each given frequency [0..Nfreq-1]
     @rtype: array
     """
@@ -1138,49 +1421,41 @@ def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
     Ntime = len(time)
     Nfreq = len(freq)
 
-    binsize = 1.0 / Nbin
     covershift = 1.0 / (Nbin * Ncover)
 
-    theta = np.zeros(Nfreq)
-
-    for i in range(Nfreq):
-
-        # Compute the phases in [0,1[ for all time points
-        phase = np.fmod((time - time[0]) * freq[i] + D/2.*time**2, 1.0)
+    # The theta-statistic does not depend on the mean of the signal, but
+    # the bin variances are more precise without it
 
-        # Reset the number of (shifted) bins without datapoints
+    signal = signal - signal.mean()
+    signal2 = signal**2
 
-        Nempty = 0
-
-        # Loop over all Nbin * Ncover (shifted) bins
+    theta = np.zeros(Nfreq)
+    Nempty = np.zeros(Nfreq)
 
-        for k in range(Nbin):
-            for n in range(Ncover):
+    for chunk in _frequency_chunks(Nfreq, Ntime, chunksize):
 
-                # Determine the left and right boundary of one such bin
-                # Note that due to the modulo, right may be < left. So instead
-                # of 0-----+++++------1, the bin might be 0++-----------+++1 .
+        # Compute the phases for all time points and frequencies
 
-                left = np.fmod(k * binsize + n * covershift, 1.0)
-                right = np.fmod((k+1) * binsize + n * covershift, 1.0)
+        phase = np.outer(freq[chunk], time - time[0]) + D/2.*time**2
 
-                # Select all data points in that bin
+        # Collect the number of points, the sum and the sum of squares in all
+        # Nbin * Ncover (shifted) bins. A bin may wrap around phase 1.
 
-                if (left < right):
-                    bindata = np.compress((left <= phase) & (phase < right), signal)
-                else:
-                    bindata = np.compress(~((right <= phase) & (phase < left)), signal)
+        for n in range(Ncover):
+            counts,sums,sums2 = _fold_bins(phase - n * covershift, Nbin,
+                                           signal, signal2)
 
-                # Compute the contribution of that bin to the theta-statistics
+            # Contribution of all bins to the theta-statistics: (N-1) times
+            # the variance of the bin
 
-                if (len(bindata) != 0):
-                    theta[i] += (len(bindata) - 1) * bindata.var()
-                else:
-                    Nempty += 1
+            filled = counts > 0
+            counts = np.where(filled, counts, 1)
+            theta[chunk] += ((counts - 1.) / counts**2 * (sums2 * counts - sums**2)).sum(axis=1)
+            Nempty[chunk] += (~filled).sum(axis=1)
 
-        # Normalize the theta-statistics
+    # Normalize the theta-statistics
 
-        theta[i] /= Ncover * Ntime - (Ncover * Nbin - Nempty)
+    theta /= Ncover * Ntime - (Ncover * Nbin - Nempty)
 
     # Normalize the theta-statistics again
 
@@ -1193,6 +1468,153 @@ def pdm_py(time, signal, f0=None, fn=None, df=None, Nbin=10, Ncover=5, D=0.):
 
 
 
+@defaults_pergram
+@parallel_pergram
+@make_parallel
+def box_py(time, signal, f0=None, fn=None, df=None, Nbin=10, qmi=0.005, qma=0.75,
+           chunksize=None):
+    """
+    Box-Least-Squares spectrum of Kovacs et al (2002).
+
+    Vectorized version of L{box}, with the same edge effect correction and
+    the same minimum number of points in a transit (the largest of 5 and
+    qmi times the number of points).
+
+    The time series is folded with C{chunksize} frequencies at once, and the
+    number of points and the sum of the signal in each phase bin are collected
+    with C{np.bincount}. The box fits of all widths and all starting bins then
+    follow from the cumulative sums over the (wrapped) bins.
+
+    Several ranges of fractional transit lengths can be searched in one pass
+    by giving sequences for C{qmi} and C{qma}. Then one spectrum is returned
+    per range:
+
+    >>> times = np.linspace(0,100,1000)
+    >>> signal = np.where(np.mod(times,3.)<0.1,-1.,0.)
+    >>> freq,short,long = box_py(times,signal,fn=1.,qmi=[0.01,0.1],qma=[0.1,0.3])
+
+    @param time: observation times
+    @type time: numpy 1D array
+    @param signal: observations
+    @type signal: numpy 1D array
+    @param f0: start frequency
+    @type f0: float
+    @param fn: end frequency
+    @type fn: float
+    @param df: frequency step
+    @type df: float
+    @param Nbin: number of bins in the folded time series at any test period
+    @type Nbin: integer
+    @param qmi: minimum fractional transit length to be tested
+    @type qmi: 0<float<qma<1, or a sequence of them
+    @param qma: maximum fractional transit length to be tested
+    @type qma: 0<qmi<float<1, or a sequence of them
+    @param chunksize: number of frequencies folded at once (default: about
+    4 million phases at once)
+    @type chunksize: integer
+    @return: frequencies, amplitude spectrum (one per transit length range)
+    @rtype: array,array
+    """
+    Ntime = len(time)
+    T = time.ptp()
+
+    #-- frequency vector (as in L{box})
+    if f0<2./T: f0 += np.ceil((2./T-f0)/df)*df
+    Nfreq = int((fn-f0)/df + 0.001) + 1
+    freq = f0 + df*np.arange(Nfreq)
+
+    #-- range of box widths (in bins) and minimum number of points per range
+    qmi,qma = np.broadcast_arrays(np.atleast_1d(qmi),np.atleast_1d(qma))
+    kmi = np.maximum((qmi*Nbin).astype(int),1)
+    kma = (qma*Nbin).astype(int) + 1
+    kkmi = np.maximum((qmi*Ntime).astype(int),5)
+
+    #-- bins are wrapped beyond Nbin such that boxes can span phase 1
+    wrapped = np.arange(Nbin+kma.max()) % Nbin
+
+    signal = signal - signal.mean()
+    power = np.zeros((len(qmi),Nfreq))
+
+    for chunk in _frequency_chunks(Nfreq, Ntime, chunksize):
+        phase = np.outer(freq[chunk], time - time[0])
+        counts,sums = _fold_bins(phase, Nbin, signal)
+
+        #-- cumulative number of points and signal over the wrapped bins
+        cum_counts = np.zeros((len(counts),len(wrapped)+1))
+        cum_sums = np.zeros((len(counts),len(wrapped)+1))
+        np.cumsum(counts[:,wrapped],axis=1,out=cum_counts[:,1:])
+        np.cumsum(sums[:,wrapped],axis=1,out=cum_sums[:,1:])
+
+        #-- fit boxes of each width, starting in each bin
+        for width in range(kmi.min(),kma.max()+2):
+            inbox = cum_counts[:,width:width+Nbin] - cum_counts[:,:Nbin]
+            sumbox = cum_sums[:,width:width+Nbin] - cum_sums[:,:Nbin]
+            with np.errstate(divide='ignore',invalid='ignore'):
+                boxpower = sumbox**2/(inbox*(Ntime-inbox))
+            boxpower[inbox>=Ntime] = 0.
+            #   (empty boxes are excluded by the minimum number of points)
+            for i in np.flatnonzero((kmi<=width) & (width<=kma+1)):
+                best = np.where(inbox>=kkmi[i],boxpower,0.).max(axis=1)
+                power[i,chunk] = np.maximum(power[i,chunk],best)
+
+    power = np.sqrt(power)
+    return (freq,) + tuple(power)
+
+
+
+
+def _frequency_chunks(Nfreq, Ntime, chunksize=None):
+    """
+    Split a frequency grid in slices that fold at most a few million phases.
+
+    @param Nfreq: number of frequencies
+    @type Nfreq: integer
+    @param Ntime: number of time points
+    @type Ntime: integer
+    @param chunksize: number of frequencies per slice
+    @type chunksize: integer
+    @return: slices of the frequency grid
+    @rtype: generator
+    """
+    if chunksize is None:
+        chunksize = max(1,2**22//Ntime)
+    for start in range(0,Nfreq,chunksize):
+        yield slice(start,start+chunksize)
+
+
+
+def _fold_bins(phase, Nbin, *weights):
+    """
+    Number of points and weighted sums in each phase bin, for a set of folds.
+
+    Only the fractional part of the phases is used.
+
+    @param phase: phases (one row per frequency)
+    @type phase: 2D numpy array
+    @param Nbin: number of phase bins
+    @type Nbin: integer
+    @param weights: quantities to sum per bin (one value per time point)
+    @type weights: 1D numpy arrays
+    @return: number of points per bin, and the sum of each weight per bin
+    (each of shape (number of frequencies, Nbin))
+    @rtype: tuple of 2D numpy arrays
+    """
+    Nfreq,Ntime = phase.shape
+    bins = phase*Nbin
+    np.floor(bins,out=bins)
+    bins = bins.astype(int)
+    bins %= Nbin
+    bins += Nbin*np.arange(Nfreq)[:,None]
+    bins = bins.ravel()
+    output = [np.bincount(bins,minlength=Nfreq*Nbin)]
+    for weight in weights:
+        weight = np.tile(weight,Nfreq)
+        output.append(np.bincount(bins,weights=weight,minlength=Nfreq*Nbin))
+    return tuple([out.reshape(Nfreq,Nbin) for out in output])
+
+
+
+
 def fasper_py(x,y,ofac,hifac, MACC=4):
     """ function fasper
         Given abscissas x (which need not be equally spaced) and ordinates
@@ -1321,7 +1743,7 @@ def fasper_py(x,y,ofac,hifac, MACC=4):
 
 #{ Helper functions
 
-def windowfunction(time, freq):
+def windowfunction(time, freq, accuracy=1e-10):
 
     """
     Computes the modulus square of the window function of a set of
@@ -1329,10 +1751,15 @@ def windowfunction(time, freq):
     equidistant. The normalisation is such that 1.0 is returned at
     frequency 0.
 
+    Equidistant frequencies are computed with a non-uniform FFT to the given
+    accuracy (see L{nufft}), unless C{accuracy} is None.
+
     @param time: time points  [0..Ntime-1]
     @type time: ndarray
     @param freq: frequency points. Units: inverse unit of 'time' [0..Nfreq-1]
     @type freq: ndarray
+    @param accuracy: accuracy of the non-uniform FFT (None for direct sums)
+    @type accuracy: float
     @return: |W(freq)|^2      [0..Nfreq-1]
     @rtype: array
 
@@ -1340,17 +1767,111 @@ def windowfunction(time, freq):
 
     Ntime = len(time)
     Nfreq = len(freq)
-    winkernel = np.empty_like(freq)
+    grid = accuracy and _equidistant(freq)
 
-    for i in range(Nfreq):
-        winkernel[i] = np.sum(np.cos(2.0*pi*freq[i]*time))**2     \
-                     + np.sum(np.sin(2.0*pi*freq[i]*time))**2
+    if grid:
+        ft = nufft(time, np.ones(Ntime), grid[0], grid[1], Nfreq, accuracy=accuracy)
+        winkernel = ft.real**2 + ft.imag**2
+    else:
+        winkernel = np.empty_like(freq)
+        for i in range(Nfreq):
+            winkernel[i] = np.sum(np.cos(2.0*pi*freq[i]*time))**2     \
+                         + np.sum(np.sin(2.0*pi*freq[i]*time))**2
 
     # Normalise such that winkernel(nu = 0.0) = 1.0
 
     return winkernel/Ntime**2
 
 
+
+def nufft(time, weights, f0, df, Nfreq, accuracy=1e-10, chunksize=2**16):
+    """
+    Fourier sums of non-equidistant time points on an equidistant frequency grid.
+
+    Computes sum_j weights_j exp(2 pi i f_k time_j) for the frequencies
+    f_k = f0 + k*df (k=0..Nfreq-1) with a type-1 non-uniform FFT: the
+    weights are spread with a Gaussian on a twice oversampled grid, the grid is
+    Fourier transformed and the Gaussian is divided out again (Greengard & Lee
+    2004, SIAM Review 46, 443). The cost is O(Ntime*log(1/accuracy) +
+    Nfreq*log(Nfreq)) instead of O(Ntime*Nfreq) for the direct sums.
+
+    The error is C{accuracy} times the sum of the absolute weights.
+
+    >>> times = np.sort(np.random.uniform(size=1000,high=100.))
+    >>> ft = nufft(times,np.ones(1000),0.,0.001,5000)
+
+    @param time: time points [0..Ntime-1]
+    @type time: ndarray
+    @param weights: (complex) weight of each time point [0..Ntime-1]
+    @type weights: ndarray
+    @param f0: first frequency
+    @type f0: float
+    @param df: frequency step
+    @type df: float
+    @param Nfreq: number of frequencies
+    @type Nfreq: integer
+    @param accuracy: relative accuracy
+    @type accuracy: float
+    @param chunksize: number of time points spread on the grid at once
+    @type chunksize: integer
+    @return: Fourier sums [0..Nfreq-1]
+    @rtype: complex array
+    """
+    tref = time[0]
+    time = time - tref
+    half = Nfreq//2
+
+    #-- half width of the Gaussian spreading (in grid points), oversampled
+    #   grid size and width of the Gaussian
+    Msp = max(2, int(np.ceil(-np.log(accuracy)/(0.75*pi))))
+    Ngrid = 2**int(np.ceil(np.log2(max(2*Nfreq, 4*Msp))))
+    ratio = Ngrid/float(Nfreq)
+    tau = pi*Msp / (Nfreq**2 * ratio * (ratio-0.5))
+    h = 2*pi/Ngrid
+    offsets = np.arange(-Msp+1, Msp+1)
+
+    #-- spread exp(2 pi i f0 t) * exp(2 pi i half df t) * weights on the grid
+    #   at x = 2 pi df t, the frequencies are then centred around zero
+    grid = np.zeros(Ngrid, complex)
+    for start in range(0, len(time), chunksize):
+        t = time[start:start+chunksize]
+        cycles = np.mod(df*t, 1.0)
+        x = 2*pi*cycles
+        c = weights[start:start+chunksize] * np.exp(2j*pi*np.mod(f0*t + half*cycles, 1.0))
+        m = np.floor(x/h).astype(int)[:,None] + offsets
+        c = (c[:,None] * np.exp(-(x[:,None] - m*h)**2 / (4*tau))).ravel()
+        m = (m % Ngrid).ravel()
+        grid += np.bincount(m, weights=c.real, minlength=Ngrid)
+        grid += 1j*np.bincount(m, weights=c.imag, minlength=Ngrid)
+
+    #-- Fourier coefficients of the grid, deconvolved with the Gaussian
+    k = np.arange(Nfreq) - half
+    ft = np.fft.ifft(grid)[k % Ngrid] * np.sqrt(pi/tau) * np.exp(k**2 * tau)
+
+    #-- back to the original time zero point
+    freq = f0 + df*np.arange(Nfreq)
+    return ft * np.exp(2j*pi*np.mod(freq*tref, 1.0))
+
+
+
+def _equidistant(freq):
+    """
+    Start and step of a frequency array, if it is equidistant.
+
+    @param freq: frequencies
+    @type freq: ndarray
+    @return: (f0,df), or None if the frequencies are not equidistant
+    @rtype: tuple
+    """
+    freq = np.asarray(freq)
+    if len(freq) < 2:
+        return None
+    df = (freq[-1] - freq[0]) / (len(freq) - 1.)
+    if df == 0 or not np.allclose(freq, freq[0] + df*np.arange(len(freq)), rtol=0, atol=1e-9*abs(df)):
+        return None
+    return freq[0], df
+
+
 def check_input(times,signal,**kwargs):
     """
     Check the input arguments for periodogram calculations for mistakes.
@@ -0,0 +1,97 @@
+"""
+Unit test covering timeseries.freqanalyse.py
+"""
+import numpy as np
+from ivs.timeseries import freqanalyse
+
+import unittest
+try:
+    from mock import patch
+    noMock = False
+except Exception:
+    noMock = True
+
+class Spectrum2DTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0,150,100))
+        self.wavel = np.r_[4500:4520:1.0]
+        central_wave = 5*np.sin(2*np.pi/10*self.times)
+        self.matrix = 1 - 0.5*np.exp(-(self.wavel-4510-central_wave[:,None])**2/10**2)
+        self.matrix = self.matrix + np.random.normal(0,0.01,self.matrix.shape)
+
+    def testMatrixVersion(self):
+        """ timeseries.freqanalyse.spectrum_2D() matrix version """
+        output = freqanalyse.spectrum_2D(self.times,self.wavel,self.matrix,
+                           f0=0.05,fn=0.3,full_output=True,chunk_size=2000)
+        matrix = self.matrix - self.matrix.mean(axis=0)
+        for i in range(matrix.shape[1]):
+            pars,(freqs,spectrum),mymodel = freqanalyse.find_frequency(self.times,
+                         matrix[:,i],f0=0.05,fn=0.3,scale_df=0,full_output=True)
+            for name in pars.dtype.names:
+                self.assertAlmostEqual(output['pars'][name][i],pars[name][0],places=10)
+            self.assertTrue(np.allclose(output['pergram'][0],freqs))
+            self.assertTrue(np.allclose(output['pergram'][1][:,i],spectrum))
+            self.assertTrue(np.allclose(output['model'][:,i],mymodel))
+
+        output2 = freqanalyse.spectrum_2D(self.times,self.wavel,self.matrix,
+                           f0=0.05,fn=0.3,chunk_size=2000,threads=2)
+        for name in output['pars'].dtype.names:
+            self.assertTrue(np.all(output['pars'][name]==output2['pars'][name]))
+
+    @unittest.skipIf(noMock, "Mock not installed")
+    def testOtherKeywords(self):
+        """ timeseries.freqanalyse.spectrum_2D() keywords of find_frequency """
+        with patch.object(freqanalyse,'_spectrum_2D_sine') as mock_sine:
+            output = freqanalyse.spectrum_2D(self.times,self.wavel,self.matrix,
+                                             f0=0.05,fn=0.3,scale_df=0.2)
+            weights = np.ones_like(self.matrix)
+            freqanalyse.spectrum_2D(self.times,self.wavel,self.matrix,
+                                    f0=0.05,fn=0.3,weights=weights[:,0])
+            self.assertFalse(mock_sine.called)
+
+            freqanalyse.spectrum_2D(self.times,self.wavel,self.matrix,
+                                    f0=0.05,fn=0.3,scale_df=0,weights=None)
+            self.assertEqual(mock_sine.call_count,1)
+
+        self.assertEqual(len(output['pars']),len(self.wavel))
+        self.assertAlmostEqual(np.median(output['pars']['freq']),0.1,places=3)
+
+class TimeFrequencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0,100,500))
+        self.signal = np.sin(2*np.pi*0.5*self.times) + np.random.normal(0,0.3,500)
+        self.kwargs = dict(n_windows=20,window_width=20.,f0=0.1,fn=1.,df=0.005)
+
+    def testSharedSlices(self):
+        """ timeseries.freqanalyse.time_frequency() shared slices """
+        output = freqanalyse.time_frequency(self.times,self.signal,**self.kwargs)
+        #-- detrending with the identity forces the loop over the slices
+        output_ = freqanalyse.time_frequency(self.times,self.signal,
+                                detrend=lambda times,signal:(times,signal),**self.kwargs)
+        self.assertTrue(np.allclose(output['pergram'][0],output_['pergram'][0]))
+        self.assertTrue(np.allclose(output['pergram'][1],output_['pergram'][1]))
+        for name in output['pars'].dtype.names:
+            self.assertTrue(np.allclose(output['pars'][name],output_['pars'][name],
+                                        rtol=1e-10,atol=1e-12))
+
+    @unittest.skipIf(noMock, "Mock not installed")
+    def testOtherKeywords(self):
+        """ timeseries.freqanalyse.time_frequency() keywords of find_frequency """
+        with patch.object(freqanalyse,'_time_frequency_scargle') as mock_scargle:
+            output = freqanalyse.time_frequency(self.times,self.signal,
+                                                scale_df=0.2,**self.kwargs)
+            self.assertFalse(mock_scargle.called)
+            with patch.object(freqanalyse,'find_frequency') as mock_find:
+                freqanalyse.time_frequency(self.times,self.signal,bogus=1,**self.kwargs)
+                self.assertEqual(mock_find.call_args[1]['bogus'],1)
+            self.assertFalse(mock_scargle.called)
+
+            freqanalyse.time_frequency(self.times,self.signal,scale_df=0,
+                                       weights=None,**self.kwargs)
+            self.assertEqual(mock_scargle.call_count,1)
+
+        self.assertAlmostEqual(np.median(output['pars']['freq']),0.5,places=3)
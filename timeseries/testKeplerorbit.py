@@ -0,0 +1,41 @@
+"""
+Unit test covering timeseries.keplerorbit.py
+"""
+import numpy as np
+from ivs.timeseries import keplerorbit
+
+import unittest
+
+class EccentricAnomalyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.M = np.linspace(-10,10,2001)
+        self.e = np.array([0.,0.5,0.9,0.999])
+
+    def testKeplerEquation(self):
+        """ timeseries.keplerorbit.eccentric_anomaly() """
+        for e in self.e:
+            E = keplerorbit.eccentric_anomaly(self.M,e)
+            self.assertEqual(E.shape,self.M.shape)
+            self.assertTrue(np.abs(E-e*np.sin(E)-self.M).max()<1e-12,'e=%g'%(e))
+        E = keplerorbit.eccentric_anomaly(4.,0.5)
+        self.assertEqual(np.ndim(E),0)
+        self.assertAlmostEqual(E-0.5*np.sin(E),4.,places=12)
+
+    def testBroadcast(self):
+        """ timeseries.keplerorbit.eccentric_anomaly() broadcast """
+        E = keplerorbit.eccentric_anomaly(self.M[None,:],self.e[:,None])
+        self.assertEqual(E.shape,(len(self.e),len(self.M)))
+        for i,e in enumerate(self.e):
+            E_ = np.array([keplerorbit.eccentric_anomaly(M,e) for M in self.M[::50]])
+            self.assertTrue(np.allclose(E[i,::50],E_,rtol=0,atol=1e-12))
+
+    def testTable(self):
+        """ timeseries.keplerorbit.eccentric_anomaly() lookup table """
+        for e in self.e:
+            E = keplerorbit.eccentric_anomaly(self.M,e)
+            E_ = keplerorbit.eccentric_anomaly(self.M,e,table=100)
+            self.assertTrue(np.allclose(E,E_,rtol=0,atol=1e-12),'e=%g'%(e))
+        E = keplerorbit.eccentric_anomaly(self.M,np.ones_like(self.M)*0.5,table=100)
+        self.assertTrue(np.abs(E-0.5*np.sin(E)-self.M).max()<1e-12)
+        self.assertRaises(ValueError,keplerorbit.eccentric_anomaly,self.M[:4],self.e,table=100)
@@ -0,0 +1,76 @@
+"""
+Unit test covering timeseries.pergrams.py
+"""
+import numpy as np
+from ivs.timeseries import pergrams
+
+import unittest
+
+class BoxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0,100,800))
+        self.signal = np.where(np.mod(self.times,3.)<0.15,-1.,0.)
+        self.signal = self.signal + np.random.normal(0,0.1,len(self.times))
+
+    def testBoxPy(self):
+        """ timeseries.pergrams.box_py() """
+        for kwargs in [dict(),dict(Nbin=25,qmi=0.01,qma=0.1)]:
+            freq,power = pergrams.box(self.times,self.signal,fn=1.,df=0.001,**kwargs)
+            freq_,power_ = pergrams.box_py(self.times,self.signal,fn=1.,df=0.001,**kwargs)
+            self.assertTrue(np.allclose(freq,freq_,rtol=0,atol=1e-12))
+            self.assertTrue(np.allclose(power,power_,rtol=0,atol=1e-12))
+        self.assertAlmostEqual(freq_[np.argmax(power_)],1/3.,places=3)
+
+        freq,short,long = pergrams.box_py(self.times,self.signal,fn=1.,df=0.001,
+                                          qmi=[0.01,0.1],qma=[0.1,0.3])
+        freq_,short_ = pergrams.box_py(self.times,self.signal,fn=1.,df=0.001,
+                                       qmi=0.01,qma=0.1)
+        self.assertTrue(np.all(short==short_))
+
+    def testBoxPyThreads(self):
+        """ timeseries.pergrams.box_py() threads """
+        freq,power = pergrams.box_py(self.times,self.signal,f0=0.1,fn=1.05,df=0.001)
+        self.assertEqual(len(freq),951)
+        self.assertTrue(np.allclose(freq,0.1+0.001*np.arange(951),rtol=0,atol=1e-12))
+        for threads in [2,3]:
+            freq_,power_ = pergrams.box_py(self.times,self.signal,f0=0.1,fn=1.05,
+                                           df=0.001,threads=threads)
+            self.assertTrue(np.allclose(freq,freq_,rtol=0,atol=1e-12))
+            self.assertTrue(np.allclose(power,power_,rtol=0,atol=1e-12))
+
+        #-- start frequency below 2/T is skipped in steps of the same grid
+        freq,power = pergrams.box_py(self.times,self.signal,fn=1.,df=0.001)
+        freq_,power_ = pergrams.box_py(self.times,self.signal,fn=1.,df=0.001,threads=2)
+        self.assertTrue(np.allclose(freq,freq_,rtol=0,atol=1e-12))
+        self.assertTrue(np.allclose(power,power_,rtol=0,atol=1e-12))
+
+class NufftTestCase(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1111)
+        self.times = np.sort(np.random.uniform(0,100,3000))
+        self.signal = np.sin(2*np.pi*0.3*self.times) + np.random.normal(0,1,3000)
+        self.weights = np.random.uniform(0.5,1.5,3000)
+        self.freqs = 0.01 + 0.002*np.arange(5000)
+
+    def testNufft(self):
+        """ timeseries.pergrams.nufft() """
+        direct = np.exp(2j*np.pi*np.outer(self.freqs,self.times)).dot(self.weights)
+        for accuracy in [1e-6,1e-10]:
+            ft = pergrams.nufft(self.times,self.weights,0.01,0.002,5000,accuracy=accuracy)
+            error = np.abs(ft-direct).max() / np.abs(self.weights).sum()
+            self.assertTrue(error<accuracy,'error %g at accuracy %g'%(error,accuracy))
+
+    def testWindowfunction(self):
+        """ timeseries.pergrams.windowfunction() and weightedpower() """
+        window = pergrams.windowfunction(self.times,self.freqs,accuracy=None)
+        power = pergrams.weightedpower(self.times,self.signal,self.weights,
+                                       self.freqs,accuracy=None)
+        for accuracy in [1e-6,1e-10]:
+            window_ = pergrams.windowfunction(self.times,self.freqs,accuracy=accuracy)
+            power_ = pergrams.weightedpower(self.times,self.signal,self.weights,
+                                            self.freqs,accuracy=accuracy)
+            self.assertTrue(np.abs(window-window_).max()<accuracy)
+            self.assertTrue(np.abs(power-power_).max()<accuracy*np.abs(power).max())